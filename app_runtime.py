@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime
+
+from bus_app_state import BusAppStateManager
+
+
+class AppRuntime:
+    """What the app serves from, built on first use instead of when main is imported.
+
+    The static GTFS load is the slow part: load() runs it in the calling thread and
+    start_loading() in a background one; state_manager (and static_reloader) wait for it.
+    The feed fetcher and merger, whose modules import requests and the protobuf bindings,
+    are built by the first feed refresh. status() is what /readyz reports.
+    """
+
+    def __init__(self, tz, dumps=None, folders=None, realtime_url=None, recorder=None):
+        self.tz = tz
+        self.dumps = dumps
+        self.folders = folders
+        self.realtime_url = realtime_url
+        self.recorder = recorder
+        self.created_at = time.time()
+        # Per-feed / per-file timings of the first load, shown by /bus_state/static.
+        self.load_report = {}
+        self.load_error = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.static_reloader = None
+        self._state_manager = None
+        self._loaded = threading.Event()
+        self._load_lock = threading.Lock()
+        self._loader = None
+        self._client_lock = threading.Lock()
+        self._fetcher = None
+        self._feed_merger = None
+
+    @property
+    def ready(self):
+        return self._loaded.is_set()
+
+    @property
+    def loading(self):
+        return self._loader is not None and self._loader.is_alive()
+
+    @property
+    def state_manager(self):
+        return self._state_manager if self._loaded.is_set() else self.load()
+
+    def load(self):
+        """Loads the static data unless it already is and returns the state manager; raises what the load raised."""
+        with self._load_lock:
+            if not self._loaded.is_set():
+                try:
+                    self._load()
+                except Exception as e:
+                    self.load_error = f"{type(e).__name__}: {e}"
+                    raise
+        return self._state_manager
+
+    def _load(self):
+        # Imported here: the loaders pull in numpy and the snapshot code, which importing main shouldn't.
+        from gtfs_static import STATIC_DATA_FOLDERS, feed_hashes, load_static_data
+        from static_generation import StaticGeneration, StaticReloader
+
+        started = time.perf_counter()
+        folders = self.folders or STATIC_DATA_FOLDERS
+        hashes = feed_hashes(folders)
+        # Isolated: this may run on a background thread while request threads wait, so no forking here.
+        data = load_static_data(folders, hashes=hashes, report=self.load_report, isolated=True)
+        generation = StaticGeneration.from_data(data, 1, hashes, self.tz, self.dumps)
+        self._state_manager = BusAppStateManager(generation, {"vehicles": {}, "stop_index": {}, "version": 0})
+        self.static_reloader = StaticReloader(generation, self.build_static_generation,
+                                              self._state_manager.swap_generation, folders)
+        self.load_seconds = time.perf_counter() - started
+        self.loaded_at = time.time()
+        self.load_error = None
+        self._loaded.set()
+        print(f"✅ Static GTFS ready {self.loaded_at - self.created_at:.2f}s after startup "
+              f"(load {self.load_seconds:.2f}s)")
+
+    def build_static_generation(self, data, number, hashes):
+        from static_generation import StaticGeneration
+        generation = StaticGeneration.from_data(data, number, hashes, self.tz, self.dumps)
+        # Have today's departure boards ready before the generation starts serving.
+        generation.departure_boards.roll_over(datetime.now(self.tz).date())
+        return generation
+
+    def start_loading(self):
+        """Starts the static load in a background thread unless it is loaded or already loading."""
+        with self._client_lock:
+            if self._loaded.is_set() or self.loading:
+                return
+            self._loader = threading.Thread(target=self._load_in_background, daemon=True)
+            self._loader.start()
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"❌ Static GTFS load failed: {e}")
+
+    def wait(self, timeout=None):
+        """Starts the load if nothing has (or the last attempt failed) and waits up to timeout seconds for it.
+
+        Returns True once the static data is loaded.
+        """
+        if not self._loaded.is_set():
+            self.start_loading()
+            self._loaded.wait(timeout)
+        return self._loaded.is_set()
+
+    @property
+    def fetcher(self):
+        if self._fetcher is None:
+            with self._client_lock:
+                if self._fetcher is None:
+                    from feed_fetcher import FeedFetcher
+                    self._fetcher = FeedFetcher(self.realtime_url, recorder=self.recorder)
+        return self._fetcher
+
+    @property
+    def feed_merger(self):
+        if self._feed_merger is None:
+            with self._client_lock:
+                if self._feed_merger is None:
+                    from live_feed import FeedMerger
+                    self._feed_merger = FeedMerger()
+        return self._feed_merger
+
+    def fetcher_started(self):
+        """The fetcher if a refresh has built it, else None; for metrics that mustn't build it."""
+        return self._fetcher
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "loading": self.loading,
+            "error": self.load_error,
+            "started_at": self.created_at,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "ready_after_seconds": self.loaded_at - self.created_at if self.loaded_at else None,
+        }
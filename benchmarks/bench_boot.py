@@ -0,0 +1,105 @@
+"""Import cost of main and how soon a fresh server answers, with and without the static preload.
+
+First runs `python -X importtime -c "import main"` and reports the cumulative import time, the
+slowest top-level imports and whether the heavy modules (requests, protobuf, numpy, the static
+loaders) were pulled in. Then starts `gunicorn -c gunicorn.conf.py main:app` (one worker) in a
+scratch copy of static_data/ without the snapshot, so the static load parses the CSVs as on a
+first deploy, and times the first 200 from / and from /readyz. PRELOAD_STATIC=1 is the old
+boot (data loaded before the worker forks); PRELOAD_STATIC=0 serves / at once and loads behind it.
+Usage: python benchmarks/bench_boot.py [target ms for /]
+"""
+import http.client
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8766
+HEAVY = ["requests", "google.protobuf", "numpy", "gtfs_static", "static_generation", "feed_fetcher"]
+
+
+def import_times():
+    """({module: cumulative us} of everything imported, [(cumulative us, module)] imported by main itself)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    children = []
+    direct = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        times.setdefault(name, int(cumulative))
+        # A module is listed after everything it imported, one level deeper.
+        if depth == 1:
+            children.append((int(cumulative), name))
+        elif depth == 0:
+            if name == "main":
+                direct = children
+            children = []
+    return times, direct
+
+
+def status(path):
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except OSError:
+        return None
+
+
+def boot(data_dir, preload, timeout=120):
+    """(seconds to the first 200 from /, seconds to the first 200 from /readyz) after spawning gunicorn."""
+    env = dict(os.environ, WEB_CONCURRENCY="1", BIND=f"127.0.0.1:{PORT}", PRELOAD_STATIC="1" if preload else "0",
+               PYTHONPATH=ROOT, GTFS_REALTIME_URL="http://127.0.0.1:9/unreachable", FEED_INTERVAL="3600",
+               BUS_APP_SHARED_DIR=tempfile.mkdtemp(prefix="bus_app_shared_"))
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                               "main:app"], cwd=data_dir, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    home = ready = None
+    try:
+        while ready is None and time.perf_counter() - started < timeout:
+            if home is None and status("/") == 200:
+                home = time.perf_counter() - started
+            if home is not None and status("/readyz") == 200:
+                ready = time.perf_counter() - started
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(env["BUS_APP_SHARED_DIR"], ignore_errors=True)
+    return home, ready
+
+
+if __name__ == "__main__":
+    target = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 1.0
+    times, direct = import_times()
+    print(f"import main: {times['main'] / 1000:.1f} ms cumulative; slowest of its imports:")
+    for cumulative, name in sorted(direct, reverse=True)[:8]:
+        print(f"  {cumulative / 1000:7.1f} ms  {name}")
+    print("  heavy modules imported: " + (", ".join(m for m in HEAVY if m in times) or "none"))
+
+    with tempfile.TemporaryDirectory() as scratch:
+        shutil.copytree(os.path.join(ROOT, "static_data"), os.path.join(scratch, "static_data"),
+                        ignore=shutil.ignore_patterns("*.snapshot*", ".snapshots", "*.lock"))
+        for preload in (True, False):
+            # A cold start each time: nothing may reuse the snapshot the previous run wrote.
+            for name in os.listdir(os.path.join(scratch, "static_data")):
+                path = os.path.join(scratch, "static_data", name)
+                if name.startswith(".snapshots"):
+                    shutil.rmtree(path)
+                elif ".snapshot" in name:
+                    os.remove(path)
+            home, ready = boot(scratch, preload)
+            label = "PRELOAD_STATIC=1" if preload else "PRELOAD_STATIC=0"
+            verdict = "ok" if home is not None and home <= target else "MISSED"
+            print(f"{label}: / after {home:.2f}s ({verdict}, target {target:.2f}s), /readyz after {ready:.2f}s")
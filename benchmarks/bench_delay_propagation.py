@@ -0,0 +1,116 @@
+"""Delay propagation over the real static stop_times for a synthetic island-wide fleet.
+
+Every vehicle runs a random trip of the loaded schedule and reports three stops part-way
+along it, delayed by up to 10 minutes. Times the full pass (first feed, static reload), an
+incremental pass with 30% of the vehicles touched, and what the same predictions would cost
+per request if a stop board walked trips_dict[trip_id]["stop_times"] itself.
+Usage: python benchmarks/bench_delay_propagation.py [vehicles] [budget ms]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from delay_propagation import DelayPropagator, build_prediction_index
+from gtfs_static import feed_hashes, load_static_data
+from live_feed import StopTimeUpdates, Vehicle
+from stop_times_store import parse_gtfs_time
+
+
+def make_fleet(store, n_vehicles, base, seed=0):
+    """(vehicles, {vehicle_id: expected predicted arrivals}) with every vehicle on a different trip."""
+    rng = random.Random(seed)
+    vehicles = {}
+    expected = {}
+    for n, t in enumerate(rng.sample(range(len(store.trip_ids)), n_vehicles)):
+        start, end = store.trip_start[t], store.trip_start[t + 1]
+        if end - start < 5:
+            continue
+        first = rng.randrange(start, end - 3)
+        delay = rng.randrange(-60, 600)
+        rows = range(first, first + 3)
+        updates = StopTimeUpdates([store.stop_ids[store.stop_index[r]] for r in rows],
+                                  [base + store.arrival[r] + delay for r in rows], [delay] * 3,
+                                  [base + store.departure[r] + delay for r in rows], [delay] * 3)
+        vehicle_id = f"V{n}"
+        vehicles[vehicle_id] = Vehicle(vehicle_id, store.trip_ids[t], base, 35.0, 33.0, updates)
+        expected[vehicle_id] = [base + store.arrival[r] + delay for r in range(first + 3, end)
+                                if store.stop_ids[store.stop_index[r]] not in updates.stop_ids]
+    return vehicles, expected
+
+
+def per_request(trips, vehicles, stop_id):
+    """One stop's predicted arrivals computed at request time from the stop_times dicts (loops aside)."""
+    found = []
+    for vehicle in vehicles.values():
+        updates = vehicle.updates
+        delay = base = None
+        for stop_time in trips[vehicle.trip_id]["stop_times"]:
+            row = updates.index(stop_time["stop_id"])
+            if row >= 0:
+                if base is None:
+                    base = updates.arrival_time[row] - updates.arrival_delay[row] - parse_gtfs_time(stop_time["arrival_time"])
+                delay = updates.departure_delay[row]
+            elif base is not None and stop_time["stop_id"] == stop_id:
+                found.append((vehicle.vehicle_id, base + parse_gtfs_time(stop_time["arrival_time"]) + delay))
+    return found
+
+
+if __name__ == "__main__":
+    n_vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    budget = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    os.chdir(ROOT)
+    routes, stops, trips, store, shapes, service_dates = load_static_data(hashes=feed_hashes())
+    store.attach(trips)
+    tz = ZoneInfo("Asia/Nicosia")
+    base = int(datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+    vehicles, expected = make_fleet(store, n_vehicles, base)
+    print(f"{len(vehicles)} vehicles on {len(store.trip_ids)} scheduled trips, {len(store)} stop_times rows, "
+          f"budget {budget * 1000:.0f} ms")
+
+    propagator = DelayPropagator(budget=float("inf"))
+    start = time.perf_counter()
+    predictions = propagator.update(store, vehicles)
+    full = time.perf_counter() - start
+    start = time.perf_counter()
+    index = build_prediction_index(vehicles, predictions)
+    build = time.perf_counter() - start
+    print(f"  full pass:         {full * 1000:7.2f} ms, {propagator.stats['predicted_stops']} predicted stops; "
+          f"index build {build * 1000:.2f} ms")
+
+    # Every prediction is the schedule after the last reported stop shifted by its delay, loops included.
+    assert {vehicle_id: list(p.arrival_time) for vehicle_id, p in predictions.items()} == \
+        {vehicle_id: times for vehicle_id, times in expected.items() if times}
+
+    rng = random.Random(1)
+    touched = set(rng.sample(sorted(vehicles), len(vehicles) * 3 // 10))
+    moved = {vehicle_id: vehicle.moved(vehicle.timestamp + 30, vehicle.lat, vehicle.lon) if vehicle_id in touched else vehicle
+             for vehicle_id, vehicle in vehicles.items()}
+    start = time.perf_counter()
+    propagator.update(store, moved, touched)
+    incremental = time.perf_counter() - start
+    print(f"  incremental pass:  {incremental * 1000:7.2f} ms ({len(touched)} touched)")
+
+    bounded = DelayPropagator(budget=budget)
+    passes = 0
+    while True:
+        bounded.update(store, vehicles, None if passes == 0 else set())
+        passes += 1
+        print(f"  budgeted pass {passes}:   {bounded.stats['seconds'] * 1000:7.2f} ms, {bounded.stats['deferred']} deferred")
+        if not bounded.pending or passes == 10:
+            break
+
+    stop_id = max(index, key=lambda s: len(index[s]))
+    start = time.perf_counter()
+    found = per_request(trips, vehicles, stop_id)
+    walk = time.perf_counter() - start
+    start = time.perf_counter()
+    entries = index.get(stop_id, ())
+    lookup = time.perf_counter() - start
+    print(f"  stop {stop_id} ({len(entries)} predicted arrivals): per-request walk {walk * 1000:.2f} ms, "
+          f"index lookup {lookup * 1e6:.1f} us")
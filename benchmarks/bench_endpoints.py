@@ -0,0 +1,147 @@
+"""Endpoint latency percentiles, throughput and server memory while a recorded feed replays.
+
+Starts benchmarks/replay_server.py's FeedReplay in-process (a derived log unless --log is
+given), runs `gunicorn -c gunicorn.conf.py main:app` polling it every second, and drives the
+endpoints from client processes. Each client selects --stop first, so /bus_state/view goes
+through update_stop_table. Server RSS (all gunicorn processes) is sampled as each feed
+refresh goes live upstream.
+Usage: python benchmarks/bench_endpoints.py [--log recorder_dir] [--speed 60] [--clients 1 8] [--seconds 15]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_gtfs_rt_server import MockFeed, serve
+from replay_server import FeedReplay, first_payload, synthesize_log
+
+PORT = 8766
+DEFAULT_PATHS = ["/vehicle_positions", "/bus_state/view", "/stops/{stop}/departures",
+                 "/bus_stops/search?near=34.6786,33.0413&n=10"]
+
+
+def client(args):
+    index, paths, stop, seconds = args
+    conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+    headers = {"Cookie": f"bus_session=bench{index}"}
+    conn.request("GET", f"/bus_state/select_stop/{stop}", headers=headers)
+    conn.getresponse().read()
+    latencies = {path: [] for path in paths}
+    deadline = time.monotonic() + seconds
+    i = index
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        conn.request("GET", path.format(stop=stop), headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if response.status == 200:
+            latencies[path].append((time.perf_counter() - start) * 1000)
+    conn.close()
+    return latencies
+
+
+def process_tree(pid):
+    pids = [pid]
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def tree_rss_mb(pid):
+    total = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+    return total / 1e6
+
+
+def wait_until_up(timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+            conn.request("GET", "/bus_state/fetcher")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not come up")
+
+
+def percentile_line(name, latencies, seconds):
+    if len(latencies) < 2:
+        return f"  {name:<42} {len(latencies)} requests"
+    q = statistics.quantiles(latencies, n=100)
+    return (f"  {name:<42} {len(latencies) / seconds:8.0f} req/s  p50 {q[49]:7.2f}  p95 {q[94]:7.2f}  "
+            f"p99 {q[98]:7.2f} ms")
+
+
+def run(clients, args, log_path):
+    feed = MockFeed(first_payload(log_path))
+    upstream, url = serve(feed)
+    shared = tempfile.mkdtemp(prefix="bus_app_shared_")
+    env = dict(os.environ, WEB_CONCURRENCY=str(args.workers), BIND=f"127.0.0.1:{PORT}", GTFS_REALTIME_URL=url,
+               FEED_INTERVAL="1", BUS_APP_SHARED_DIR=shared)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=ROOT,
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    rss = []
+    try:
+        wait_until_up()
+        replay = FeedReplay(feed, log_path, args.speed,
+                            on_advance=lambda served: rss.append(tree_rss_mb(server.pid))).start()
+        with multiprocessing.Pool(clients) as pool:
+            start = time.perf_counter()
+            results = pool.map(client, [(i, args.paths, args.stop, args.seconds) for i in range(clients)])
+            elapsed = time.perf_counter() - start
+        replay.stop()
+    finally:
+        server.terminate()
+        server.wait()
+        upstream.shutdown()
+        shutil.rmtree(shared, ignore_errors=True)
+
+    print(f"{clients} client(s), {args.workers} worker(s), {elapsed:.1f} s, {len(rss)} feed refreshes replayed")
+    everything = []
+    for path in args.paths:
+        latencies = [ms for result in results for ms in result[path]]
+        everything.extend(latencies)
+        print(percentile_line(path.format(stop=args.stop), latencies, elapsed))
+    print(percentile_line("all", everything, elapsed))
+    if len(rss) > 1:
+        print(f"  server RSS {rss[0]:.0f} MB at the first refresh, {rss[-1]:.0f} MB at the last, "
+              f"{(rss[-1] - rss[0]) / (len(rss) - 1):+.2f} MB per refresh")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", help="feed_recorder log file or directory (default: derived)")
+    parser.add_argument("--speed", type=float, default=60)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--stop", default="7973")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = args.log or synthesize_log(tmp, refreshes=int(args.seconds * args.speed / 60) + 2)
+        for clients in args.clients:
+            run(clients, args, log_path)
@@ -0,0 +1,89 @@
+"""Parse + merge + publish time per refresh: full rebuild vs FeedMerger, on recorded feeds replayed from disk.
+
+Pass a directory of recorded GTFS-RT files to replay them in name order. Without one, a
+sequence is derived from process_scripts/gtfs-realtime: each step re-times and moves a
+fraction of the entities, the way consecutive upstream refreshes differ.
+Usage: python benchmarks/bench_feed_merge.py [recordings dir] [--refreshes N] [--changing 0.3]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bus_app_state import BusAppStateManager
+from live_feed import FeedMerger, decode_feed, parse_feed
+
+RECORDED_FEED = os.path.join(ROOT, "process_scripts", "gtfs-realtime")
+
+
+def derive_recordings(directory, refreshes, changing, seed=0):
+    rng = random.Random(seed)
+    with open(RECORDED_FEED, "rb") as f:
+        feed = parse_feed(f.read())
+    paths = []
+    for step in range(refreshes):
+        for entity in feed.entity:
+            if rng.random() >= changing:
+                continue
+            if entity.HasField("vehicle"):
+                entity.vehicle.timestamp += 60
+                entity.vehicle.position.latitude += rng.uniform(-0.002, 0.002)
+            if entity.HasField("trip_update"):
+                entity.trip_update.timestamp += 60
+                for update in entity.trip_update.stop_time_update:
+                    update.arrival.delay += 30
+                    update.arrival.time += 30
+        feed.header.timestamp += 60
+        path = os.path.join(directory, f"{step:05d}.pb")
+        with open(path, "wb") as f:
+            f.write(feed.SerializeToString())
+        paths.append(path)
+    return paths
+
+
+def replay(paths, incremental):
+    manager = BusAppStateManager({"stops": {}, "trips": {}, "routes": {}}, {})
+    merger = FeedMerger()
+    timings = []
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        start = time.perf_counter()
+        feed = parse_feed(content)
+        if incremental:
+            changes = merger.merge(feed)
+            manager.publish_feed(changes.vehicles, changes)
+        else:
+            manager.publish_feed(decode_feed(feed))
+        timings.append(time.perf_counter() - start)
+    return timings, manager.live_feed_state["vehicles"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recordings", nargs="?")
+    parser.add_argument("--refreshes", type=int, default=60)
+    parser.add_argument("--changing", type=float, default=0.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.recordings:
+            paths = sorted(os.path.join(args.recordings, name) for name in os.listdir(args.recordings))
+        else:
+            paths = derive_recordings(tmp, args.refreshes, args.changing)
+        full, full_vehicles = replay(paths, incremental=False)
+        incremental, merged_vehicles = replay(paths, incremental=True)
+
+    assert full_vehicles == merged_vehicles, "incremental merge diverged from the full rebuild"
+    print(f"{len(paths)} refreshes, {len(full_vehicles)} vehicles in the last one")
+    # The first refresh decodes everything in both modes; steady state is what matters.
+    for name, timings in (("full rebuild", full), ("incremental", incremental)):
+        steady = timings[1:] or timings
+        print(f"  {name:>12}: median {statistics.median(steady) * 1000:6.2f} ms, "
+              f"max {max(steady) * 1000:6.2f} ms per refresh (parse + merge + publish)")
@@ -0,0 +1,50 @@
+"""FeedFetcher against the local mock upstream: latency, conditional requests, retries, timeouts.
+
+Usage: python benchmarks/bench_fetcher.py [fetches per scenario]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from feed_fetcher import FeedFetcher, FeedFetchError
+from mock_gtfs_rt_server import DEFAULT_PAYLOAD, MockFeed, serve
+
+SCENARIOS = {
+    "healthy": dict(),
+    "no validators": dict(conditional=False),
+    "flaky (40% 503)": dict(fail_rate=0.4),
+    "hanging": dict(hang_rate=1.0, hang_seconds=5),
+}
+
+
+def run(name, options, payload, fetches):
+    feed = MockFeed(payload, **options)
+    server, url = serve(feed)
+    fetcher = FeedFetcher(url, connect_timeout=0.5, read_timeout=0.5, retries=2, backoff=0.05)
+    payloads, failures = 0, 0
+    start = time.perf_counter()
+    for _ in range(fetches if name != "hanging" else 2):
+        try:
+            payloads += fetcher.fetch() is not None
+        except FeedFetchError:
+            failures += 1
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    stats = fetcher.stats_snapshot()
+    print(f"{name}: {elapsed:.2f} s, {payloads} new payloads, {failures} failed fetches")
+    print(f"    requests {stats['requests']}, 304s {stats['not_modified']}, unchanged {stats['unchanged']}, "
+          f"retries {stats['retries']}, timeouts {stats['timeouts']}, errors {stats['errors']}")
+    mean = stats["mean_latency_ms"] or 0
+    print(f"    latency mean {mean:.1f} ms, max {stats['max_latency_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    fetches = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(DEFAULT_PAYLOAD, "rb") as f:
+        payload = f.read()
+    for name, options in SCENARIOS.items():
+        run(name, options, payload, fetches)
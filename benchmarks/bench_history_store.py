@@ -0,0 +1,105 @@
+"""Write throughput and query latency of history_store over several days of synthetic feeds.
+
+A fleet runs on 30 routes with one feed a minute; every vehicle moves each feed and reaches
+its next stop about every other feed, with a delay that drifts. Reports the writer's rows/s,
+what record() costs the feed refresh, the size on disk, and trail / on-time query times
+over one hour, one day and the whole range.
+Usage: python benchmarks/bench_history_store.py [days] [vehicles]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from history_store import HistoryStore
+from live_feed import FeedChanges, StopTimeUpdates, Vehicle
+
+FEED_INTERVAL = 60
+STOPS_PER_TRIP = 40
+
+
+def simulate(days, n_vehicles, start, seed=0):
+    """Yields (version, feed timestamp, FeedChanges, trips) for every feed of the range."""
+    rng = random.Random(seed)
+    trips = {}
+    state = {f"V{v}": [0, 0, rng.randrange(-60, 300)] for v in range(n_vehicles)}  # trip number, stop, delay
+    for version in range(1, days * 86400 // FEED_INTERVAL + 1):
+        ts = start + version * FEED_INTERVAL
+        vehicles = {}
+        for n, (vehicle_id, s) in enumerate(state.items()):
+            if rng.random() < 0.5:
+                s[1] += 1
+                s[2] = max(-120, s[2] + rng.randrange(-30, 45))
+                if s[1] == STOPS_PER_TRIP:
+                    s[:] = [s[0] + 1, 0, rng.randrange(-60, 300)]
+            route_id = f"R{n % 30}"
+            trip_id = f"{route_id}-{vehicle_id}-{s[0]}"
+            trips.setdefault(trip_id, {"route_id": route_id})
+            stop_id = f"S{(n % 30) * 100 + s[1]}"
+            updates = StopTimeUpdates([stop_id], [ts + 120 + s[2]], [s[2]], [ts + 150 + s[2]], [s[2]])
+            vehicles[vehicle_id] = Vehicle(vehicle_id, trip_id, ts, 35.0 + rng.random() / 10, 33.0 + rng.random() / 10,
+                                           updates)
+        yield version, ts, FeedChanges(vehicles, set(), set(vehicles), set()), trips
+
+
+def median_ms(fn, repeat=20):
+    """(first call ms, median ms, result); they differ where closed days' totals are memoized."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return times[0] * 1000, statistics.median(times) * 1000, result
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 14
+    n_vehicles = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+    start = int(time.time()) // 86400 * 86400 - days * 86400
+    end = start + days * 86400
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(directory)
+        # Written synchronously in the same batches the writer thread would commit.
+        batch = []
+        write_seconds = 0.0
+        for item in simulate(days, n_vehicles, start):
+            batch.append(item)
+            if len(batch) == 10:
+                t0 = time.perf_counter()
+                store.write(batch)
+                write_seconds += time.perf_counter() - t0
+                batch = []
+        if batch:
+            store.write(batch)
+        rows = store.stats["positions"] + store.stats["stop_events"]
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"{days} days, {n_vehicles} vehicles: {store.stats['positions']} positions, "
+              f"{store.stats['stop_events']} stop events in {len(store.partitions())} partitions, {size / 1e6:.0f} MB")
+        print(f"  writer: {rows / write_seconds:,.0f} rows/s")
+
+        live = HistoryStore(os.path.join(directory, "live"))
+        feeds = list(simulate(1, n_vehicles, end))[:200]
+        t0 = time.perf_counter()
+        for version, ts, changes, trips in feeds:
+            live.record(version, ts, changes, trips)
+        enqueue = (time.perf_counter() - t0) / len(feeds)
+        while live.pending():
+            time.sleep(0.01)
+        print(f"  record() on the feed refresh: {enqueue * 1e6:.1f} us per feed")
+
+        for label, span in (("1 hour", 3600), ("1 day", 86400), (f"{days} days", end - start)):
+            _, ms, points = median_ms(lambda: store.trail(end - span, end, vehicle_id="V7", limit=10 ** 6))
+            print(f"  trail V7, {label:>8}:       {ms:8.2f} ms ({len(points)} points)")
+        _, ms, points = median_ms(lambda: store.trail(start, end, trip_id="R7-V7-3"))
+        print(f"  trail of one trip:           {ms:8.2f} ms ({len(points)} points)")
+        for label, span in (("1 day", 86400), (f"{days} days", end - start)):
+            first, ms, stats = median_ms(lambda: store.on_time("R7", end - span, end))
+            print(f"  on-time R7, {label:>7}: first {first:8.2f} ms, then {ms:6.2f} ms "
+                  f"({stats['departures']} departures, {stats['on_time_ratio']:.0%} on time)")
+        first, ms, stats = median_ms(lambda: store.on_time("R7", start, end, stop_id="S710"))
+        print(f"  on-time R7 at one stop: first {first:7.2f} ms, then {ms:6.2f} ms ({stats['departures']} departures)")
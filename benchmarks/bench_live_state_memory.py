@@ -0,0 +1,141 @@
+"""Live vehicle state as nested dicts (the old layout) vs slotted Vehicle records with array columns.
+
+The feed is process_scripts/gtfs-realtime with its entities repeated under new vehicle ids up to
+the requested fleet size. Each layout runs in a fresh interpreter and reports the memory and
+GC-tracked objects of one decoded feed plus its stop index, a full gc.collect() with it alive,
+and the collector's pauses over a series of refreshes.
+Usage: python benchmarks/bench_live_state_memory.py [vehicles] [refreshes]
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import gc, json, os, statistics, sys, time, tracemalloc
+sys.path.insert(0, os.environ["ROOT"])
+from bus_app_state import build_stop_index
+from live_feed import decode_feed, parse_feed
+
+layout, n_vehicles, refreshes = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+
+
+def decode_entity_dicts(entity, vehicle_id=None):
+    # The decoder before Vehicle records.
+    v_info = {}
+    if entity.HasField("vehicle"):
+        v = entity.vehicle
+        vehicle_id = v.vehicle.id
+        v_info["trip_id"] = v.trip.trip_id
+        v_info["timestamp"] = int(v.timestamp)
+        v_info["current_position"] = (v.position.latitude, v.position.longitude) if v.HasField("position") else (None, None)
+    if entity.HasField("trip_update"):
+        trip = entity.trip_update
+        vehicle_id = trip.vehicle.id if trip.HasField("vehicle") else vehicle_id or "unknown"
+        v_info["trip_id"] = trip.trip.trip_id
+        v_info["timestamp"] = int(trip.timestamp)
+        v_info["stop_time_updates"] = [
+            {"stop_id": u.stop_id,
+             "arrival": {"time": u.arrival.time, "delay": u.arrival.delay},
+             "departure": {"time": u.departure.time, "delay": u.departure.delay}}
+            for u in trip.stop_time_update if u.HasField("arrival") and u.HasField("departure")]
+    return vehicle_id, v_info
+
+
+def decode_dicts(feed):
+    vehicles = {}
+    for entity in feed.entity:
+        vehicle_id, v_info = decode_entity_dicts(entity)
+        if vehicle_id:
+            vehicles.setdefault(vehicle_id, {}).update(v_info)
+    return vehicles
+
+
+def stop_index_dicts(vehicles):
+    index = {}
+    for vehicle_id, data in vehicles.items():
+        for update in data.get("stop_time_updates", []):
+            index.setdefault(update["stop_id"], []).append((vehicle_id, update))
+    return index
+
+
+def make_feed(step):
+    with open(os.path.join(os.environ["ROOT"], "process_scripts", "gtfs-realtime"), "rb") as f:
+        source = parse_feed(f.read())
+    feed = type(source)()
+    feed.header.CopyFrom(source.header)
+    copies = 0
+    while len({e.vehicle.vehicle.id or e.trip_update.vehicle.id for e in feed.entity}) < n_vehicles:
+        for src in source.entity:
+            entity = feed.entity.add()
+            entity.CopyFrom(src)
+            entity.id = f"{src.id}-{copies}"
+            if entity.HasField("vehicle"):
+                entity.vehicle.vehicle.id = f"{src.vehicle.vehicle.id}-{copies}"
+                entity.vehicle.timestamp += 60 * step
+            if entity.HasField("trip_update"):
+                entity.trip_update.vehicle.id = f"{src.trip_update.vehicle.id}-{copies}"
+                for u in entity.trip_update.stop_time_update:
+                    u.arrival.delay += 30 * step
+        copies += 1
+    return feed
+
+
+decode, index = (decode_dicts, stop_index_dicts) if layout == "dicts" else (decode_feed, build_stop_index)
+feeds = [make_feed(step) for step in range(refreshes)]
+
+gc.collect()
+objects_before = len(gc.get_objects())
+tracemalloc.start()
+vehicles = decode(feeds[0])
+stop_index = index(vehicles)
+retained = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+objects = len(gc.get_objects()) - objects_before
+updates = sum(len(entries) for entries in stop_index.values())
+
+full = []
+for _ in range(5):
+    start = time.perf_counter()
+    gc.collect()
+    full.append(time.perf_counter() - start)
+
+pauses = []
+def on_gc(phase, info, starts=[0.0]):
+    if phase == "start":
+        starts[0] = time.perf_counter()
+    else:
+        pauses.append(time.perf_counter() - starts[0])
+gc.callbacks.append(on_gc)
+start = time.perf_counter()
+for feed in feeds:
+    vehicles = decode(feed)
+    stop_index = index(vehicles)
+elapsed = time.perf_counter() - start
+gc.callbacks.remove(on_gc)
+
+print(json.dumps({"vehicles": len(vehicles), "updates": updates, "retained": retained, "objects": objects,
+                  "full_gc": statistics.median(full), "pauses": len(pauses), "pause_total": sum(pauses),
+                  "pause_max": max(pauses, default=0), "refresh": elapsed / len(feeds)}))
+"""
+
+
+def run(layout, vehicles, refreshes):
+    env = dict(os.environ, ROOT=ROOT)
+    result = subprocess.run([sys.executable, "-c", CHILD, layout, str(vehicles), str(refreshes)], env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    n_vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    refreshes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    for layout in ("dicts", "records"):
+        r = run(layout, n_vehicles, refreshes)
+        print(f"{layout:>8}: {r['vehicles']} vehicles, {r['updates']} updates: {r['retained'] / 1e6:6.2f} MB, "
+              f"{r['objects']:7d} GC-tracked objects ({r['retained'] / r['updates']:.0f} B/update)")
+        print(f"{'':>8}  full gc.collect {r['full_gc'] * 1000:6.2f} ms; {refreshes} refreshes: "
+              f"{r['refresh'] * 1000:6.1f} ms each, {r['pauses']} GC pauses, {r['pause_total'] * 1000:6.2f} ms total, "
+              f"max {r['pause_max'] * 1000:5.2f} ms")
@@ -0,0 +1,50 @@
+"""Cold CSV load of all feeds with 1 worker vs a process pool, in fresh interpreters.
+
+Runs against a scratch copy of static_data without any snapshots, so every feed is parsed.
+Worker count defaults to the CPU count; with one CPU the pool can only add overhead.
+Usage: python benchmarks/bench_parallel_load.py [runs] [workers]
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, os, resource, shutil, sys, time
+import gtfs_static
+shutil.rmtree("static_data/.snapshots", ignore_errors=True)
+if os.path.exists("static_data/bench.snapshot"):
+    os.remove("static_data/bench.snapshot")
+report = {}
+start = time.perf_counter()
+data = gtfs_static.load_static_data(snapshot_path="static_data/bench.snapshot", workers=int(sys.argv[1]), report=report)
+elapsed = time.perf_counter() - start
+slowest = max(report["feeds"], key=lambda feed: feed["seconds"])
+print(json.dumps({"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "slowest": slowest["folder"], "slowest_seconds": slowest["seconds"], "trips": len(data[2])}))
+"""
+
+
+def run(scratch, workers):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, "-c", CHILD, str(workers)], cwd=scratch, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as scratch:
+        shutil.copytree(os.path.join(ROOT, "static_data"), os.path.join(scratch, "static_data"),
+                        ignore=shutil.ignore_patterns(".snapshots", "*.snapshot", "*.lock"))
+        for n in sorted({1, workers}):
+            results = [run(scratch, n) for _ in range(runs)]
+            best = min(results, key=lambda r: r["seconds"])
+            rss = max(r["max_rss_mb"] for r in results)
+            print(f"{n:>2} workers: best {best['seconds'] * 1000:7.1f} ms, parent peak RSS {rss:6.1f} MB, "
+                  f"slowest feed {best['slowest']} {best['slowest_seconds']:.2f}s, {best['trips']} trips")
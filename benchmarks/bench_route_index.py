@@ -0,0 +1,77 @@
+"""Route lookups over the real static data for a synthetic fleet: indexes vs scanning per request.
+
+Times building RouteIndex for the merged feeds, then for a fleet running random trips compares
+what /routes/<id>/vehicles costs by scanning every vehicle through trips -> routes against the
+route_vehicles lookup, and what keeping route_vehicles in step costs per feed (30% of vehicles
+touched, 5% of them switching trips) against rebuilding it. Checks the kept index matches a rebuild.
+Usage: python benchmarks/bench_route_index.py [vehicles]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gtfs_static import feed_hashes, load_static_data
+from live_feed import StopTimeUpdates, Vehicle
+from route_index import RouteIndex, build_route_vehicles, update_route_vehicles
+
+
+def median_us(fn, repeat=50):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def scan(vehicles, trips, routes, short_name):
+    """The per-request way: every vehicle's trip resolved to its route and compared."""
+    return [vehicle_id for vehicle_id, vehicle in vehicles.items()
+            if routes.get(trips.get(vehicle.trip_id, {}).get("route_id"), {}).get("route_short_name") == short_name]
+
+
+if __name__ == "__main__":
+    n_vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    os.chdir(ROOT)
+    routes, stops, trips, store, shapes, service_dates = load_static_data(hashes=feed_hashes())
+    start = time.perf_counter()
+    index = RouteIndex(routes, trips, store)
+    build = time.perf_counter() - start
+    print(f"RouteIndex: {len(index.route_trips)} routes, {len(index.trip_routes)} trips, "
+          f"{sum(map(len, index.route_stops.values()))} route stops, {len(index.short_names)} route numbers; "
+          f"built in {build * 1000:.0f} ms")
+
+    rng = random.Random(0)
+    trip_ids = list(trips)
+    empty = StopTimeUpdates([], [], [], [], [])
+    vehicles = {f"V{n}": Vehicle(f"V{n}", trip_id, 0, 35.0, 33.0, empty)
+                for n, trip_id in enumerate(rng.sample(trip_ids, n_vehicles))}
+    route_vehicles = build_route_vehicles(vehicles, index.trip_routes)
+    busiest = max(route_vehicles, key=lambda r: len(route_vehicles[r]))
+    short_name = index.routes[busiest]["route_short_name"]
+
+    def lookup():
+        return [v for route_id in index.resolve(short_name) for v in route_vehicles.get(route_id, ())]
+
+    assert sorted(scan(vehicles, trips, routes, short_name)) == sorted(lookup())
+    print(f"{n_vehicles} vehicles, route number {short_name} ({len(lookup())} vehicles):")
+    print(f"  scan the fleet:        {median_us(lambda: scan(vehicles, trips, routes, short_name)):8.1f} us")
+    print(f"  route_vehicles lookup: {median_us(lookup):8.1f} us")
+
+    touched = set(rng.sample(sorted(vehicles), n_vehicles * 3 // 10))
+    moved = dict(vehicles)
+    for vehicle_id in touched:
+        vehicle = vehicles[vehicle_id]
+        trip_id = rng.choice(trip_ids) if rng.random() < 0.05 else vehicle.trip_id
+        moved[vehicle_id] = Vehicle(vehicle_id, trip_id, 30, vehicle.lat, vehicle.lon, empty)
+    kept = update_route_vehicles(route_vehicles, vehicles, moved, touched, index.trip_routes)
+    rebuilt = build_route_vehicles(moved, index.trip_routes)
+    assert {r: sorted(v) for r, v in kept.items()} == {r: sorted(v) for r, v in rebuilt.items()}
+    update = median_us(lambda: update_route_vehicles(route_vehicles, vehicles, moved, touched, index.trip_routes))
+    rebuild = median_us(lambda: build_route_vehicles(moved, index.trip_routes))
+    print(f"  per feed, {len(touched)} touched: update {update:.1f} us, rebuild {rebuild:.1f} us")
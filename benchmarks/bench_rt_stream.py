@@ -0,0 +1,90 @@
+"""Whole-message JSON dump (the old process_scripts/parse.py) vs the streaming converter.
+
+The input is process_scripts/gtfs-realtime with its entities repeated to the given count. Each
+mode runs in a fresh interpreter; peak RSS includes the interpreter and the mapped input file.
+Usage: python benchmarks/bench_rt_stream.py [entities] [files for the parallel run]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECORDED_FEED = os.path.join(ROOT, "process_scripts", "gtfs-realtime")
+
+CHILD = r"""
+import json, os, sys, time
+sys.path.insert(0, os.environ["ROOT"])
+mode, paths = sys.argv[1], sys.argv[2:]
+start = time.perf_counter()
+if mode == "whole":
+    from google.transit import gtfs_realtime_pb2
+    from rt_stream import entity_record
+    entities = 0
+    with open(os.devnull, "w") as out:
+        for path in paths:
+            feed = gtfs_realtime_pb2.FeedMessage()
+            with open(path, "rb") as f:
+                feed.ParseFromString(f.read())
+            records = [entity_record(entity, feed.header.timestamp) for entity in feed.entity]
+            out.write(json.dumps({"entities": records}, indent=4))
+            entities += len(records)
+else:
+    import rt_stream
+    fmt = "columnar" if mode == "columnar" else "ndjson"
+    if mode == "parallel":
+        reports = rt_stream.convert_files(paths, os.environ["OUT"], fmt)
+    else:
+        reports = [rt_stream.convert_to_file(path, os.path.join(os.environ["OUT"], "single.out"), fmt) for path in paths]
+    entities = sum(r["entities"] for r in reports)
+elapsed = time.perf_counter() - start
+# VmHWM rather than ru_maxrss, which carries over the parent's peak across exec.
+with open("/proc/self/status") as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM"))
+print(json.dumps({"seconds": elapsed, "entities": entities, "max_rss_mb": peak_kb / 1024}))
+"""
+
+
+def make_feed(path, n_entities):
+    sys.path.insert(0, ROOT)
+    from google.transit import gtfs_realtime_pb2
+    source = gtfs_realtime_pb2.FeedMessage()
+    with open(RECORDED_FEED, "rb") as f:
+        source.ParseFromString(f.read())
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.CopyFrom(source.header)
+    for i in range(n_entities):
+        entity = feed.entity.add()
+        entity.CopyFrom(source.entity[i % len(source.entity)])
+        entity.id = f"{entity.id}-{i}"
+    with open(path, "wb") as f:
+        f.write(feed.SerializeToString())
+
+
+def run(mode, paths, out):
+    env = dict(os.environ, ROOT=ROOT, OUT=out)
+    result = subprocess.run([sys.executable, "-c", CHILD, mode, *paths], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    n_entities = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_files = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "feed.pb")
+        make_feed(path, n_entities)
+        print(f"input: {n_entities} entities, {os.path.getsize(path) / 1e6:.1f} MB")
+        for mode in ("whole", "ndjson", "columnar"):
+            r = run(mode, [path], tmp)
+            print(f"{mode:>9}: {r['seconds']:6.2f}s, {r['entities'] / r['seconds']:9,.0f} entities/s, "
+                  f"peak RSS {r['max_rss_mb']:6.1f} MB")
+        paths = []
+        for i in range(n_files):
+            paths.append(os.path.join(tmp, f"feed{i}.pb"))
+            os.link(path, paths[-1])
+        out = os.path.join(tmp, "out")
+        os.makedirs(out)
+        for mode in ("ndjson", "parallel"):
+            r = run(mode, paths, out)
+            print(f"{n_files} files {mode:>8}: {r['seconds']:6.2f}s, {r['entities'] / r['seconds']:9,.0f} entities/s")
@@ -0,0 +1,95 @@
+"""Per-request serialization cost: Flask's default JSON provider vs fast_json, and cached bodies.
+
+/vehicle_positions is rendered the old way (walk the view, look every vehicle up again, encode
+with sorted keys and ASCII escapes) and the new way (position records built at publish time,
+encoded by dumps_bytes). The stop table is timed with a cold clock cache (every row formatted,
+as before) and a warm one (once per feed version). Cache hits are a ResponseCache lookup.
+Usage: python benchmarks/bench_serialization.py [vehicles] [updates per vehicle]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask
+
+import fast_json
+from bus_app_state import AppState, BusAppStateManager
+from fast_json import dumps_bytes
+from http_cache import ResponseCache
+from synthetic_feed import make_vehicles
+
+
+def old_vehicle_positions(manager, now):
+    """render_vehicle_positions before position records were reused."""
+    vehicles = []
+    for vehicle_id, info in manager.view(AppState.DEFAULT, None, now)["bus_locations"].items():
+        v = manager.live_feed_state["vehicles"].get(vehicle_id)
+        stop_ids = v.updates.stop_ids if v is not None else ()
+        vehicles.append({
+            "vehicle_id": vehicle_id,
+            "latitude": info["lat"],
+            "longitude": info["lon"],
+            "timestamp": info["timestamp"],
+            "trip_id": v.trip_id if v is not None else None,
+            "next_stop_id": stop_ids[0] if stop_ids else ""
+        })
+    return {"vehicles": vehicles}
+
+
+def per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(label, seconds, body=None):
+    size = f"{len(body) / 1024:8.1f} KiB" if body is not None else ""
+    print(f"  {label:<44} {seconds * 1e6:10.1f} us/request {size}")
+
+
+if __name__ == "__main__":
+    n_vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_updates = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    vehicles = make_vehicles(n_vehicles, n_updates)
+    manager = BusAppStateManager({"stops": {}, "trips": {}, "routes": {}}, {})
+    manager.publish_feed(vehicles)
+    default_json = Flask("bench").json
+    now = datetime.now().astimezone(manager.cyprus_tz)
+    stop_id = max(manager.live_feed_state["stop_index"], key=lambda s: len(manager.live_feed_state["stop_index"][s]))
+    repeat = 50
+
+    print(f"{n_vehicles} vehicles x {n_updates} updates (encoder: {'orjson' if fast_json.orjson else 'stdlib json'})")
+    print("/vehicle_positions")
+    old_body = default_json.dumps(old_vehicle_positions(manager, now)).encode("utf-8")
+    report("before: re-walk view + Flask default JSON",
+           per_call(lambda: default_json.dumps(old_vehicle_positions(manager, now)).encode("utf-8"), repeat), old_body)
+    new_body = dumps_bytes({"vehicles": list(manager.current_positions().values())})
+    report("after: position records + dumps_bytes",
+           per_call(lambda: dumps_bytes({"vehicles": list(manager.current_positions().values())}), repeat), new_body)
+
+    print(f"stop table ({len(manager.live_feed_state['stop_index'][stop_id])} live arrivals)")
+
+    def cold_table():
+        manager._clock_texts = {}
+        return manager.update_stop_table(stop_id, now)
+
+    table = cold_table()
+    report("before: strftime per row + Flask default JSON",
+           per_call(lambda: default_json.dumps(cold_table()).encode("utf-8"), repeat),
+           default_json.dumps(table).encode("utf-8"))
+    report("after: clock() once per version + dumps_bytes",
+           per_call(lambda: dumps_bytes(manager.update_stop_table(stop_id, now)), repeat), dumps_bytes(table))
+
+    print("response cache")
+    cache = ResponseCache()
+    epoch = manager.view_epoch(now)
+    cache.get_or_render("vehicle_positions", (AppState.DEFAULT, None), epoch, lambda: new_body)
+    report("hit (any endpoint)",
+           per_call(lambda: cache.get_or_render("vehicle_positions", (AppState.DEFAULT, None), epoch,
+                                                lambda: new_body), repeat * 100))
@@ -0,0 +1,74 @@
+"""Per-tick cost of positioning approaching buses: the old per-vehicle straight line vs the batched shape interpolator.
+
+Legs are built from real trips: each bus sits near one of its trip's stops and heads for a stop
+a few positions later. "first tick" includes snapping every fix onto its shape; later ticks
+reuse the snaps until the feed brings a new fix.
+Usage: python benchmarks/bench_shape_interpolation.py [vehicles ...]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bus_app_state import BusAppStateManager
+from gtfs_static import load_static_data
+from shape_store import ShapeInterpolator
+
+
+def make_legs(static_data, n_vehicles, rng, fix_time=1_000_000):
+    trips = [t for t in static_data["trips"].values()
+             if t.get("shape_id") in static_data["shapes"] and len(t.get("stop_times", ())) > 6]
+    legs = []
+    for n in range(n_vehicles):
+        trip = rng.choice(trips)
+        rows = trip["stop_times"]
+        k = rng.randrange(len(rows) - 5)
+        stop = static_data["stops"][rows[k]["stop_id"]]
+        pos = (float(stop["stop_lat"]) + rng.uniform(-0.0003, 0.0003), float(stop["stop_lon"]) + rng.uniform(-0.0003, 0.0003))
+        legs.append((f"bus{n}", trip["trip_id"], pos, fix_time, rows[k + rng.randint(1, 4)]["stop_id"],
+                     fix_time + rng.randint(60, 900)))
+    return legs
+
+
+def straight_lines(manager, legs, now):
+    """What update_stop_table did per vehicle before: datetime conversions and a straight line to the stop."""
+    stops = manager.static_data["stops"]
+    return [manager.interpolate_position(pos[0], pos[1], fix_time, float(stops[stop_id]["stop_lat"]),
+                                         float(stops[stop_id]["stop_lon"]), stop_time, now)
+            for _, _, pos, fix_time, stop_id, stop_time in legs]
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [500, 2000, 5000]
+    os.chdir(ROOT)
+    routes, stops_data, trips, stop_times, shapes, service_dates = load_static_data()
+    static_data = {"routes": routes, "stops": {s["stop_id"]: s for s in stops_data}, "trips": trips,
+                   "stop_times": stop_times, "shapes": shapes}
+    manager = BusAppStateManager(static_data, {})
+    rng = random.Random(0)
+    print(f"{len(shapes)} shape points in {len(shapes.shape_ids)} shapes")
+    for n in sizes:
+        legs = make_legs(static_data, n, rng)
+        now = legs[0][3] + 300
+        now_dt = datetime.fromtimestamp(now, manager.cyprus_tz)
+        interpolator = ShapeInterpolator(shapes, trips, static_data["stops"])
+        start = time.perf_counter()
+        interpolator.interpolate(legs, now)
+        first = time.perf_counter() - start
+        warm = timed(lambda: interpolator.interpolate(legs, now))
+        old = timed(lambda: straight_lines(manager, legs, now_dt))
+        print(f"{n:>6} buses: straight line {old * 1000:7.2f} ms/tick | shapes first tick {first * 1000:7.2f} ms, "
+              f"later ticks {warm * 1000:6.2f} ms")
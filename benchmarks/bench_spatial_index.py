@@ -0,0 +1,72 @@
+"""Grid-index bbox and nearest-N queries vs a linear scan, over the real stops and synthetic vehicles.
+
+Usage: python benchmarks/bench_spatial_index.py [vehicles] [queries]
+"""
+import math
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gtfs_static import load_static_data
+from spatial_index import METERS_PER_DEGREE, GridIndex, stop_points, vehicle_points
+from bus_app_state import position_record
+from synthetic_feed import make_vehicles
+
+
+def scan_within(points, min_lat, min_lon, max_lat, max_lon):
+    return [item for lat, lon, item in points if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon]
+
+
+def scan_nearest(points, lat, lon, n):
+    cos_lat = math.cos(math.radians(lat))
+    return sorted((math.hypot((p_lon - lon) * METERS_PER_DEGREE * cos_lat, (p_lat - lat) * METERS_PER_DEGREE), id(item))
+                  for p_lat, p_lon, item in points)[:n]
+
+
+def per_call(fn, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) / len(args_list)
+
+
+def run(name, points, n_queries, rng):
+    start = time.perf_counter()
+    grid = GridIndex(points)
+    build = time.perf_counter() - start
+    anchors = [points[rng.randrange(len(points))] for _ in range(n_queries)]
+    # A street-level map viewport (~1.5 x 1 km) around a random point.
+    boxes = [(lat - 0.0045, lon - 0.0075, lat + 0.0045, lon + 0.0075) for lat, lon, _ in anchors]
+    near = [(lat + rng.uniform(-0.01, 0.01), lon + rng.uniform(-0.01, 0.01), 10) for lat, lon, _ in anchors]
+
+    for box in boxes[:50]:
+        assert sorted(map(id, grid.within(*box))) == sorted(map(id, scan_within(points, *box)))
+    for q in near[:50]:
+        got = [round(d, 6) for d, _ in grid.nearest(*q)]
+        assert got == [round(d, 6) for d, _ in scan_nearest(points, *q)], q
+
+    print(f"{name}: {len(points)} points, {len(grid.cells)} cells, built in {build * 1000:.2f} ms")
+    print(f"  bbox    scan: {per_call(lambda *b: scan_within(points, *b), boxes) * 1e6:9.1f} us   "
+          f"grid: {per_call(grid.within, boxes) * 1e6:7.1f} us")
+    print(f"  near-10 scan: {per_call(lambda *q: scan_nearest(points, *q), near) * 1e6:9.1f} us   "
+          f"grid: {per_call(grid.nearest, near) * 1e6:7.1f} us")
+
+
+if __name__ == "__main__":
+    n_vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    os.chdir(ROOT)
+    rng = random.Random(0)
+
+    _, stops_data, _, _, _, _ = load_static_data()
+    stops = {stop["stop_id"]: stop for stop in stops_data}
+    run("stops", list(stop_points(stops)), n_queries, rng)
+
+    vehicles = make_vehicles(n_vehicles)
+    positions = {vehicle_id: position_record(vehicle_id, data) for vehicle_id, data in vehicles.items()}
+    run("vehicles", list(vehicle_points(positions)), n_queries, rng)
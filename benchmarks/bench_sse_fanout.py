@@ -0,0 +1,131 @@
+"""Push fan-out load test over HTTP: thousands of SSE subscribers on the deployed stream server.
+
+Starts stream_server.py on a scratch shared directory, publishes a synthetic fleet through the
+live state channel the way the poller does, and connects the subscribers as real HTTP clients
+(asyncio sockets, in this process). A few of them read slowly, to exercise the backpressure
+path. Reports how many streams were accepted, delivery latency from publish to frame received,
+and what the slow readers got.
+Usage: python benchmarks/bench_sse_fanout.py [subscribers] [refreshes] [slow subscribers]
+"""
+import asyncio
+import http.client
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shared_state import LIVE_STATE_FILE, LiveStateChannel
+from synthetic_feed import advance_vehicles, make_vehicles
+
+PORT = 8767
+
+
+def healthz():
+    conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+    conn.request("GET", "/healthz")
+    return json.loads(conn.getresponse().read())
+
+
+async def subscribe(published_at, latencies, frames, statuses, delay, stop):
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT, limit=1 << 24)
+    try:
+        writer.write(b"GET /vehicle_positions/stream HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        statuses.append(int(head.split(b" ", 2)[1]))
+        if statuses[-1] != 200:
+            return
+        while not stop.is_set():
+            try:
+                frame = await asyncio.wait_for(reader.readuntil(b"\n\n"), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            if frame.startswith(b":"):
+                continue
+            version = int(frame.split(b"\nid: ", 1)[1].split(b"\n", 1)[0])
+            latencies.append(time.perf_counter() - published_at[version])
+            frames.append(frame.split(b" ", 1)[1].split(b"\n", 1)[0])
+            if delay:
+                await asyncio.sleep(delay)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        statuses.append("dropped")
+    finally:
+        writer.close()
+
+
+async def run(channel, n_subscribers, refreshes, n_slow, n_vehicles=1000, interval=0.5):
+    published_at, latencies, frames, statuses = {}, [], [], []
+    slow_frames = []
+    stop = asyncio.Event()
+    vehicles = make_vehicles(n_vehicles)
+    version = 1
+    published_at[version] = time.perf_counter()
+    channel.publish(version, vehicles)
+
+    tasks = []
+    for i in range(n_subscribers):
+        slow = i < n_slow
+        tasks.append(asyncio.create_task(subscribe(published_at, latencies, slow_frames if slow else frames, statuses,
+                                                   20 * interval if slow else 0, stop)))
+        if i % 200 == 199:
+            await asyncio.sleep(0.05)  # don't overrun the listen backlog
+    await asyncio.sleep(2)
+
+    connected = healthz()["clients"]
+    latencies.clear()
+    for refresh in range(refreshes):
+        await asyncio.sleep(interval)
+        vehicles = advance_vehicles(vehicles, seed=refresh)
+        version += 1
+        published_at[version] = time.perf_counter()
+        channel.publish(version, vehicles)
+    await asyncio.sleep(2)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return connected, statuses, sorted(latencies), frames, slow_frames
+
+
+if __name__ == "__main__":
+    n_subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    refreshes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    n_slow = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    shared = tempfile.mkdtemp(prefix="bus_app_shared_")
+    os.chmod(shared, 0o700)
+    env = dict(os.environ, BUS_APP_SHARED_DIR=shared, PYTHONPATH=ROOT)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "stream_server.py"), f"127.0.0.1:{PORT}"], env=env)
+    try:
+        for _ in range(100):
+            try:
+                healthz()
+                break
+            except OSError:
+                time.sleep(0.1)
+        channel = LiveStateChannel(os.path.join(shared, LIVE_STATE_FILE))
+        connected, statuses, latencies, frames, slow_frames = asyncio.run(run(channel, n_subscribers, refreshes, n_slow))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(shared, ignore_errors=True)
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    accepted = statuses.count(200)
+    print(f"{n_subscribers} subscribers over HTTP ({n_slow} slow), {refreshes} feed refreshes")
+    print(f"  streams accepted: {accepted}, refused: {sum(1 for s in statuses if s not in (200, 'dropped'))}, "
+          f"dropped: {statuses.count('dropped')}; open on the server after connecting: {connected}")
+    print(f"  delivery latency (publish -> frame read): p50 {pct(0.50):.1f} ms, p95 {pct(0.95):.1f} ms, "
+          f"p99 {pct(0.99):.1f} ms")
+    print(f"  fast readers: {len(frames)} frames ({frames.count(b'delta')} deltas, {frames.count(b'snapshot')} snapshots); "
+          f"slow readers: {len(slow_frames)} frames ({slow_frames.count(b'snapshot')} snapshots)")
@@ -0,0 +1,40 @@
+"""Cold-start time and peak RSS of the CSV loader vs the binary snapshot loader.
+
+Each mode runs in a fresh interpreter so neither benefits from the other's imports or heap.
+Usage: python benchmarks/bench_static_load.py [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, resource, sys, time
+start = time.perf_counter()
+import gtfs_static
+if sys.argv[1] == "csv":
+    routes, stops, trips, stop_times, shapes, service_dates = gtfs_static.load_static_csv()
+else:
+    routes, stops, trips, stop_times, shapes, service_dates = gtfs_static.load_static_data()
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "trips": len(trips)}))
+"""
+
+
+def run(mode):
+    out = subprocess.run([sys.executable, "-c", CHILD, mode], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    # Make sure the snapshot exists and is fresh before timing it.
+    run("snapshot")
+    for mode in ("csv", "snapshot"):
+        results = [run(mode) for _ in range(runs)]
+        best = min(r["seconds"] for r in results)
+        rss = max(r["max_rss_mb"] for r in results)
+        print(f"{mode:>8}: best {best * 1000:7.1f} ms, peak RSS {rss:6.1f} MB, {results[0]['trips']} trips")
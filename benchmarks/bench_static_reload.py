@@ -0,0 +1,46 @@
+"""Time and memory of a hot reload after one feed folder changes, on a scratch copy of static_data/.
+
+Usage: python benchmarks/bench_static_reload.py [feed folder name]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from zoneinfo import ZoneInfo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gtfs_static import STATIC_DATA_FOLDERS, build_snapshot, feed_hashes, load_static_data
+from static_generation import StaticGeneration, StaticReloader, rss_mb
+
+if __name__ == "__main__":
+    changed = sys.argv[1] if len(sys.argv) > 1 else "10_google_transit"
+    tz = ZoneInfo("Asia/Nicosia")
+    with tempfile.TemporaryDirectory() as scratch:
+        shutil.copytree(os.path.join(ROOT, "static_data"), os.path.join(scratch, "static_data"),
+                        ignore=shutil.ignore_patterns("*.snapshot", ".snapshots"))
+        os.chdir(scratch)
+        build_snapshot()
+        hashes = feed_hashes()
+        generation = StaticGeneration.from_data(load_static_data(hashes=hashes), 1, hashes, tz)
+        swapped = []
+        reloader = StaticReloader(generation, lambda data, number, h: StaticGeneration.from_data(data, number, h, tz),
+                                  swapped.append)
+
+        folder = next(f for f in STATIC_DATA_FOLDERS if changed in f)
+        with open(os.path.join(folder, "routes.txt"), "a", encoding="utf-8") as f:
+            f.write("\n")
+        print(f"RSS before: {rss_mb():.0f} MB; touching {folder}")
+        start = time.perf_counter()
+        report = reloader.check()
+        print(f"check() returned after {time.perf_counter() - start:.2f}s")
+        for key in ("generation", "seconds", "load_seconds", "rss_before_mb", "rss_peak_mb", "rss_after_mb"):
+            print(f"  {key:>14}: {report[key]:.2f}" if isinstance(report[key], float) else f"  {key:>14}: {report[key]}")
+        for feed in report["parsed"]:
+            print(f"  parsed {feed['folder']} in {feed['seconds']:.2f}s (worker peak RSS {feed['max_rss_mb']:.0f} MB)")
+        # Nothing changed since: a check is just a stat() per source file.
+        start = time.perf_counter()
+        reloader.check()
+        print(f"idle check(): {(time.perf_counter() - start) * 1e6:.0f} us")
@@ -0,0 +1,51 @@
+"""update_stop_table with the stop -> vehicle index vs the old scan over every vehicle's updates.
+
+Usage: python benchmarks/bench_stop_index.py [vehicles] [updates per vehicle]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bus_app_state import BusAppStateManager, build_stop_index
+from synthetic_feed import make_vehicles
+
+
+def scan(vehicles, stop_id):
+    """The matching loop update_stop_table used before the index."""
+    return [(vehicle, row) for vehicle in vehicles.values()
+            for row, update_stop_id in enumerate(vehicle.updates.stop_ids) if update_stop_id == stop_id]
+
+
+def per_call(fn, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) / len(args_list)
+
+
+if __name__ == "__main__":
+    n_vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_updates = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    vehicles = make_vehicles(n_vehicles, n_updates)
+    stop_ids = [str(s) for s in range(0, 5600, 56)]
+
+    start = time.perf_counter()
+    stop_index = build_stop_index(vehicles)
+    build = time.perf_counter() - start
+
+    manager = BusAppStateManager({"stops": {}, "trips": {}, "routes": {}}, {})
+    manager.publish_feed(vehicles)
+    old = per_call(scan, [(vehicles, s) for s in stop_ids])
+    new = per_call(lambda s: stop_index.get(s, ()), [(s,) for s in stop_ids])
+    table = per_call(manager.update_stop_table, [(s,) for s in stop_ids])
+    hits = sum(len(stop_index.get(s, ())) for s in stop_ids) / len(stop_ids)
+
+    print(f"{n_vehicles} vehicles x {n_updates} updates, {hits:.1f} matches per stop")
+    print(f"  index build (once per refresh): {build * 1000:8.2f} ms")
+    print(f"  scan lookup:                    {old * 1e6:8.1f} us/stop")
+    print(f"  index lookup:                   {new * 1e6:8.1f} us/stop")
+    print(f"  update_stop_table (indexed):    {table * 1e6:8.1f} us/stop")
@@ -0,0 +1,55 @@
+"""Heap used by one feed's stop_times: per-row dicts (the old loader) vs the columnar StopTimesStore.
+
+Usage: python benchmarks/bench_stop_times_memory.py [feed folder]
+"""
+import csv
+import os
+import sys
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stop_times_store import StopTimesBuilder
+
+
+def load_dicts(path):
+    stop_times = defaultdict(list)
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            stop_times[row["trip_id"]].append({
+                "stop_id": row["stop_id"],
+                "arrival_time": row["arrival_time"],
+                "departure_time": row["departure_time"],
+                "stop_sequence": int(row["stop_sequence"])
+            })
+    # The old loader also kept a sorted copy of every list on its trip row.
+    return stop_times, {trip_id: sorted(times, key=lambda x: x["stop_sequence"]) for trip_id, times in stop_times.items()}
+
+
+def load_store(path):
+    builder = StopTimesBuilder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            builder.add(row["trip_id"], row["stop_id"], row["arrival_time"], row["departure_time"], row["stop_sequence"])
+    return builder.build()
+
+
+def measure(loader, path):
+    tracemalloc.start()
+    result = loader(path)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, peak
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "static_data/10_google_transit")
+    path = os.path.join(folder, "stop_times.txt")
+    _, dict_size, dict_peak = measure(load_dicts, path)
+    store, store_size, store_peak = measure(load_store, path)
+    print(f"{len(store)} rows, {len(store.trip_ids)} trips from {path}")
+    print(f"  dicts: retained {dict_size / 1e6:6.1f} MB (peak {dict_peak / 1e6:6.1f} MB)")
+    print(f"  store: retained {store_size / 1e6:6.1f} MB (peak {store_peak / 1e6:6.1f} MB)")
+    print(f"  ratio: {dict_size / store_size:.1f}x")
@@ -0,0 +1,52 @@
+"""Bytes one map client downloads per hour for vehicle positions: full polls vs 304s vs deltas.
+
+Replays an hour of synthetic 60 s feed refreshes through the Flask app while a client polls every 5 s.
+Usage: python benchmarks/bench_vehicle_delta.py [vehicles] [moving fraction]
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+
+import main
+from synthetic_feed import advance_vehicles, make_vehicles
+
+POLL_SECONDS = 5
+REFRESH_SECONDS = 60
+
+
+def run(n_vehicles, moving_fraction):
+    client = main.app.test_client()
+    vehicles = make_vehicles(n_vehicles)
+    totals = {"full": 0, "conditional": 0, "delta": 0}
+    etag, version = None, None
+    for refresh in range(3600 // REFRESH_SECONDS):
+        main.state_manager.publish_feed(vehicles)
+        for _ in range(REFRESH_SECONDS // POLL_SECONDS):
+            # Before: every poll re-downloads the full list.
+            full = client.get("/vehicle_positions")
+            totals["full"] += len(full.data)
+            # Conditional GET: the full list once per feed version, 304s in between.
+            headers = {"If-None-Match": etag} if etag else {}
+            conditional = client.get("/vehicle_positions", headers=headers)
+            totals["conditional"] += len(conditional.data)
+            etag = conditional.headers["ETag"]
+            # Delta stream: one delta per feed version, near-empty bodies in between.
+            since = "" if version is None else version
+            delta = client.get(f"/vehicle_positions/delta?since={since}")
+            totals["delta"] += len(delta.data)
+            version = delta.json["version"]
+        vehicles = advance_vehicles(vehicles, moving_fraction, seed=refresh)
+    return totals
+
+
+if __name__ == "__main__":
+    n_vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    moving_fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    totals = run(n_vehicles, moving_fraction)
+    print(f"{n_vehicles} vehicles, {moving_fraction:.0%} moving per refresh, one client polling every {POLL_SECONDS} s")
+    for name, size in totals.items():
+        print(f"  {name:>11}: {size / 1e6:8.2f} MB/hour")
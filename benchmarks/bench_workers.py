@@ -0,0 +1,92 @@
+"""Requests/sec vs gunicorn worker count, with the shared static data and single elected poller.
+
+Starts the mock upstream in-process, then for each worker count runs
+`gunicorn -c gunicorn.conf.py main:app` against it and hammers one endpoint from client processes.
+Also reports how many upstream fetches were made, to show only one worker polls.
+Usage: python benchmarks/bench_workers.py [--workers 1 2 4] [--clients 16] [--seconds 10] [--path /vehicle_positions]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_gtfs_rt_server import DEFAULT_PAYLOAD, MockFeed, serve
+
+PORT = 8765
+FEED_INTERVAL = 2
+
+
+def client(args):
+    index, path, seconds = args
+    conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=10)
+    headers = {"Cookie": f"bus_session=bench{index}"}
+    done = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        done += response.status == 200
+    conn.close()
+    return done
+
+
+def wait_until_up(timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+            conn.request("GET", "/bus_state/fetcher")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not come up")
+
+
+def run(workers, clients, seconds, path, upstream_url, feed):
+    shared = tempfile.mkdtemp(prefix="bus_app_shared_")
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{PORT}", GTFS_REALTIME_URL=upstream_url,
+               FEED_INTERVAL=str(FEED_INTERVAL), BUS_APP_SHARED_DIR=shared)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=ROOT,
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up()
+        time.sleep(FEED_INTERVAL + 1)  # let the poller publish and the followers pick it up
+        before = feed.requests
+        with multiprocessing.Pool(clients) as pool:
+            start = time.perf_counter()
+            done = sum(pool.map(client, [(i, path, seconds) for i in range(clients)]))
+            elapsed = time.perf_counter() - start
+        upstream = feed.requests - before
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(shared, ignore_errors=True)
+    return done / elapsed, upstream, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--path", default="/vehicle_positions")
+    args = parser.parse_args()
+
+    with open(DEFAULT_PAYLOAD, "rb") as f:
+        feed = MockFeed(f.read())
+    upstream_server, upstream_url = serve(feed)
+    print(f"{args.clients} clients on {args.path} for {args.seconds:.0f} s, upstream polled every {FEED_INTERVAL} s")
+    for workers in args.workers:
+        rps, upstream, elapsed = run(workers, args.clients, args.seconds, args.path, upstream_url, feed)
+        print(f"  {workers} worker(s): {rps:8.0f} req/s, {upstream} upstream fetches in {elapsed:.0f} s")
+    upstream_server.shutdown()
@@ -0,0 +1,97 @@
+"""Local stand-in for the GTFS-RT upstream, with fault injection.
+
+Serves one recorded protobuf (process_scripts/gtfs-realtime by default) with ETag and
+Last-Modified validators. It can add latency, fail a fraction of requests with 503, hang
+requests past any sane timeout, or ignore conditional headers.
+Usage: python benchmarks/mock_gtfs_rt_server.py [--port 8328] [--delay 0.05] [--fail-rate 0.2] ...
+"""
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PAYLOAD = os.path.join(ROOT, "process_scripts", "gtfs-realtime")
+
+
+class MockFeed:
+    def __init__(self, payload, delay=0.0, fail_rate=0.0, hang_rate=0.0, hang_seconds=30.0, conditional=True):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.conditional = conditional
+        self.requests = 0
+        self.set_payload(payload)
+
+    def set_payload(self, payload):
+        self.payload = payload
+        self.etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+
+def make_handler(feed):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is observable
+
+        def do_GET(self):
+            feed.requests += 1
+            if feed.delay:
+                time.sleep(feed.delay)
+            if random.random() < feed.hang_rate:
+                time.sleep(feed.hang_seconds)
+            if random.random() < feed.fail_rate:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if feed.conditional and self.headers.get("If-None-Match") == feed.etag:
+                self.send_response(304)
+                self.send_header("ETag", feed.etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Length", str(len(feed.payload)))
+            if feed.conditional:
+                self.send_header("ETag", feed.etag)
+                self.send_header("Last-Modified", feed.last_modified)
+            self.end_headers()
+            self.wfile.write(feed.payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(feed, port=0):
+    """Starts the server on a daemon thread; returns (server, url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(feed))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/Api/api/gtfs-realtime"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payload", default=DEFAULT_PAYLOAD)
+    parser.add_argument("--port", type=int, default=8328)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--no-conditional", action="store_true")
+    args = parser.parse_args()
+    with open(args.payload, "rb") as f:
+        feed = MockFeed(f.read(), args.delay, args.fail_rate, args.hang_rate, conditional=not args.no_conditional)
+    server, url = serve(feed, args.port)
+    print(f"Serving {args.payload} at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,99 @@
+"""Serves a feed_recorder log as a local GTFS-RT upstream, at recorded or accelerated speed.
+
+Each recorded payload goes live at (its fetch time - the first one's) / speed after start, so a
+60 s recording interval becomes 1 s at --speed 60. Without a log, one is derived from
+process_scripts/gtfs-realtime the way bench_feed_merge does it.
+Usage: python benchmarks/replay_server.py [log file or recorder dir] [--speed 60] [--loop] [--port 8328]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_feed_merge import derive_recordings
+from feed_recorder import FeedRecorder, iter_log
+from mock_gtfs_rt_server import MockFeed, serve
+
+
+def synthesize_log(directory, refreshes=60, interval=60, changing=0.3, start=1_740_863_331):
+    """Records a derived sequence of refreshes, `interval` seconds apart, into a new log under directory."""
+    recorder = FeedRecorder(directory)
+    with tempfile.TemporaryDirectory() as tmp:
+        for step, path in enumerate(derive_recordings(tmp, refreshes, changing)):
+            with open(path, "rb") as f:
+                recorder.record(f.read(), start + step * interval)
+    return directory
+
+
+class FeedReplay:
+    """Moves a MockFeed through the records of a log on a background thread."""
+
+    def __init__(self, feed, log_path, speed=1.0, loop=False, on_advance=None):
+        self.feed = feed
+        self.log_path = log_path
+        self.speed = speed
+        self.loop = loop
+        self.on_advance = on_advance
+        self.served = 0
+        self.done = threading.Event()
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            first = None
+            started = time.monotonic()
+            for fetched_at, payload in iter_log(self.log_path):
+                first = fetched_at if first is None else first
+                wait = started + (fetched_at - first) / self.speed - time.monotonic()
+                if wait > 0 and self._stop.wait(wait):
+                    return
+                if self.on_advance is not None:
+                    self.on_advance(self.served)
+                self.feed.set_payload(payload)
+                self.served += 1
+            if not self.loop or first is None:
+                break
+        self.done.set()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def first_payload(log_path):
+    for _, payload in iter_log(log_path):
+        return payload
+    raise ValueError(f"No records in {log_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", nargs="?")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--loop", action="store_true")
+    parser.add_argument("--port", type=int, default=8328)
+    parser.add_argument("--refreshes", type=int, default=60, help="length of the derived log when none is given")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = args.log or synthesize_log(tmp, args.refreshes)
+        feed = MockFeed(first_payload(log_path))
+        server, url = serve(feed, args.port)
+        replay = FeedReplay(feed, log_path, args.speed, args.loop).start()
+        print(f"Replaying {log_path} at {args.speed:g}x on {url}")
+        try:
+            replay.done.wait()
+            print(f"Replayed {replay.served} feeds; still serving the last one (Ctrl-C to stop)")
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            replay.stop()
+            server.shutdown()
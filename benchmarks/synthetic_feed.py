@@ -0,0 +1,44 @@
+"""Synthetic live feed state shaped like what update_feed publishes, for benchmarks."""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from live_feed import StopTimeUpdates, Vehicle
+
+# Roughly the island's bounding box
+LAT_RANGE = (34.6, 35.2)
+LON_RANGE = (32.4, 34.0)
+
+
+def make_vehicles(n_vehicles, updates_per_vehicle=20, n_stops=5600, now=None, seed=0, prefix="V"):
+    rng = random.Random(seed)
+    now = int(now or time.time())
+    vehicles = {}
+    for v in range(n_vehicles):
+        first_stop = rng.randrange(n_stops)
+        delays = [rng.randrange(-60, 600) for _ in range(updates_per_vehicle)]
+        etas = [now + 90 * (i + 1) + delay for i, delay in enumerate(delays)]
+        updates = StopTimeUpdates([sys.intern(str((first_stop + i) % n_stops)) for i in range(updates_per_vehicle)],
+                                  etas, delays, etas, delays)
+        vehicle_id = f"{prefix}{v:05d}"
+        vehicles[vehicle_id] = Vehicle(vehicle_id, str(10_000_000 + v), now - rng.randrange(60),
+                                       rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE), updates)
+    return vehicles
+
+
+def advance_vehicles(vehicles, moving_fraction=0.3, churn=0.01, seed=0):
+    """Next refresh of a synthetic feed: some vehicles move, a few leave and a few join."""
+    rng = random.Random(seed)
+    nxt = {}
+    for vehicle_id, vehicle in vehicles.items():
+        if rng.random() < churn:
+            continue
+        if rng.random() < moving_fraction:
+            vehicle = vehicle.moved(vehicle.timestamp + 60, vehicle.lat + rng.uniform(-0.003, 0.003),
+                                    vehicle.lon + rng.uniform(-0.003, 0.003))
+        nxt[vehicle_id] = vehicle
+    nxt.update(make_vehicles(int(len(vehicles) * churn), seed=seed + 1, prefix=f"N{seed:04d}-"))
+    return nxt
@@ -2,6 +2,15 @@
 from enum import Enum
 from zoneinfo import ZoneInfo
 from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from itertools import chain
+import threading
+import time
+
+from delay_propagation import DelayPropagator, build_prediction_index
+from metrics import VIEW_SECONDS, timed
+from route_index import build_route_vehicles, update_route_vehicles
+from spatial_index import GridIndex, vehicle_points
 
 
 class AppState(Enum):
@@ -9,48 +18,329 @@ class AppState(Enum):
     STOP_SELECTED = 1
     BUS_SELECTED = 2
 
-class BusAppStateManager:
-    def __init__(self, static_data, live_feed_state):
+def build_stop_index(vehicles):
+    """stop_id -> [(vehicle, row)] over every vehicle's stop time updates, in feed order.
+
+    `row` indexes vehicle.updates; holding the Vehicle itself keeps an entry consistent
+    even if it is read while the next feed is being published.
+    """
+    stop_index = {}
+    for vehicle in vehicles.values():
+        for row, stop_id in enumerate(vehicle.updates.stop_ids):
+            entries = stop_index.get(stop_id)
+            if entries is None:
+                stop_index[stop_id] = [(vehicle, row)]
+            else:
+                entries.append((vehicle, row))
+    return stop_index
+
+
+def update_stop_index(stop_index, old_vehicles, vehicles, touched):
+    """Copy of stop_index with the entries of the touched vehicle ids rebuilt; the input is not modified."""
+    stops = set()
+    for vehicle_id in touched:
+        for vehicle in (old_vehicles.get(vehicle_id), vehicles.get(vehicle_id)):
+            if vehicle is not None:
+                stops.update(vehicle.updates.stop_ids)
+
+    new_index = dict(stop_index)
+    for stop_id in stops:
+        kept = [entry for entry in stop_index.get(stop_id, ()) if entry[0].vehicle_id not in touched]
+        if kept:
+            new_index[stop_id] = kept
+        else:
+            new_index.pop(stop_id, None)
+    # Every list touched below was freshly built above, so readers of the old index are unaffected.
+    for vehicle_id in touched:
+        vehicle = vehicles.get(vehicle_id)
+        if vehicle is not None:
+            for row, stop_id in enumerate(vehicle.updates.stop_ids):
+                new_index.setdefault(stop_id, []).append((vehicle, row))
+    return new_index
+
+
+def build_trip_index(vehicles):
+    """trip_id -> vehicle_id of the vehicle currently running it."""
+    return {vehicle.trip_id: vehicle_id for vehicle_id, vehicle in vehicles.items() if vehicle.trip_id}
+
+
+def position_record(vehicle_id, vehicle):
+    """The per-vehicle record /vehicle_positions and its delta stream send to the map."""
+    stop_ids = vehicle.updates.stop_ids
+    return {
+        "vehicle_id": vehicle_id,
+        "latitude": vehicle.lat,
+        "longitude": vehicle.lon,
+        "timestamp": vehicle.timestamp,
+        "trip_id": vehicle.trip_id,
+        "next_stop_id": stop_ids[0] if stop_ids else ""
+    }
+
+
+def diff_positions(base, current):
+    """(added, moved, removed) between two {vehicle_id: position_record}: new and changed records, gone ids."""
+    added, moved = [], []
+    for vehicle_id, record in current.items():
+        previous = base.get(vehicle_id)
+        if previous is None:
+            added.append(record)
+        elif previous != record:
+            moved.append(record)
+    removed = [vehicle_id for vehicle_id in base if vehicle_id not in current]
+    return added, moved, removed
+
+
+class ClientSession:
+    """Selection state of one browser."""
+    __slots__ = ("state", "selected_stop", "selected_bus", "highlighted_stop", "last_seen")
+
+    def __init__(self, now):
         self.state = AppState.DEFAULT
         self.selected_stop = None
         self.selected_bus = None
         self.highlighted_stop = None
-        self.static_data = static_data
+        self.last_seen = now
+
+    def select(self, mode, key=None):
+        self.state = mode
+        self.selected_stop = key if mode == AppState.STOP_SELECTED else None
+        self.selected_bus = key if mode == AppState.BUS_SELECTED else None
+        self.highlighted_stop = None
+
+    def view_key(self):
+        """(mode, key) of the shared view this session is looking at."""
+        if self.state == AppState.BUS_SELECTED:
+            return AppState.BUS_SELECTED, self.selected_bus
+        elif self.state == AppState.STOP_SELECTED:
+            return AppState.STOP_SELECTED, self.selected_stop
+        return AppState.DEFAULT, None
+
+
+class SessionStore:
+    """Bounded LRU of ClientSessions; sessions idle for longer than ttl seconds start over."""
+
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or now - session.last_seen > self.ttl:
+                session = self._sessions[session_id] = ClientSession(now)
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+
+            # Oldest first: evict past capacity, then anything that has expired.
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if len(self._sessions) <= self.max_sessions and now - oldest.last_seen <= self.ttl:
+                    break
+                del self._sessions[oldest_id]
+            return session
+
+
+class BusAppStateManager:
+    def __init__(self, static_data, live_feed_state, max_sessions=10000, session_ttl=3600, view_tick=5, max_views=4096,
+                 position_history=30, propagation_budget=0.05):
+        # The current feed and its indexes. Each publish replaces the dict and never modifies a published
+        # one, so code that reads self.live_feed_state once sees a single feed throughout.
         self.live_feed_state = live_feed_state
         self.cyprus_tz = ZoneInfo("Asia/Nicosia")
+        self.sessions = SessionStore(max_sessions, session_ttl)
+        # Static data and its indexes (stop grid, shapes, departure boards) form one generation
+        # that a reload replaces as a whole; the vehicle grid is rebuilt with every published feed.
+        if isinstance(static_data, dict):
+            # Imported here: static_generation pulls in the GTFS loaders, which only this path needs.
+            from static_generation import StaticGeneration
+            static_data = StaticGeneration(static_data, tz=self.cyprus_tz)
+        self.generation = static_data
 
-    def on_select_stop(self, stop_id):
-        self.selected_stop = stop_id
-        self.selected_bus = None
-        self.highlighted_stop = None
-        self.state = AppState.STOP_SELECTED
-        return self.update_stop_table(stop_id)
+        # Views are shared by every session showing the same thing and memoized per
+        # (mode, key) within one (feed version, view_tick-second) epoch.
+        self.view_tick = view_tick
+        self.max_views = max_views
+        self._views = {}
+        self._views_epoch = None
+        self._view_locks = {}
+        self._views_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        # (version, {vehicle_id: position_record}) for the last few feeds, oldest first
+        self.position_history = deque(maxlen=position_history)
+        # unix time -> "HH:MM:SS" in Cyprus time; replaced with every feed version
+        self._clock_texts = {}
+        # Predicted arrivals at the stops trip updates leave out, recomputed with every feed
+        self.propagator = DelayPropagator(propagation_budget)
 
-    def on_select_bus(self, vehicle_id):
-        self.selected_bus = vehicle_id
-        self.selected_stop = None
-        self.highlighted_stop = None
-        self.state = AppState.BUS_SELECTED
-        return self.update_future_stops(vehicle_id)
+    @property
+    def static_data(self):
+        return self.generation.static_data
+
+    @property
+    def stop_grid(self):
+        return self.generation.stop_grid
+
+    @property
+    def departure_boards(self):
+        return self.generation.departure_boards
+
+    def clock(self, timestamp):
+        """"HH:MM:SS" of a unix time in Cyprus; each distinct time is formatted once per feed version."""
+        text = self._clock_texts.get(timestamp)
+        if text is None:
+            text = self._clock_texts[timestamp] = datetime.fromtimestamp(timestamp, self.cyprus_tz).strftime('%H:%M:%S')
+        return text
+
+    def current_positions(self):
+        """{vehicle_id: position_record} of the newest feed."""
+        return self.position_history[-1][1] if self.position_history else {}
 
-    def on_select_stop_from_route(self, stop_id):
-        self.highlighted_stop = stop_id
+    def swap_generation(self, generation):
+        """Makes a reloaded StaticGeneration current; views computed from the old one expire with the epoch."""
+        with self._publish_lock:
+            self.generation = generation
+            # Trips may have moved between routes: regroup the running vehicles by the new schedule.
+            state = self.live_feed_state
+            self.live_feed_state = dict(state, route_vehicles=build_route_vehicles(state.get("vehicles", {}),
+                                                                                   generation.route_index.trip_routes))
+
+    def on_select_stop(self, session, stop_id):
+        session.select(AppState.STOP_SELECTED, stop_id)
+        return self.view(AppState.STOP_SELECTED, stop_id)
+
+    def on_select_bus(self, session, vehicle_id):
+        session.select(AppState.BUS_SELECTED, vehicle_id)
+        return self.view(AppState.BUS_SELECTED, vehicle_id)
+
+    def on_select_stop_from_route(self, session, stop_id):
+        session.highlighted_stop = stop_id
         return f"Stop {stop_id} highlighted on map"
 
-    def on_deselect(self):
-        self.selected_stop = None
-        self.selected_bus = None
-        self.highlighted_stop = None
-        self.state = AppState.DEFAULT
+    def on_deselect(self, session):
+        session.select(AppState.DEFAULT)
         return "Deselected all. Reset to default view."
 
-    def update_every_5s(self, current_time):
-        if self.state == AppState.BUS_SELECTED:
-            return self.update_future_stops(self.selected_bus, current_time)
-        elif self.state == AppState.STOP_SELECTED:
-            return self.update_stop_table(self.selected_stop, current_time)
-        else:
-            return self.update_all_bus_locations(current_time)
+    def publish_feed(self, vehicles, changes=None, version=None, feed_timestamp=None):
+        """Publishes a new feed version. Returns False if `changes` (a live_feed.FeedChanges) is empty.
+
+        Without `changes` the stop index, delay predictions and position records are rebuilt from
+        scratch; with them only the added, changed and removed vehicles are reprocessed. `version` lets a
+        worker adopt the version number the elected poller assigned. `feed_timestamp` is the
+        feed header's timestamp, kept for the staleness metric.
+        """
+        with self._publish_lock:
+            state = self.live_feed_state
+            previous = state.get("vehicles", {})
+            trip_routes = self.generation.route_index.trip_routes
+            if changes is None or not self.position_history:
+                touched = None
+                stop_index = build_stop_index(vehicles)
+                route_vehicles = build_route_vehicles(vehicles, trip_routes)
+                positions = {vehicle_id: position_record(vehicle_id, data) for vehicle_id, data in vehicles.items()}
+            else:
+                touched = changes.added | changes.changed | changes.removed
+                if not touched:
+                    # Same data: keep the version, so cached views, bodies and ETags stay valid.
+                    return False
+                stop_index = update_stop_index(state.get("stop_index", {}), previous, vehicles, touched)
+                route_vehicles = update_route_vehicles(state.get("route_vehicles", {}), previous, vehicles,
+                                                       touched, trip_routes)
+                last_positions = self.position_history[-1][1]
+                positions = {vehicle_id: last_positions[vehicle_id] if vehicle_id not in touched and vehicle_id in last_positions
+                             else position_record(vehicle_id, data) for vehicle_id, data in vehicles.items()}
+
+            predictions = self.propagator.update(self.generation.static_data.get("stop_times"), vehicles, touched)
+
+            if version is None:
+                version = state.get("version", 0) + 1
+            # A new dict swapped in whole: a reader holding the old one keeps a consistent older feed.
+            self.live_feed_state = dict(state, **{
+                "vehicles": vehicles,
+                "stop_index": stop_index,
+                "version": version,
+                "vehicle_grid": GridIndex(vehicle_points(positions)),
+                "trip_vehicles": build_trip_index(vehicles),
+                "route_vehicles": route_vehicles,
+                "predictions": predictions,
+                "prediction_index": build_prediction_index(vehicles, predictions),
+                "feed_timestamp": feed_timestamp,
+            })
+            self.position_history.append((version, positions))
+            self._clock_texts = {}
+            return True
+
+    def has_positions(self, version):
+        """True if position_delta(version) can answer with a delta rather than the full snapshot."""
+        return any(v == version for v, _ in list(self.position_history))
+
+    @timed(VIEW_SECONDS, "position_delta")
+    def position_delta(self, since=None):
+        """Vehicles added, moved or removed since feed version `since`.
+
+        Falls back to a full snapshot when `since` is missing or older than the history kept.
+        """
+        history = list(self.position_history)
+        if not history:
+            return {"version": self.live_feed_state.get("version", 0), "full": True, "vehicles": []}
+        version, current = history[-1]
+        base = next((positions for v, positions in history if v == since), None)
+        if base is None:
+            return {"version": version, "full": True, "vehicles": list(current.values())}
+
+        added, moved, removed = diff_positions(base, current)
+        return {"version": version, "full": False, "added": added, "moved": moved, "removed": removed}
+
+    def vehicle_grid(self):
+        return self.live_feed_state.get("vehicle_grid") or GridIndex(())
+
+    def update_every_5s(self, session, current_time):
+        mode, key = session.view_key()
+        return self.view(mode, key, current_time)
+
+    def view_epoch(self, current_time):
+        """(feed version, view tick, static generation) that views computed at current_time are valid for."""
+        return (self.live_feed_state.get("version", 0), int(current_time.timestamp()) // self.view_tick,
+                self.generation.number)
+
+    @timed(VIEW_SECONDS, "view")
+    def view(self, mode, key, current_time=None):
+        if not current_time:
+            current_time = datetime.now().astimezone(self.cyprus_tz)
+        epoch = self.view_epoch(current_time)
+
+        view_key = (mode, key)
+        with self._views_lock:
+            if epoch != self._views_epoch or len(self._views) >= self.max_views:
+                self._views = {}
+                self._view_locks = {}
+                self._views_epoch = epoch
+            result = self._views.get(view_key)
+            if result is not None:
+                return result
+            view_lock = self._view_locks.setdefault(view_key, threading.Lock())
+
+        # Computed under this view's own lock: concurrent polls of the same view wait for one
+        # result, while every other view is served meanwhile.
+        with view_lock:
+            with self._views_lock:
+                result = self._views.get(view_key) if epoch == self._views_epoch else None
+            if result is None:
+                if mode == AppState.BUS_SELECTED:
+                    result = self.update_future_stops(key, current_time)
+                elif mode == AppState.STOP_SELECTED:
+                    result = self.update_stop_table(key, current_time)
+                else:
+                    result = self.update_all_bus_locations(current_time)
+                with self._views_lock:
+                    if epoch == self._views_epoch:
+                        self._views[view_key] = result
+            return result
 
 
 
@@ -69,53 +359,119 @@ class BusAppStateManager:
         lon = lon1 + f * (lon2 - lon1)
         return lat, lon
 
+    @timed(VIEW_SECONDS, "departures")
+    def departures(self, stop_id, current_time=None, n=10, generation=None, state=None):
+        """Next n scheduled departures from the stop, with the live delay of trips that are running.
+
+        A trip's delay comes from its vehicle's update for this stop if there is one, otherwise
+        from the delay propagated to it, otherwise from the vehicle's next update; trips with
+        no vehicle in the feed keep delay None. `state` is the live_feed_state to read, by default the current one.
+        """
+        boards = (generation or self.generation).departure_boards
+        if boards is None:
+            return []
+        if not current_time:
+            current_time = datetime.now().astimezone(self.cyprus_tz)
+        state = state or self.live_feed_state
+        vehicles = state.get("vehicles", {})
+        trip_vehicles = state.get("trip_vehicles", {})
+        predictions = state.get("predictions", {})
+        # Look back a little so a late bus is still listed after its scheduled time.
+        departures = boards.next_departures(stop_id, current_time - timedelta(minutes=15), n + 10)
+
+        board = []
+        for departure in departures:
+            vehicle_id = trip_vehicles.get(departure["trip_id"])
+            vehicle = vehicles.get(vehicle_id)
+            delay = None
+            if vehicle is not None and vehicle.updates:
+                row = vehicle.updates.index(stop_id)
+                predicted = predictions.get(vehicle_id)
+                predicted_row = predicted.index(stop_id) if row < 0 and predicted is not None else -1
+                if predicted_row >= 0:
+                    delay = predicted.departure_delay[predicted_row]
+                else:
+                    delay = vehicle.updates.departure_delay[max(row, 0)]
+            expected = departure["scheduled_time"] + (delay or 0)
+            if expected < current_time.timestamp():
+                continue
+            board.append(dict(departure, vehicle_id=vehicle_id, delay=delay, expected_time=expected))
+        board.sort(key=lambda d: d["expected_time"])
+        return board[:n]
+
+    @timed(VIEW_SECONDS, "update_stop_table")
     def update_stop_table(self, stop_id, current_time=None):
         if not current_time:
             current_time = datetime.now().astimezone(self.cyprus_tz)
 
+        # One generation and one feed for the whole table, even if a reload or a publish swaps them meanwhile.
+        generation = self.generation
+        state = self.live_feed_state
+        static_data = generation.static_data
+        trip_routes = generation.route_index.trip_routes
         stop_info = []
         locations = {}
-        stop_data = self.static_data["stops"].get(stop_id, {})
+        legs = []
+        stop_data = static_data["stops"].get(stop_id, {})
         stop_lat = float(stop_data.get("stop_lat", 0))
         stop_lon = float(stop_data.get("stop_lon", 0))
-        for vehicle_id, data in self.live_feed_state["vehicles"].items():
-            for update in data.get("stop_time_updates", []):
-                if update["stop_id"] == stop_id:
-                    eta_dt = datetime.fromtimestamp(int(update["arrival"]["time"]), self.cyprus_tz)
-                    eta_minutes = int((eta_dt - current_time).total_seconds() // 60)
-                    delay_minutes = int(update["arrival"]["delay"] // 60)
-
-                    trip_id = data.get("trip_id")
-                    route_id = self.static_data["trips"].get(trip_id, {}).get("route_id", "")
-                    route_number = self.static_data["routes"].get(route_id, {}).get("route_short_name", "")
-
-                    stop_info.append({
-                        "vehicle_id": vehicle_id,
-                        'trip_id': trip_id,
-                        'route_id': route_id,
-                        "route_number": route_number,
-                        "eta": eta_dt.strftime('%H:%M:%S'),
-                        "eta_in_minutes": eta_minutes,
-                        "delay_in_minutes": delay_minutes
-                    })
-                    pos = data.get("current_position", (None, None))
-                    timestamp_bus = int(data.get("timestamp"))
-                    timestamp_stop = int(update["arrival"]["time"])
-                    approx_lat, approx_lon = self.interpolate_position(pos[0], pos[1], timestamp_bus, stop_lat, stop_lon, timestamp_stop, datetime.now().astimezone(self.cyprus_tz))
-                    if pos:
-                        locations[vehicle_id] = {
-                            "route_number": route_number,
-                            "lat": approx_lat,
-                            "lon": approx_lon,
-                            "timestamp": datetime.fromtimestamp(int(data.get("timestamp")), self.cyprus_tz).strftime('%H:%M:%S'),
-                            "now": current_time.strftime('%H:%M:%S'),
-
-                        }
+        now_ts = current_time.timestamp()
+        now_text = current_time.strftime('%H:%M:%S')
+        # Stops a vehicle's updates list come first, then those only the delay propagation predicts.
+        live = ((vehicle, vehicle.updates, row) for vehicle, row in state.get("stop_index", {}).get(stop_id, ()))
+        predicted = state.get("prediction_index", {}).get(stop_id, ())
+        for vehicle, updates, row in chain(live, predicted):
+            vehicle_id = vehicle.vehicle_id
+            arrival_time = updates.arrival_time[row]
+            eta_minutes = int((arrival_time - now_ts) // 60)
+            delay_minutes = updates.arrival_delay[row] // 60
+
+            trip_id = vehicle.trip_id
+            route_id, route_number = trip_routes.get(trip_id, ("", ""))
+
+            stop_info.append({
+                "vehicle_id": vehicle_id,
+                'trip_id': trip_id,
+                'route_id': route_id,
+                "route_number": route_number,
+                "eta": self.clock(arrival_time),
+                "eta_in_minutes": eta_minutes,
+                "delay_in_minutes": delay_minutes
+            })
+            if updates is not vehicle.updates:
+                stop_info[-1]["predicted"] = True
+            pos = vehicle.position
+            if pos:
+                legs.append((vehicle_id, trip_id, pos, vehicle.timestamp, stop_id, arrival_time))
+                locations[vehicle_id] = {
+                    "route_number": route_number,
+                    "timestamp": self.clock(vehicle.timestamp),
+                    "now": now_text,
+
+                }
+
+        if not stop_info:
+            # Nothing live is heading here: show the timetable instead, with delays of running trips.
+            for departure in self.departures(stop_id, current_time, generation=generation, state=state):
+                stop_info.append({
+                    "vehicle_id": departure["vehicle_id"] or "",
+                    "trip_id": departure["trip_id"],
+                    "route_id": departure["route_id"],
+                    "route_number": departure["route_number"],
+                    "eta": self.clock(departure["expected_time"]),
+                    "eta_in_minutes": int((departure["expected_time"] - now_ts) // 60),
+                    "delay_in_minutes": int((departure["delay"] or 0) // 60),
+                    "scheduled": True
+                })
+
+        # Every approaching bus is advanced along its shape in one batched call.
+        for leg, (approx_lat, approx_lon) in zip(legs, generation.interpolator.interpolate(legs, current_time.timestamp())):
+            locations[leg[0]].update(lat=approx_lat, lon=approx_lon)
 
 
 
         return {
-            "now": current_time.strftime('%H:%M:%S'),
+            "now": now_text,
             "stop_id": stop_id,
             "stop_name": stop_data.get("stop_name", ""),
             "stop_lat": stop_lat,
@@ -126,30 +482,31 @@ class BusAppStateManager:
 
 
 
+    @timed(VIEW_SECONDS, "update_future_stops")
     def update_future_stops(self, vehicle_id, current_time=None):
-        vehicle_data = self.live_feed_state["vehicles"].get(vehicle_id)
-        if not vehicle_data:
+        vehicle = self.live_feed_state["vehicles"].get(vehicle_id)
+        if vehicle is None:
             return {"error": "Vehicle not found"}
 
         future_stops = []
-        for update in vehicle_data.get("stop_time_updates", []):
-            arrival_ts = int(update["arrival"]["time"])
-            eta = datetime.fromtimestamp(arrival_ts, self.cyprus_tz)
+        updates = vehicle.updates
+        for row, stop_id in enumerate(updates.stop_ids):
+            arrival_ts = updates.arrival_time[row]
             if not current_time or arrival_ts >= int(current_time.timestamp()):
                 future_stops.append({
-                    "stop_id": update["stop_id"],
-                    "eta": eta.strftime('%H:%M:%S'),
-                    "delay": int(update["arrival"]["delay"])
+                    "stop_id": stop_id,
+                    "eta": self.clock(arrival_ts),
+                    "delay": updates.arrival_delay[row]
                 })
 
         # ✅ Include bus location so /vehicle_positions gets it
         locations = {}
-        pos = vehicle_data.get("current_position", (None, None))
+        pos = vehicle.position
         if pos:
             locations[vehicle_id] = {
                 "lat": pos[0],
                 "lon": pos[1],
-                "timestamp": vehicle_data.get("timestamp")
+                "timestamp": vehicle.timestamp
             }
             return {
                 "future_stops": future_stops,
@@ -161,13 +518,13 @@ class BusAppStateManager:
         }
 
 
+    @timed(VIEW_SECONDS, "update_all_bus_locations")
     def update_all_bus_locations(self, current_time):
         locations = {}
-        for vehicle_id, data in self.live_feed_state["vehicles"].items():
-            pos = data.get("current_position", (None, None))
+        for vehicle_id, vehicle in self.live_feed_state["vehicles"].items():
             locations[vehicle_id] = {
-                "lat": pos[0],
-                "lon": pos[1],
-                "timestamp": data.get("timestamp")
+                "lat": vehicle.lat,
+                "lon": vehicle.lon,
+                "timestamp": vehicle.timestamp
             }
         return {"bus_locations": locations}
@@ -0,0 +1,125 @@
+import time
+
+from live_feed import StopTimeUpdates
+
+
+def propagate_trip(store, t, updates, stop_rows):
+    """Predicted StopTimeUpdates for the scheduled stops of trip index t that `updates` leaves out.
+
+    The updates are matched to the trip's rows in order. The first matched update anchors the
+    trip to the clock (its time minus its delay is the scheduled time); rows before it are
+    skipped as already passed. Every later row the feed omits gets the departure delay of the
+    closest matched stop before it. Returns None if no update matches or nothing is left.
+    """
+    start, end = store.trip_start[t], store.trip_start[t + 1]
+    stop_index = store.stop_index[start:end]
+    arrival = store.arrival[start:end]
+    departure = store.departure[start:end]
+    on_trip = set(stop_index)
+    wanted = [(s, j) for j, s in enumerate(stop_rows.get(stop_id) for stop_id in updates.stop_ids)
+              if s in on_trip and updates.arrival_time[j]]
+    if not wanted:
+        return None
+
+    first, j = wanted[0]
+    scheduled = updates.arrival_time[j] - updates.arrival_delay[j]
+    # A loop visits the first stop more than once. The schedule counts from the service day's
+    # start, which is on a whole hour; only the right visit puts it there.
+    candidates = [k for k, s in enumerate(stop_index) if s == first]
+    anchor = min(candidates, key=lambda k: (scheduled - arrival[k]) % 3600 != 0)
+    base = scheduled - arrival[anchor]
+
+    listed = {s for s, _ in wanted}
+    stop_ids = store.stop_ids
+    delay = 0
+    next_wanted = 0
+    rows, arrivals, departures, delays = [], [], [], []
+    for k in range(anchor, end - start):
+        s = stop_index[k]
+        if next_wanted < len(wanted) and s == wanted[next_wanted][0]:
+            delay = updates.departure_delay[wanted[next_wanted][1]]
+            next_wanted += 1
+        elif s not in listed:
+            rows.append(stop_ids[s])
+            arrivals.append(base + arrival[k] + delay)
+            departures.append(base + departure[k] + delay)
+            delays.append(delay)
+    if not rows:
+        return None
+    return StopTimeUpdates(rows, arrivals, delays, departures, delays)
+
+
+def build_prediction_index(vehicles, predictions):
+    """stop_id -> [(vehicle, predicted, row)] over every vehicle's predicted stops."""
+    index = {}
+    for vehicle_id, predicted in predictions.items():
+        vehicle = vehicles.get(vehicle_id)
+        if vehicle is None:
+            continue
+        for row, stop_id in enumerate(predicted.stop_ids):
+            entries = index.get(stop_id)
+            if entries is None:
+                index[stop_id] = [(vehicle, predicted, row)]
+            else:
+                entries.append((vehicle, predicted, row))
+    return index
+
+
+class DelayPropagator:
+    """Predicted arrivals at the stops each running trip's updates omit, computed once per feed refresh.
+
+    A pass walks the StopTimesStore columns of every active trip and propagates the last known
+    delay forward. With the set of touched vehicle ids only those are recomputed; the rest keep
+    their predictions, which depend on nothing else. A pass stops at `budget` seconds: vehicles
+    left over keep no prediction and are done first on the next refresh. Not thread-safe; the
+    state manager calls it under its publish lock.
+    """
+
+    def __init__(self, budget=0.05):
+        self.budget = budget
+        self.store = None
+        self.predictions = {}
+        self.pending = set()
+        self._stop_rows = {}
+        self.stats = {"passes": 0, "seconds": 0.0, "vehicles": 0, "predicted_stops": 0, "deferred": 0, "overruns": 0}
+
+    def update(self, store, vehicles, touched=None):
+        """{vehicle_id: predicted StopTimeUpdates} for the feed `vehicles`; a new dict every call."""
+        started = time.perf_counter()
+        if store is not self.store:
+            # New static generation: every prediction was made against the old schedule.
+            self.store = store
+            self._stop_rows = {stop_id: s for s, stop_id in enumerate(store.stop_ids)} if store is not None else {}
+            touched = None
+        if touched is None:
+            predictions = {}
+            work = list(vehicles)
+        else:
+            predictions = {vehicle_id: p for vehicle_id, p in self.predictions.items()
+                           if vehicle_id not in touched and vehicle_id in vehicles}
+            work = [vehicle_id for vehicle_id in self.pending if vehicle_id in vehicles]
+            work += [vehicle_id for vehicle_id in touched if vehicle_id in vehicles and vehicle_id not in self.pending]
+
+        pending = set()
+        if store is not None:
+            deadline = started + self.budget
+            trip_index = store.trip_index
+            for i, vehicle_id in enumerate(work):
+                if i % 8 == 0 and time.perf_counter() > deadline:
+                    pending.update(work[i:])
+                    break
+                vehicle = vehicles[vehicle_id]
+                t = trip_index.get(vehicle.trip_id)
+                if t is None or not vehicle.updates:
+                    continue
+                predicted = propagate_trip(store, t, vehicle.updates, self._stop_rows)
+                if predicted is not None:
+                    predictions[vehicle_id] = predicted
+
+        self.predictions = predictions
+        self.pending = pending
+        seconds = time.perf_counter() - started
+        self.stats.update(passes=self.stats["passes"] + 1, seconds=seconds, vehicles=len(work) - len(pending),
+                          predicted_stops=sum(len(p) for p in predictions.values()), deferred=len(pending),
+                          overruns=self.stats["overruns"] + bool(pending))
+        return predictions
@@ -0,0 +1,122 @@
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from heapq import merge
+
+
+def service_day_start(service_date, tz):
+    """GTFS times count from "noon minus 12h" of the service date, which is midnight except on DST days.
+
+    The 12 hours are elapsed time, so they are subtracted in UTC: arithmetic on an aware
+    datetime is wall-clock and would always land on midnight.
+    """
+    noon = datetime(service_date.year, service_date.month, service_date.day, 12, tzinfo=tz)
+    return (noon.astimezone(timezone.utc) - timedelta(hours=12)).astimezone(tz)
+
+
+class DepartureBoards:
+    """Scheduled departures per (service date, stop), from stop_times filtered by calendar_dates.
+
+    Each service_id's board (stop -> departures sorted by time) is built once from the
+    StopTimesStore. The board of a service date merges the boards of the services active that
+    day and is memoized per set of services, so rolling over to a new date is usually a dict
+    lookup and at worst one merge; nothing is rebuilt at process start. Board entries are
+    (departure seconds array, trip index array) pairs searched with bisect.
+    """
+
+    def __init__(self, stop_times, trips, routes, service_dates, tz, keep_days=3):
+        self.stop_times = stop_times
+        self.trips = trips
+        self.routes = routes
+        self.service_dates = service_dates
+        self.tz = tz
+        self.keep_days = keep_days
+        self._service_boards = None
+        self._by_services = {}
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def _build_service_boards(self):
+        store = self.stop_times
+        rows_by_service = {}
+        for t, trip_id in enumerate(store.trip_ids):
+            service_id = self.trips.get(trip_id, {}).get("service_id")
+            if service_id is None:
+                continue
+            board = rows_by_service.setdefault(service_id, {})
+            for row in range(store.trip_start[t], store.trip_start[t + 1]):
+                board.setdefault(store.stop_index[row], []).append((store.departure[row], t))
+        stop_ids = store.stop_ids
+        return {service_id: {stop_ids[s]: sorted(rows) for s, rows in board.items()}
+                for service_id, board in rows_by_service.items()}
+
+    def _build_day(self, services):
+        per_stop = {}
+        for service_id in services:
+            for stop_id, rows in self._service_boards.get(service_id, {}).items():
+                per_stop.setdefault(stop_id, []).append(rows)
+        board = {}
+        for stop_id, parts in per_stop.items():
+            rows = list(merge(*parts)) if len(parts) > 1 else parts[0]
+            board[stop_id] = (array("i", [r[0] for r in rows]), array("i", [r[1] for r in rows]))
+        return board
+
+    def board(self, service_date):
+        """stop_id -> (departure seconds, trip indexes) for one service date (a datetime.date)."""
+        board = self._days.get(service_date)
+        if board is not None:
+            return board
+        with self._lock:
+            board = self._days.get(service_date)
+            if board is None:
+                if self._service_boards is None:
+                    self._service_boards = self._build_service_boards()
+                services = frozenset(self.service_dates.get(service_date.strftime("%Y%m%d"), ()))
+                board = self._by_services.get(services)
+                if board is None:
+                    board = self._by_services[services] = self._build_day(services)
+                self._days[service_date] = board
+            return board
+
+    def roll_over(self, today):
+        """Makes sure yesterday's and today's boards exist and forgets older ones; call after midnight."""
+        for service_date in (today - timedelta(days=1), today):
+            self.board(service_date)
+        with self._lock:
+            oldest = today - timedelta(days=self.keep_days - 1)
+            self._days = {d: b for d, b in self._days.items() if d >= oldest}
+            in_use = {id(b) for b in self._days.values()}
+            self._by_services = {s: b for s, b in self._by_services.items() if id(b) in in_use}
+
+    def next_departures(self, stop_id, now, n=10):
+        """The next n scheduled departures from stop_id at or after `now` (an aware datetime).
+
+        Yesterday's service date is searched too, for trips running past midnight (24:xx times).
+        """
+        now = now.astimezone(self.tz)
+        candidates = []
+        for service_date in (now.date() - timedelta(days=1), now.date()):
+            entry = self.board(service_date).get(stop_id)
+            if entry is None:
+                continue
+            times, trip_indexes = entry
+            # Elapsed seconds since the day start: now - day_start would be wall-clock, an hour off on DST days.
+            base = int(service_day_start(service_date, self.tz).timestamp())
+            i = bisect_left(times, int(now.timestamp()) - base)
+            candidates.extend((base + times[k], trip_indexes[k]) for k in range(i, min(i + n, len(times))))
+        candidates.sort()
+
+        departures = []
+        for timestamp, t in candidates[:n]:
+            trip_id = self.stop_times.trip_ids[t]
+            trip = self.trips.get(trip_id, {})
+            route_id = trip.get("route_id", "")
+            departures.append({
+                "trip_id": trip_id,
+                "route_id": route_id,
+                "route_number": self.routes.get(route_id, {}).get("route_short_name", ""),
+                "headsign": trip.get("trip_headsign", ""),
+                "scheduled_time": timestamp,
+            })
+        return departures
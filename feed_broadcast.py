@@ -0,0 +1,117 @@
+import threading
+from collections import deque
+
+
+def sse_message(event, data, event_id=None):
+    """One Server-Sent Events frame; data is already serialized JSON bytes."""
+    frame = b"event: " + event.encode("utf-8") + b"\n"
+    if event_id is not None:
+        frame += b"id: " + str(event_id).encode("utf-8") + b"\n"
+    return frame + b"data: " + data + b"\n\n"
+
+
+KEEPALIVE = b": keepalive\n\n"
+
+
+class Subscriber:
+    """Bounded mailbox of one push client.
+
+    A client that falls max_queue messages behind loses its backlog and is sent the latest
+    full snapshot instead, so a slow reader costs bounded memory and never blocks publish().
+    """
+    __slots__ = ("broadcaster", "max_queue", "queue", "lagged", "resyncs", "cond")
+
+    def __init__(self, broadcaster, max_queue):
+        self.broadcaster = broadcaster
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.lagged = True  # the first thing every subscriber gets is a full snapshot
+        self.resyncs = 0
+        self.cond = threading.Condition(threading.Lock())
+
+    def offer(self, message):
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                self.queue.clear()
+                self.lagged = True
+                self.resyncs += 1
+            elif not self.lagged:
+                self.queue.append(message)
+            self.cond.notify()
+
+    def resync(self):
+        """Drops the backlog; the next frame will be the latest full snapshot."""
+        with self.cond:
+            self.queue.clear()
+            self.lagged = True
+            self.cond.notify()
+
+    def next(self, timeout=None):
+        """Next frame to send, or None if nothing arrived within timeout."""
+        with self.cond:
+            if not self.queue and (not self.lagged or self.broadcaster.snapshot is None):
+                self.cond.wait(timeout)
+            if self.lagged:
+                snapshot = self.broadcaster.snapshot
+                if snapshot is None:
+                    return None
+                self.lagged = False
+                return snapshot
+            if self.queue:
+                return self.queue.popleft()
+            return None
+
+
+class FeedBroadcaster:
+    """Fans each feed version out to every push subscriber, serialized once.
+
+    Under a threaded server every open stream holds a thread for as long as it lasts, so
+    max_subscribers (None for no limit) caps them; subscribe() returns None past the cap.
+    """
+
+    def __init__(self, max_queue=16, max_subscribers=None):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.snapshot = None
+        self.version = None
+        self.rejected = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """A new Subscriber, or None if max_subscribers are already connected."""
+        subscriber = Subscriber(self, self.max_queue)
+        with self._lock:
+            if self.max_subscribers is not None and len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, version, snapshot, delta=None):
+        """snapshot and delta are finished SSE frames for this version; delta may be None."""
+        self.snapshot = snapshot
+        self.version = version
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if delta is None:
+                subscriber.resync()
+            else:
+                subscriber.offer(delta)
+
+    def stream(self, subscriber, keepalive=15):
+        """Generator of SSE frames for one HTTP response; unsubscribes when the client goes away."""
+        try:
+            while True:
+                message = subscriber.next(timeout=keepalive)
+                yield message if message is not None else KEEPALIVE
+        finally:
+            self.unsubscribe(subscriber)
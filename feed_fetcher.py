@@ -0,0 +1,153 @@
+import hashlib
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+
+
+class FeedFetchError(Exception):
+    """The upstream could not be fetched after all retries."""
+
+
+# Worth retrying: the upstream or the network may recover within the backoff window.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_timeout(error):
+    """True for a requests Timeout, and for the ConnectionError requests raises when reading the body times out."""
+    if isinstance(error, requests.Timeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(cause, ReadTimeoutError) or isinstance(error.__context__, ReadTimeoutError)
+
+
+class FeedFetcher:
+    """Pooled, time-bounded GTFS-RT downloader.
+
+    Keeps one keep-alive session, sends If-None-Match/If-Modified-Since, retries transient
+    failures with full-jitter exponential backoff and skips payloads whose hash has not
+    changed. fetch() returns the new payload, or None when there is nothing new to parse.
+    New payloads are also handed to `recorder` (a feed_recorder.FeedRecorder), if given.
+    """
+
+    def __init__(self, url, connect_timeout=3.05, read_timeout=10, retries=3, backoff=0.5, max_backoff=8,
+                 pool_size=2, recorder=None):
+        self.url = url
+        self.recorder = recorder
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.etag = None
+        self.last_modified = None
+        self.payload_hash = None
+        self._fetch_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "fetches": 0,         # fetch() calls
+            "requests": 0,        # HTTP attempts, including retries
+            "updated": 0,         # new payloads returned
+            "not_modified": 0,    # 304 from the upstream
+            "unchanged": 0,       # 200 with the same payload hash
+            "errors": 0,          # failed attempts (timeouts, connection errors, bad statuses)
+            "timeouts": 0,
+            "retries": 0,
+            "failures": 0,        # fetch() calls that gave up
+            "last_latency_ms": None,  # per HTTP attempt
+            "max_latency_ms": 0.0,
+            "total_latency_ms": 0.0,
+            "last_error": None,
+            "last_success": None,  # unix time of the last 200/304
+            "last_payload_bytes": None,
+        }
+
+    def _count(self, **changes):
+        with self._stats_lock:
+            for key, value in changes.items():
+                self.stats[key] += value
+
+    def _record_latency(self, seconds):
+        ms = seconds * 1000
+        with self._stats_lock:
+            self.stats["last_latency_ms"] = ms
+            self.stats["max_latency_ms"] = max(self.stats["max_latency_ms"], ms)
+            self.stats["total_latency_ms"] += ms
+
+    def stats_snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["mean_latency_ms"] = stats["total_latency_ms"] / stats["requests"] if stats["requests"] else None
+        return stats
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def _get(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count(retries=1)
+                self._sleep_before_retry(attempt - 1)
+            self._count(requests=1)
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+                # Read the body here so a stalled upstream trips the read timeout inside the retry loop.
+                response.content
+            except requests.RequestException as e:
+                self._count(errors=1, timeouts=int(is_timeout(e)))
+                error = e
+            self._record_latency(time.perf_counter() - start)
+
+            if response is not None:
+                if response.status_code in (200, 304):
+                    return response
+                self._count(errors=1)
+                error = FeedFetchError(f"HTTP {response.status_code} from {self.url}")
+            with self._stats_lock:
+                self.stats["last_error"] = f"{type(error).__name__}: {error}"
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                break
+
+        self._count(failures=1)
+        raise FeedFetchError(f"Giving up on {self.url}: {error}") from error
+
+    def fetch(self):
+        with self._fetch_lock:
+            self._count(fetches=1)
+            response = self._get()
+            with self._stats_lock:
+                self.stats["last_success"] = time.time()
+            if response.status_code == 304:
+                self._count(not_modified=1)
+                return None
+
+            content = response.content
+            with self._stats_lock:
+                self.stats["last_payload_bytes"] = len(content)
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            digest = hashlib.sha256(content).digest()
+            if digest == self.payload_hash:
+                self._count(unchanged=1)
+                return None
+            self.payload_hash = digest
+            self._count(updated=1)
+            if self.recorder is not None:
+                self.recorder.record(content)
+            return content
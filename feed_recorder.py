@@ -0,0 +1,114 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+# Append-only log of fetched GTFS-RT payloads, one file per UTC day (feeds-YYYYMMDD.log).
+# Record = header (magic, fetch time as unix seconds, raw length, compressed length, crc32 of
+# the raw payload) + zlib-compressed payload. A record torn by a crash mid-write is ignored
+# by the reader and trimmed by the next FeedRecorder before it appends.
+RECORD_MAGIC = b"GRT1"
+RECORD_HEADER = struct.Struct("<4sdIII")
+LOG_PREFIX = "feeds-"
+LOG_SUFFIX = ".log"
+
+
+class FeedRecorder:
+    """Archives every new payload the fetcher returns, for replay_server.py and the benchmarks."""
+
+    def __init__(self, directory, level=6):
+        self.directory = directory
+        self.level = level
+        self.stats = {"records": 0, "raw_bytes": 0, "stored_bytes": 0, "errors": 0, "last_error": None}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        existing = log_files(directory)
+        if existing:
+            trim_torn_tail(existing[-1])
+
+    def log_path(self, fetched_at):
+        day = datetime.fromtimestamp(fetched_at, timezone.utc).strftime("%Y%m%d")
+        return os.path.join(self.directory, f"{LOG_PREFIX}{day}{LOG_SUFFIX}")
+
+    def record(self, payload, fetched_at=None):
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        compressed = zlib.compress(payload, self.level)
+        record = RECORD_HEADER.pack(RECORD_MAGIC, fetched_at, len(payload), len(compressed),
+                                    zlib.crc32(payload)) + compressed
+        with self._lock:
+            try:
+                # One write per record on an O_APPEND descriptor: concurrent writers can't interleave.
+                fd = os.open(self.log_path(fetched_at), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, record)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = str(e)
+                print(f"⚠️ Could not record feed: {e}")
+                return False
+            self.stats["records"] += 1
+            self.stats["raw_bytes"] += len(payload)
+            self.stats["stored_bytes"] += len(record)
+        return True
+
+    def stats_snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+def log_files(path):
+    """The log files under path (a log file or a recorder directory), oldest first."""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.startswith(LOG_PREFIX) and name.endswith(LOG_SUFFIX))
+
+
+def trim_torn_tail(log_file):
+    """Cuts a log file back to its last complete record; returns the number of bytes dropped."""
+    size = os.path.getsize(log_file)
+    end = 0
+    with open(log_file, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            magic, _, _, stored_length, _ = RECORD_HEADER.unpack(header)
+            if magic != RECORD_MAGIC or end + RECORD_HEADER.size + stored_length > size:
+                break
+            end += RECORD_HEADER.size + stored_length
+            f.seek(end)
+    if end < size:
+        os.truncate(log_file, end)
+        print(f"⚠️ {log_file}: dropped {size - end} bytes of an incomplete record")
+    return size - end
+
+
+def iter_log(path, since=None, until=None):
+    """Yields (fetched_at, payload) from a log file or recorder directory, in recording order."""
+    for log_file in log_files(path):
+        with open(log_file, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, fetched_at, raw_length, stored_length, crc = RECORD_HEADER.unpack(header)
+                if magic != RECORD_MAGIC:
+                    print(f"⚠️ {log_file}: bad record at byte {f.tell() - RECORD_HEADER.size}, skipping the rest")
+                    break
+                compressed = f.read(stored_length)
+                if len(compressed) < stored_length:
+                    break  # torn last record
+                if since is not None and fetched_at < since:
+                    continue
+                if until is not None and fetched_at >= until:
+                    return
+                payload = zlib.decompress(compressed)
+                if len(payload) != raw_length or zlib.crc32(payload) != crc:
+                    print(f"⚠️ {log_file}: corrupt record at {fetched_at}, skipped")
+                    continue
+                yield fetched_at, payload
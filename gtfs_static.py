@@ -0,0 +1,500 @@
+import csv
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import resource
+import struct
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from shape_store import ShapesBuilder, merge_shapes
+from stop_times_store import StopTimesBuilder, merge_stores
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# GTFS static paths
+STATIC_DATA_FOLDERS = [
+    "static_data/2_google_transit/",
+    "static_data/4_google_transit/",
+    "static_data/5_google_transit/",
+    "static_data/6_google_transit/",
+    "static_data/9_google_transit/",
+    "static_data/10_google_transit/",
+    "static_data/11_google_transit/"
+]
+
+ROUTES_FILE = "routes.txt"
+STOPS_FILE = "stops.txt"
+TRIPS_FILE = "trips.txt"
+STOP_TIMES_FILE = "stop_times.txt"
+SHAPES_FILE = "shapes.txt"
+CALENDAR_DATES_FILE = "calendar_dates.txt"
+SOURCE_FILES = [ROUTES_FILE, STOPS_FILE, TRIPS_FILE, STOP_TIMES_FILE, SHAPES_FILE, CALENDAR_DATES_FILE]
+
+# Binary snapshot: fixed header, then a body holding a buffer table, a protocol 5 pickle and the
+# pickle's out-of-band buffers (the stop_times and shapes columns), each 8-byte aligned.
+# Header = magic, format version, sha256 of the source CSVs, sha256 of the body, body length, buffer count.
+SNAPSHOT_PATH = "static_data/gtfs_static.snapshot"
+SNAPSHOT_MAGIC = b"GTFSSNAP"
+SNAPSHOT_FORMAT_VERSION = 4
+_HEADER = struct.Struct("<8sI32s32sQI")
+_BUFFER_ENTRY = struct.Struct("<QQ")
+# Per-feed snapshots (one FeedData each), so a changed feed can be re-parsed on its own.
+FEED_SNAPSHOT_DIR = "static_data/.snapshots"
+
+# One feed folder, parsed. calendar_dates is [(date, service_id, exception_type)] in file order.
+FeedData = namedtuple("FeedData", ["routes", "stops", "trips", "stop_times", "shapes", "calendar_dates"])
+
+
+def load_feed_csv(folder, timings=None):
+    """Parses the GTFS CSV (TXT) files of one feed folder into a FeedData.
+
+    If given, `timings` is filled with the seconds spent per file (and on "build", sorting the columns).
+    """
+    routes_dict = {}
+    stops_data = []
+    trips_dict = {}
+    stop_times = StopTimesBuilder()
+    shapes = ShapesBuilder()
+    calendar_dates = []
+    clock = [time.perf_counter()]
+
+    def mark(name):
+        now = time.perf_counter()
+        if timings is not None:
+            timings[name] = now - clock[0]
+        clock[0] = now
+
+    def finish():
+        feed = FeedData(routes_dict, stops_data, trips_dict, stop_times.build(), shapes.build(), calendar_dates)
+        mark("build")
+        return feed
+
+    # --- Load Routes ---
+    path = os.path.join(folder, ROUTES_FILE)
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None or "route_id" not in reader.fieldnames:
+                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
+                return finish()
+            for row in reader:
+                routes_dict[row["route_id"]] = row
+    except FileNotFoundError:
+        print(f"⚠️ {ROUTES_FILE} not found in {folder}, skipping.")
+    except Exception as e:
+        print(f"❌ Error loading {path}: {e}")
+    mark(ROUTES_FILE)
+
+    # --- Load Stops ---
+    path = os.path.join(folder, STOPS_FILE)
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None or "stop_id" not in reader.fieldnames:
+                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
+                return finish()
+            for row in reader:
+                stops_data.append(row)
+    except FileNotFoundError:
+        print(f"⚠️ {STOPS_FILE} not found in {folder}, skipping.")
+    except Exception as e:
+        print(f"❌ Error loading {path}: {e}")
+    mark(STOPS_FILE)
+
+    # --- Load Trips ---
+    path = os.path.join(folder, TRIPS_FILE)
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None or "trip_id" not in reader.fieldnames:
+                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
+                return finish()
+            for row in reader:
+                trips_dict[row["trip_id"]] = row
+    except FileNotFoundError:
+        print(f"⚠️ {TRIPS_FILE} not found in {folder}, skipping.")
+    except Exception as e:
+        print(f"❌ Error loading {path}: {e}")
+    mark(TRIPS_FILE)
+
+    # --- Load Stop Times ---
+    path = os.path.join(folder, STOP_TIMES_FILE)
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None or "trip_id" not in reader.fieldnames:
+                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
+                return finish()
+            for row in reader:
+                try:
+                    stop_times.add(row["trip_id"], row["stop_id"], row["arrival_time"],
+                                   row["departure_time"], row["stop_sequence"])
+                except KeyError as ke:
+                    print(f"⚠️ Missing key in {path}: {ke}")
+                except ValueError:
+                    print(f"⚠️ Invalid stop_sequence or time in {path}: {row.get('stop_sequence')}")
+    except FileNotFoundError:
+        print(f"⚠️ {STOP_TIMES_FILE} not found in {folder}, skipping.")
+    except Exception as e:
+        print(f"❌ Error loading {path}: {e}")
+    mark(STOP_TIMES_FILE)
+
+    # --- Load Shapes ---
+    path = os.path.join(folder, SHAPES_FILE)
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None or "shape_id" not in reader.fieldnames:
+                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
+                return finish()
+            for row in reader:
+                try:
+                    shapes.add(row["shape_id"], row["shape_pt_lat"], row["shape_pt_lon"], row["shape_pt_sequence"])
+                except KeyError as ke:
+                    print(f"⚠️ Missing key in {path}: {ke}")
+                except ValueError:
+                    print(f"⚠️ Invalid shape point in {path}: {row.get('shape_pt_sequence')}")
+    except FileNotFoundError:
+        print(f"⚠️ {SHAPES_FILE} not found in {folder}, skipping.")
+    except Exception as e:
+        print(f"❌ Error loading {path}: {e}")
+    mark(SHAPES_FILE)
+
+    # --- Load Calendar Dates ---
+    path = os.path.join(folder, CALENDAR_DATES_FILE)
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None or "service_id" not in reader.fieldnames:
+                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
+                return finish()
+            for row in reader:
+                calendar_dates.append((row["date"], row["service_id"], row["exception_type"]))
+    except FileNotFoundError:
+        print(f"⚠️ {CALENDAR_DATES_FILE} not found in {folder}, skipping.")
+    except Exception as e:
+        print(f"❌ Error loading {path}: {e}")
+    mark(CALENDAR_DATES_FILE)
+
+    return finish()
+
+
+def merge_feeds(feeds):
+    """(routes_dict, stops_data, trips_dict, stop_times_store, shape_store, service_dates) from
+    per-feed FeedData, in folder order, later feeds overriding earlier ones."""
+    routes_dict = {}
+    stops_data = []
+    trips_dict = {}
+    service_dates = {}
+    for feed in feeds:
+        routes_dict.update(feed.routes)
+        stops_data.extend(feed.stops)
+        trips_dict.update(feed.trips)
+        for day, service_id, exception_type in feed.calendar_dates:
+            services = service_dates.setdefault(day, set())
+            # exception_type 1 adds the service on that date, 2 removes it
+            if exception_type == "2":
+                services.discard(service_id)
+            else:
+                services.add(service_id)
+
+    # Fresh trip rows, so attaching this store never touches rows an older generation is still serving.
+    trips_dict = {trip_id: dict(row) for trip_id, row in trips_dict.items()}
+    stop_times_store = merge_stores([feed.stop_times for feed in feeds])
+    stop_times_store.attach(trips_dict)
+
+    # service date (YYYYMMDD) -> sorted service_ids running that day
+    service_dates = {day: sorted(services) for day, services in service_dates.items()}
+    return (routes_dict, stops_data, trips_dict, stop_times_store,
+            merge_shapes([feed.shapes for feed in feeds]), service_dates)
+
+
+def load_static_csv(folders=STATIC_DATA_FOLDERS):
+    """Parses the GTFS CSV (TXT) files of every feed folder, later feeds overriding earlier ones."""
+    return merge_feeds([load_feed_csv(folder) for folder in folders])
+
+
+def feed_hash(folder):
+    """sha256 over the name and contents of every source file the loader reads from one folder."""
+    digest = hashlib.sha256()
+    for name in SOURCE_FILES:
+        path = os.path.join(folder, name)
+        digest.update(path.encode("utf-8") + b"\0")
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            digest.update(b"<missing>")
+        digest.update(b"\0")
+    return digest.digest()
+
+
+def feed_hashes(folders=STATIC_DATA_FOLDERS):
+    return {folder: feed_hash(folder) for folder in folders}
+
+
+def source_hash(folders=STATIC_DATA_FOLDERS, hashes=None):
+    """sha256 over every folder's feed_hash, in folder order."""
+    hashes = hashes or feed_hashes(folders)
+    digest = hashlib.sha256()
+    for folder in folders:
+        digest.update(folder.encode("utf-8") + b"\0" + hashes[folder])
+    return digest.digest()
+
+
+def feed_snapshot_path(folder):
+    return os.path.join(FEED_SNAPSHOT_DIR, os.path.basename(os.path.normpath(folder)) + ".snapshot")
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_snapshot(data, src_hash, path=SNAPSHOT_PATH):
+    """Writes the snapshot next to its final location and renames it into place."""
+    buffers = []
+    payload = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+    raw = [b.raw() for b in buffers]
+
+    position = _BUFFER_ENTRY.size * len(raw) + len(payload)
+    entries, chunks = [], [payload]
+    for buf in raw:
+        offset = _align(position)
+        chunks.append(bytes(offset - position))
+        entries.append(_BUFFER_ENTRY.pack(offset, buf.nbytes))
+        chunks.append(buf)
+        position = offset + buf.nbytes
+    body = b"".join(entries + chunks)
+
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, src_hash,
+                          hashlib.sha256(body).digest(), len(body), len(raw))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+    os.replace(tmp_path, path)
+    return _HEADER.size + len(body)
+
+
+def build_snapshot(path=SNAPSHOT_PATH, folders=STATIC_DATA_FOLDERS):
+    """Compiles the static CSV feeds into a binary snapshot, plus one snapshot per feed."""
+    hashes = feed_hashes(folders)
+    src_hash = source_hash(folders, hashes)
+    feeds = []
+    for folder in folders:
+        feeds.append(load_feed_csv(folder))
+        write_snapshot(feeds[-1], hashes[folder], feed_snapshot_path(folder))
+    data = merge_feeds(feeds)
+    size = write_snapshot(data, src_hash, path)
+    print(f"📦 Wrote {path} ({size / 1e6:.1f} MB, source {src_hash.hex()[:12]})")
+    return data
+
+
+def load_snapshot(path=SNAPSHOT_PATH, src_hash=None):
+    """Memory-maps and validates a snapshot. Returns None if it is missing, stale or corrupt.
+
+    The mapping stays open for as long as the loaded columns reference it, so
+    their pages are shared through the page cache rather than copied onto the heap. On any
+    early return the views go out of scope and the mapping is closed with them.
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    except ValueError:  # empty file
+        print(f"⚠️ Snapshot {path} is truncated, ignoring it.")
+        return None
+
+    if len(mm) < _HEADER.size:
+        print(f"⚠️ Snapshot {path} is truncated, ignoring it.")
+        return None
+    magic, version, snap_src_hash, body_hash, length, n_buffers = _HEADER.unpack_from(mm, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+        print(f"⚠️ Snapshot {path} has an unsupported format, ignoring it.")
+        return None
+    if src_hash is not None and snap_src_hash != src_hash:
+        print(f"⚠️ Snapshot {path} is stale (static data changed).")
+        return None
+    if len(mm) != _HEADER.size + length:
+        print(f"⚠️ Snapshot {path} is truncated, ignoring it.")
+        return None
+
+    body = memoryview(mm)[_HEADER.size:]
+    if hashlib.sha256(body).digest() != body_hash:
+        print(f"⚠️ Snapshot {path} failed its checksum, ignoring it.")
+        return None
+
+    # Bytes past the pickle's STOP opcode (alignment padding, buffers) are ignored by loads().
+    table_size = _BUFFER_ENTRY.size * n_buffers
+    entries = [_BUFFER_ENTRY.unpack_from(body, i * _BUFFER_ENTRY.size) for i in range(n_buffers)]
+    buffers = [body[offset:offset + size] for offset, size in entries]
+    return pickle.loads(body[table_size:], buffers=buffers)
+
+
+def load_feed(folder, src_hash=None):
+    """One folder's FeedData from its snapshot, or parsed from CSV (and snapshotted) if that is stale."""
+    src_hash = src_hash or feed_hash(folder)
+    path = feed_snapshot_path(folder)
+    feed = load_snapshot(path, src_hash)
+    if feed is not None:
+        return feed
+    feed = load_feed_csv(folder)
+    try:
+        write_snapshot(feed, src_hash, path)
+    except OSError as e:
+        print(f"⚠️ Could not write snapshot {path}: {e}")
+    return feed
+
+
+def build_feed_snapshot(folder, src_hash=None):
+    """Parses one folder and writes its snapshot; meant to run in a worker process.
+
+    Only the timing report comes back over the pipe: the parent maps the snapshot file instead.
+    """
+    start = time.perf_counter()
+    src_hash = src_hash or feed_hash(folder)
+    timings = {}
+    feed = load_feed_csv(folder, timings)
+    write_start = time.perf_counter()
+    write_snapshot(feed, src_hash, feed_snapshot_path(folder))
+    timings["write"] = time.perf_counter() - write_start
+    return {
+        "folder": folder,
+        "source": "csv",
+        "seconds": time.perf_counter() - start,
+        "files": timings,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def parse_feeds(folders, hashes=None, workers=None):
+    """Runs build_feed_snapshot for every folder on a process pool; returns {folder: report}.
+
+    Biggest feeds are submitted first so one large feed doesn't start last. Forks, so call it
+    before the process starts any threads. A folder whose job failed has no report.
+    """
+    hashes = hashes or feed_hashes(folders)
+    workers = workers or min(len(folders), os.cpu_count() or 1)
+    if workers <= 1 or len(folders) <= 1:
+        return {folder: build_feed_snapshot(folder, hashes[folder]) for folder in folders}
+
+    def size(folder):
+        return sum(os.path.getsize(os.path.join(folder, name)) for name in SOURCE_FILES
+                   if os.path.exists(os.path.join(folder, name)))
+
+    reports = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        jobs = {folder: pool.submit(build_feed_snapshot, folder, hashes[folder])
+                for folder in sorted(folders, key=size, reverse=True)}
+        for folder, job in jobs.items():
+            try:
+                reports[folder] = job.result()
+            except Exception as e:
+                print(f"❌ Parsing {folder} in a worker failed: {e}")
+    return reports
+
+
+def parse_feeds_isolated(folders, timeout=600):
+    """parse_feeds run by `python -m gtfs_static` in a fresh interpreter; returns {folder: report}.
+
+    For callers that may have threads: parse_feeds forks, and a lock another thread holds at
+    fork time stays held in the child. The new interpreter has no threads, so its pool can fork;
+    multiprocessing's spawn would instead re-import the whole app as __main__.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [MODULE_DIR, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-m", "gtfs_static", *folders], env=env, capture_output=True,
+                            text=True, timeout=timeout)
+    reports = {}
+    for line in result.stdout.splitlines():
+        if line.startswith("{"):
+            feed_report = json.loads(line)
+            reports[feed_report["folder"]] = feed_report
+        else:
+            print(line)
+    if result.returncode != 0:
+        raise RuntimeError(f"Feed parser exited with {result.returncode}: {result.stderr.strip()[-500:]}")
+    return reports
+
+
+def print_load_report(report):
+    print(f"📊 Static GTFS loaded in {report['seconds']:.2f}s ({report['source']})")
+    for feed in report.get("feeds", []):
+        files = ", ".join(f"{name} {seconds:.2f}" for name, seconds in feed.get("files", {}).items())
+        print(f"   {feed['folder']:<32} {feed['source']:<8} {feed['seconds']:6.2f}s  {files}")
+    if "merge_seconds" in report:
+        print(f"   merge {report['merge_seconds']:.2f}s")
+
+
+def load_static_data(folders=STATIC_DATA_FOLDERS, snapshot_path=SNAPSHOT_PATH, hashes=None, workers=None, report=None,
+                     isolated=False):
+    """Loads (routes_dict, stops_data, trips_dict, stop_times_store, shape_store, service_dates), re-parsing
+    only the feeds whose CSVs changed, in parallel.
+
+    `hashes` are precomputed feed_hashes(folders). `report`, if given, is filled with the
+    per-feed and per-file timings that are also printed. Pass isolated=True from a process
+    that has (or may have) threads: the parse then runs in a child interpreter instead of forking.
+    """
+    start = time.perf_counter()
+    report = report if report is not None else {}
+    hashes = hashes or feed_hashes(folders)
+    src_hash = source_hash(folders, hashes)
+    data = load_snapshot(snapshot_path, src_hash)
+    if data is not None:
+        report.update(source="snapshot", seconds=time.perf_counter() - start)
+        return data
+
+    feeds, feed_reports = {}, {}
+    for folder in folders:
+        feed_start = time.perf_counter()
+        feeds[folder] = load_snapshot(feed_snapshot_path(folder), hashes[folder])
+        feed_reports[folder] = {"folder": folder, "source": "snapshot", "seconds": time.perf_counter() - feed_start}
+    stale = [folder for folder in folders if feeds[folder] is None]
+    if stale:
+        print(f"📄 Loading static GTFS from CSV ({len(stale)} of {len(folders)} feeds)...")
+        if isolated:
+            try:
+                feed_reports.update(parse_feeds_isolated(stale))
+            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                print(f"❌ Parsing feeds in a child process failed: {e}")
+        else:
+            feed_reports.update(parse_feeds(stale, hashes, workers))
+        for folder in stale:
+            feeds[folder] = load_snapshot(feed_snapshot_path(folder), hashes[folder])
+            if feeds[folder] is None:
+                # No worker result (e.g. the snapshot directory is read-only): parse it here, without forking.
+                feed_start = time.perf_counter()
+                timings = {}
+                feeds[folder] = load_feed_csv(folder, timings)
+                feed_reports[folder] = {"folder": folder, "source": "csv", "files": timings,
+                                        "seconds": time.perf_counter() - feed_start}
+
+    # Merged in folder order whatever order the workers finished in, so later feeds still win.
+    merge_start = time.perf_counter()
+    data = merge_feeds([feeds[folder] for folder in folders])
+    try:
+        write_snapshot(data, src_hash, snapshot_path)
+    except OSError as e:
+        print(f"⚠️ Could not write snapshot {snapshot_path}: {e}")
+    report.update(source="csv" if stale else "feed snapshots", seconds=time.perf_counter() - start,
+                  merge_seconds=time.perf_counter() - merge_start,
+                  feeds=[feed_reports[folder] for folder in folders])
+    print_load_report(report)
+    return data
+
+
+if __name__ == "__main__":
+    # python -m gtfs_static <folder>...: (re)writes the per-feed snapshots in parallel, one JSON report line per feed.
+    # Go through the imported module, or FeedData would be pickled as __main__.FeedData.
+    import gtfs_static
+    for feed_report in gtfs_static.parse_feeds(sys.argv[1:]).values():
+        print(json.dumps(feed_report), flush=True)
@@ -0,0 +1,56 @@
+# Multi-worker deployment:  gunicorn -c gunicorn.conf.py main:app
+#
+# The app is imported once in the master (preload_app). Importing main no longer loads the
+# static GTFS data; when_ready does, before any worker forks, so it is loaded a single time
+# and shared with the workers copy-on-write; the stop_times columns are views into the
+# memory-mapped snapshot and are shared through the page cache. With PRELOAD_STATIC=0 the
+# workers fork at once, answer / and /healthz right away and each load the data itself
+# (/readyz turns 200 when it has). Each worker then starts main.start_shared_feed_updates: one of them wins the poller election and
+# fetches GTFS-RT, the rest pick the decoded feed up from shared memory. Every worker also
+# watches static_data/ and swaps in reloaded static data; a file lock lets the first one do
+# the parsing while the others map the snapshot it writes.
+import gc
+import os
+import subprocess
+import sys
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", "16"))
+preload_app = True
+# A push stream would hold a worker thread for as long as it is open, so streams are served by
+# stream_server.py: one asyncio process, started here, that follows the same live state channel
+# as the workers and holds thousands of connections. The workers redirect /vehicle_positions/stream
+# to it (STREAM_URL; set it yourself when a proxy puts the stream elsewhere, e.g. on the same origin).
+# With STREAM_BIND="" the workers stream themselves, at most STREAM_MAX_SUBSCRIBERS each.
+STREAM_BIND = os.environ.get("STREAM_BIND", "0.0.0.0:8001")
+if STREAM_BIND:
+    os.environ.setdefault("STREAM_URL", ":" + STREAM_BIND.rpartition(":")[2] + "/vehicle_positions/stream")
+stream_process = None
+FEED_INTERVAL = int(os.environ.get("FEED_INTERVAL", "60"))
+STATIC_RELOAD_INTERVAL = int(os.environ.get("STATIC_RELOAD_INTERVAL", "30"))
+PRELOAD_STATIC = os.environ.get("PRELOAD_STATIC", "1") == "1"
+
+
+def when_ready(server):
+    global stream_process
+    import main
+    if STREAM_BIND:
+        stream_process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        "stream_server.py"), STREAM_BIND])
+    if PRELOAD_STATIC:
+        main.runtime.load()
+    # Move everything loaded so far out of the GC's reach, so collections in the workers
+    # don't write to (and un-share) the static data pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import main
+    main.start_background_jobs(feed_interval=FEED_INTERVAL, reload_interval=STATIC_RELOAD_INTERVAL, shared=True)
+
+
+def on_exit(server):
+    if stream_process is not None:
+        stream_process.terminate()
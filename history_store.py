@@ -0,0 +1,255 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+# One SQLite database (WAL mode) per UTC day: history-YYYYMMDD.sqlite. Rows are only ever
+# appended; retention drops whole day files. `positions` has one row per vehicle per feed
+# version it changed in; `stop_events` one row per stop a vehicle left, with the departure
+# delay it last reported for that stop. positions is indexed by vehicle, trip and route,
+# stop_events by route (covering the on-time query) and stop.
+PARTITION_PREFIX = "history-"
+PARTITION_SUFFIX = ".sqlite"
+MAX_TRAIL_POINTS = 10000
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    ts INTEGER NOT NULL, version INTEGER NOT NULL, vehicle_id TEXT NOT NULL, trip_id TEXT, route_id TEXT,
+    lat REAL, lon REAL, next_stop_id TEXT, delay INTEGER);
+CREATE INDEX IF NOT EXISTS positions_vehicle ON positions (vehicle_id, ts);
+CREATE INDEX IF NOT EXISTS positions_trip ON positions (trip_id, ts);
+CREATE INDEX IF NOT EXISTS positions_route ON positions (route_id, ts);
+CREATE TABLE IF NOT EXISTS stop_events (
+    ts INTEGER NOT NULL, vehicle_id TEXT NOT NULL, trip_id TEXT, route_id TEXT, stop_id TEXT NOT NULL,
+    scheduled INTEGER NOT NULL, delay INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS stop_events_route ON stop_events (route_id, ts, stop_id, delay);
+CREATE INDEX IF NOT EXISTS stop_events_stop ON stop_events (stop_id, ts);
+"""
+
+
+def partition_day(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d")
+
+
+class HistoryStore:
+    """Append-only history of vehicle positions and delays, written in batches off the request path.
+
+    record() only queues the feed's changes; a writer thread, started by the first record() of
+    the process, turns them into rows and commits everything queued in one transaction per
+    partition. When the queue is full new feeds are dropped (and counted) rather than
+    holding up the feed refresh. Queries open the day files they span read-only.
+    """
+
+    def __init__(self, directory, keep_days=90, max_pending=64):
+        self.directory = directory
+        self.keep_days = keep_days
+        self.stats = {"feeds": 0, "batches": 0, "positions": 0, "stop_events": 0, "dropped": 0, "errors": 0,
+                      "last_error": None, "last_batch_seconds": 0.0}
+        self._queue = queue.Queue(max_pending)
+        self._writer = None
+        self._lock = threading.Lock()
+        # vehicle_id -> (trip_id, route_id, stop_id, departure_time, departure_delay) of its next stop
+        self._next_stop = {}
+        self._connections = {}
+        # (day, route_id, stop_id, early, late) -> on-time totals of a closed day, least recently added first
+        self._day_totals = OrderedDict()
+        self.max_day_totals = 100000
+        os.makedirs(directory, exist_ok=True)
+
+    def partition_path(self, day):
+        return os.path.join(self.directory, f"{PARTITION_PREFIX}{day}{PARTITION_SUFFIX}")
+
+    def record(self, version, feed_timestamp, changes, trips):
+        """Queues one published feed (a live_feed.FeedChanges); `trips` maps trip_id to its static row."""
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, daemon=True)
+                self._writer.start()
+        try:
+            self._queue.put_nowait((version, feed_timestamp or int(time.time()), changes, trips))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            try:
+                self.write(items)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = str(e)
+                print(f"⚠️ Could not write history: {e}")
+            self.stats["last_batch_seconds"] = time.perf_counter() - started
+
+    def write(self, items):
+        """Appends the rows of queued (version, feed_timestamp, changes, trips) items; writer thread only."""
+        positions = {}
+        events = {}
+        for version, ts, changes, trips in items:
+            for vehicle_id in changes.added | changes.changed:
+                vehicle = changes.vehicles[vehicle_id]
+                route_id = trips.get(vehicle.trip_id, {}).get("route_id")
+                updates = vehicle.updates
+                next_stop = None
+                if updates:
+                    next_stop = (vehicle.trip_id, route_id, updates.stop_ids[0], updates.departure_time[0],
+                                 updates.departure_delay[0])
+                row_ts = vehicle.timestamp or ts
+                positions.setdefault(partition_day(row_ts), []).append(
+                    (row_ts, version, vehicle_id, vehicle.trip_id, route_id, vehicle.lat, vehicle.lon,
+                     next_stop[2] if next_stop else None, next_stop[4] if next_stop else None))
+                self._stop_left(vehicle_id, next_stop, events)
+            for vehicle_id in changes.removed:
+                self._stop_left(vehicle_id, None, events)
+
+        for day in sorted(positions.keys() | events.keys()):
+            connection = self._connection(day)
+            with connection:
+                connection.executemany("INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", positions.get(day, ()))
+                connection.executemany("INSERT INTO stop_events VALUES (?, ?, ?, ?, ?, ?, ?)", events.get(day, ()))
+        self.stats["feeds"] += len(items)
+        self.stats["batches"] += 1
+        self.stats["positions"] += sum(len(rows) for rows in positions.values())
+        self.stats["stop_events"] += sum(len(rows) for rows in events.values())
+
+    def _stop_left(self, vehicle_id, next_stop, events):
+        # The vehicle's next stop moved on (or its trip ended): its last report for the old one is final.
+        previous = self._next_stop.pop(vehicle_id, None)
+        if next_stop is not None:
+            self._next_stop[vehicle_id] = next_stop
+        if previous is not None and (next_stop is None or previous[:3] != next_stop[:3]):
+            trip_id, route_id, stop_id, departure_time, delay = previous
+            events.setdefault(partition_day(departure_time), []).append(
+                (departure_time, vehicle_id, trip_id, route_id, stop_id, departure_time - delay, delay))
+
+    def _connection(self, day):
+        connection = self._connections.get(day)
+        if connection is None:
+            connection = sqlite3.connect(self.partition_path(day), timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._connections[day] = connection
+            self._expire(day)
+        return connection
+
+    def _expire(self, today):
+        """Closes connections to past days and deletes partitions older than keep_days."""
+        for day in [d for d in self._connections if d < today]:
+            self._connections.pop(day).close()
+        oldest = (datetime.strptime(today, "%Y%m%d") - timedelta(days=self.keep_days - 1)).strftime("%Y%m%d")
+        for day in self.partitions():
+            if day < oldest:
+                for suffix in ("", "-wal", "-shm"):
+                    try:
+                        os.remove(self.partition_path(day) + suffix)
+                    except FileNotFoundError:
+                        pass
+
+    def partitions(self, since=None, until=None):
+        """Days (YYYYMMDD) with a partition file, oldest first, limited to those [since, until) overlaps."""
+        days = sorted(name[len(PARTITION_PREFIX):-len(PARTITION_SUFFIX)] for name in os.listdir(self.directory)
+                      if name.startswith(PARTITION_PREFIX) and name.endswith(PARTITION_SUFFIX))
+        if since is not None:
+            days = [d for d in days if d >= partition_day(since)]
+        if until is not None:
+            days = [d for d in days if d <= partition_day(until - 1)]
+        return days
+
+    def _rows(self, day, sql, params):
+        connection = sqlite3.connect(f"file:{self.partition_path(day)}?mode=ro", uri=True, timeout=5)
+        try:
+            return connection.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # A partition the writer has created but not yet given its schema.
+            print(f"⚠️ Skipping history partition {day}: {e}")
+            return []
+        finally:
+            connection.close()
+
+    def trail(self, since, until, vehicle_id=None, trip_id=None, limit=MAX_TRAIL_POINTS):
+        """[ts, lat, lon, trip_id, next_stop_id, delay] of one vehicle or trip in [since, until), oldest first.
+
+        limit is clamped to 1..MAX_TRAIL_POINTS; SQLite would read a negative LIMIT as no limit.
+        """
+        limit = max(1, min(limit, MAX_TRAIL_POINTS))
+        column, key = ("vehicle_id", vehicle_id) if vehicle_id is not None else ("trip_id", trip_id)
+        sql = (f"SELECT ts, lat, lon, trip_id, next_stop_id, delay FROM positions "
+               f"WHERE {column} = ? AND ts >= ? AND ts < ? ORDER BY ts LIMIT ?")
+        points = []
+        for day in self.partitions(since, until):
+            points.extend(list(row) for row in self._rows(day, sql, (key, since, until, limit - len(points))))
+            if len(points) >= limit:
+                break
+        return points
+
+    def on_time(self, route_id, since, until, stop_id=None, early=-60, late=300):
+        """Departure punctuality of a route's stop events in [since, until).
+
+        A departure is on time from `early` to `late` seconds of delay (1 min early to 5 min
+        late by default); `stop_id` limits it to one stop. The totals of days the range covers
+        whole are memoized once the day is closed (before yesterday), so a query over weeks
+        only reads the partitions of its first and last days and the last two.
+        """
+        sql = ("SELECT COUNT(*), TOTAL(delay < ?), TOTAL(delay > ?), TOTAL(delay), MAX(delay) FROM stop_events "
+               "WHERE route_id = ? AND ts >= ? AND ts < ?")
+        if stop_id is not None:
+            sql += " AND stop_id = ?"
+        closed = partition_day(time.time() - 86400)
+        departures = n_early = n_late = 0
+        max_delay = None
+        delay_total = 0.0
+        for day in self.partitions(since, until):
+            day_start = int(datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp())
+            start, end = max(since, day_start), min(until, day_start + 86400)
+            params = [early, late, route_id, start, end] + ([stop_id] if stop_id is not None else [])
+            whole_day = day < closed and (start, end) == (day_start, day_start + 86400)
+            key = (day, route_id, stop_id, early, late)
+            totals = self._day_totals.get(key) if whole_day else None
+            if totals is None:
+                rows = self._rows(day, sql, params)
+                totals = rows[0] if rows else (0, 0, 0, 0, None)
+                if whole_day and rows:
+                    with self._lock:
+                        self._day_totals[key] = totals
+                        if len(self._day_totals) > self.max_day_totals:
+                            self._day_totals.popitem(last=False)
+            count, part_early, part_late, part_total, part_max = totals
+            if not count:
+                continue
+            departures += count
+            n_early += int(part_early)
+            n_late += int(part_late)
+            delay_total += part_total
+            if part_max is not None:
+                max_delay = part_max if max_delay is None else max(max_delay, part_max)
+        on_time = departures - n_early - n_late
+        return {
+            "route_id": route_id,
+            "stop_id": stop_id,
+            "since": since,
+            "until": until,
+            "departures": departures,
+            "on_time": on_time,
+            "early": n_early,
+            "late": n_late,
+            "on_time_ratio": on_time / departures if departures else None,
+            "mean_delay": delay_total / departures if departures else None,
+            "max_delay": max_delay,
+        }
+
+    def stats_snapshot(self):
+        return dict(self.stats, pending=self.pending(), partitions=len(self.partitions()))
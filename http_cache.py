@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+def make_etag(*parts):
+    """Opaque ETag for a response identified by parts (feed version, view key, ...)."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+
+def _not_modified(etag):
+    return request.if_none_match.contains(etag)
+
+
+def json_bytes_response(body, etag, version=None, headers=None):
+    """Serves already serialized JSON, or an empty 304 if the client holds this ETag."""
+    response = Response(status=304) if _not_modified(etag) else Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # no-cache: the browser may keep the body but must revalidate it on every poll.
+    response.headers["Cache-Control"] = "no-cache"
+    if version is not None:
+        response.headers["X-Feed-Version"] = str(version)
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    return response
+
+
+class ResponseCache:
+    """Serialized response bodies keyed by (endpoint, key, epoch), least recently used evicted first.
+
+    The epoch is whatever a body depends on besides its key (feed version, view tick), so
+    bodies of a past epoch are never served; they just age out. Bounded by entry count and
+    by total bytes; stats() reports hits, misses and evictions for /metrics.
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, endpoint, key, epoch, render):
+        cache_key = (endpoint, key, epoch)
+        with self._lock:
+            body = self._bodies.get(cache_key)
+            if body is not None:
+                self._bodies.move_to_end(cache_key)
+                self.hits += 1
+                return body
+            self.misses += 1
+        # Rendered outside the lock: a slow body doesn't hold up hits on other keys. Two
+        # threads missing the same key both render it; the views they render from are memoized.
+        body = render()
+        with self._lock:
+            previous = self._bodies.pop(cache_key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._bodies[cache_key] = body
+            self._bytes += len(body)
+            while self._bodies and (len(self._bodies) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._bodies.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        return body
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._bodies), "bytes": self._bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+class PrecompressedBody:
+    """A static body compressed once up front and served by Accept-Encoding."""
+
+    def __init__(self, body, mimetype="application/json"):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        self.encodings = {"gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(body, quality=11)
+        self.identity = body
+
+    def response(self):
+        accepted = request.accept_encodings
+        encoding = next((e for e in ("br", "gzip") if e in self.encodings and accepted[e]), None)
+        # Each representation gets its own strong ETag.
+        etag = f"{self.etag}-{encoding}" if encoding else self.etag
+        if _not_modified(etag):
+            response = Response(status=304)
+        elif encoding:
+            response = Response(self.encodings[encoding], mimetype=self.mimetype)
+            response.headers["Content-Encoding"] = encoding
+        else:
+            response = Response(self.identity, mimetype=self.mimetype)
+        response.set_etag(etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = "no-cache"
+        return response
@@ -0,0 +1,213 @@
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+
+# What changed between two consecutive feeds, by vehicle id.
+FeedChanges = namedtuple("FeedChanges", ["vehicles", "added", "changed", "removed"])
+
+
+class StopTimeUpdates:
+    """One trip update's stop time updates as parallel columns, never modified once built.
+
+    Stop ids are interned (the same few thousand strings recur in every feed), times are
+    int64 and delays int32 seconds. Updates without both an arrival and a departure are
+    dropped, as before.
+    """
+
+    __slots__ = ("stop_ids", "arrival_time", "arrival_delay", "departure_time", "departure_delay")
+
+    def __init__(self, stop_ids=(), arrival_time=(), arrival_delay=(), departure_time=(), departure_delay=()):
+        self.stop_ids = tuple(stop_ids)
+        self.arrival_time = array("q", arrival_time)
+        self.arrival_delay = array("i", arrival_delay)
+        self.departure_time = array("q", departure_time)
+        self.departure_delay = array("i", departure_delay)
+
+    @classmethod
+    def from_proto(cls, stop_time_updates):
+        kept = [u for u in stop_time_updates if u.HasField("arrival") and u.HasField("departure")]
+        if not kept:
+            return NO_UPDATES
+        return cls([sys.intern(u.stop_id) for u in kept], [u.arrival.time for u in kept],
+                   [u.arrival.delay for u in kept], [u.departure.time for u in kept],
+                   [u.departure.delay for u in kept])
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def index(self, stop_id):
+        """Row of the first update for stop_id, or -1."""
+        try:
+            return self.stop_ids.index(stop_id)
+        except ValueError:
+            return -1
+
+    def __eq__(self, other):
+        if not isinstance(other, StopTimeUpdates):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<StopTimeUpdates rows={len(self)}>"
+
+
+NO_UPDATES = StopTimeUpdates()
+
+
+class Vehicle:
+    """Live state of one vehicle, merged from its vehicle position and trip update entities."""
+
+    __slots__ = ("vehicle_id", "trip_id", "timestamp", "lat", "lon", "updates")
+
+    def __init__(self, vehicle_id, trip_id=None, timestamp=None, lat=None, lon=None, updates=NO_UPDATES):
+        self.vehicle_id = vehicle_id
+        self.trip_id = trip_id
+        self.timestamp = timestamp
+        self.lat = lat
+        self.lon = lon
+        self.updates = updates
+
+    @property
+    def position(self):
+        return self.lat, self.lon
+
+    def moved(self, timestamp, lat, lon):
+        """A copy at a new fix, sharing the stop time updates."""
+        return Vehicle(self.vehicle_id, self.trip_id, timestamp, lat, lon, self.updates)
+
+    def __eq__(self, other):
+        if not isinstance(other, Vehicle):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<Vehicle {self.vehicle_id} trip={self.trip_id} at {self.timestamp} updates={len(self.updates)}>"
+
+
+def entity_vehicle_id(entity):
+    vehicle_id = None
+    if entity.HasField("vehicle"):
+        vehicle_id = entity.vehicle.vehicle.id
+    if entity.HasField("trip_update"):
+        trip = entity.trip_update
+        vehicle_id = trip.vehicle.id if trip.HasField("vehicle") else vehicle_id or "unknown"
+    return vehicle_id
+
+
+def decode_entity(entity, vehicle):
+    """Applies one FeedEntity to `vehicle` (a Vehicle); a later entity overrides trip and timestamp."""
+    if entity.HasField("vehicle"):
+        v = entity.vehicle
+        vehicle.trip_id = v.trip.trip_id
+        vehicle.timestamp = int(v.timestamp)
+        if v.HasField("position"):
+            vehicle.lat, vehicle.lon = v.position.latitude, v.position.longitude
+        else:
+            vehicle.lat = vehicle.lon = None
+
+    if entity.HasField("trip_update"):
+        trip = entity.trip_update
+        vehicle.trip_id = trip.trip.trip_id
+        vehicle.timestamp = int(trip.timestamp)
+        vehicle.updates = StopTimeUpdates.from_proto(trip.stop_time_update)
+
+    return vehicle
+
+
+def entity_stamp(entity):
+    """(vehicle_id, stamp) from the entity's scalar fields plus a crc32 of its trip update; equal stamps mean an unchanged entity.
+
+    Agencies revise delays without bumping the trip update timestamp, so the scalars alone
+    would miss those; the crc over the serialized bytes catches them without decoding.
+    """
+    stamp = ()
+    if entity.HasField("vehicle"):
+        v = entity.vehicle
+        stamp += (v.timestamp, v.trip.trip_id, v.position.latitude, v.position.longitude)
+    if entity.HasField("trip_update"):
+        trip = entity.trip_update
+        stamp += (trip.timestamp, trip.trip.trip_id, zlib.crc32(trip.SerializeToString()))
+    return entity_vehicle_id(entity), stamp
+
+
+def parse_feed(content):
+    # Imported on first use: the protobuf bindings are the slowest import of anything that needs live_feed.
+    from google.transit import gtfs_realtime_pb2
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+    return feed
+
+
+def decode_feed(feed):
+    """Builds the vehicles dict from scratch, merging vehicle and trip_update entities per vehicle."""
+    vehicles = {}
+    for entity in feed.entity:
+        vehicle_id = entity_vehicle_id(entity)
+        if vehicle_id:
+            vehicle = vehicles.get(vehicle_id)
+            if vehicle is None:
+                vehicle = vehicles[vehicle_id] = Vehicle(vehicle_id)
+            decode_entity(entity, vehicle)
+    return vehicles
+
+
+class FeedMerger:
+    """Turns each new FeedMessage into the next vehicles dict, rebuilding only what changed.
+
+    A vehicle whose entities carry the same timestamps, trip, position and trip update
+    bytes as last time keeps its previous Vehicle object; its stop time updates are not decoded
+    again. merge() reports which vehicle ids were added, changed and removed so the
+    stop index, position history and response caches can be updated selectively.
+    """
+
+    def __init__(self):
+        self.vehicles = {}
+        self.stamps = {}
+
+    def seed(self, vehicles):
+        """Continues from vehicles decoded elsewhere, e.g. the state a new poller followed until it took over.
+
+        Without their stamps the next merge decodes every entity, but its changes are relative to
+        `vehicles`: anything that left the feed meanwhile is reported as removed.
+        """
+        self.vehicles = dict(vehicles)
+        self.stamps = {}
+
+    def merge(self, feed):
+        # Pass 1: group entities by vehicle and stamp them without touching the repeated fields.
+        entities = {}
+        stamps = {}
+        for entity in feed.entity:
+            vehicle_id, stamp = entity_stamp(entity)
+            if not vehicle_id:
+                continue
+            if vehicle_id in entities:
+                entities[vehicle_id].append(entity)
+                stamps[vehicle_id] += stamp
+            else:
+                entities[vehicle_id] = [entity]
+                stamps[vehicle_id] = stamp
+
+        # Pass 2: reuse unchanged vehicles, decode the rest.
+        vehicles = {}
+        added, changed = set(), set()
+        for vehicle_id, group in entities.items():
+            previous = self.vehicles.get(vehicle_id)
+            if previous is not None and self.stamps.get(vehicle_id) == stamps[vehicle_id]:
+                vehicles[vehicle_id] = previous
+                continue
+            vehicle = Vehicle(vehicle_id)
+            for entity in group:
+                decode_entity(entity, vehicle)
+            vehicles[vehicle_id] = vehicle
+            (changed if previous is not None else added).add(vehicle_id)
+
+        removed = set(self.vehicles) - set(vehicles)
+        self.vehicles = vehicles
+        self.stamps = stamps
+        return FeedChanges(vehicles, added, changed, removed)
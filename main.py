@@ -1,13 +1,22 @@
 
-from flask import Flask, jsonify
+from flask import Blueprint, Flask, Response, jsonify, redirect, request, g
 from flask import render_template
-import requests
-from datetime import datetime
-from google.transit import gtfs_realtime_pb2
-from bus_app_state import BusAppStateManager
+from datetime import datetime, timedelta
+from app_runtime import AppRuntime
+from bus_app_state import AppState
+from feed_recorder import FeedRecorder
+from history_store import MAX_TRAIL_POINTS, HistoryStore
+from fast_json import FastJSONProvider, dumps_bytes
+from live_feed import parse_feed
+from metrics import FEED_STAGE_SECONDS, REGISTRY, REQUEST_SECONDS, Counter, Gauge, rss_mb
+from feed_broadcast import FeedBroadcaster, sse_message
+from http_cache import ResponseCache, json_bytes_response, make_etag
+from shared_state import LIVE_STATE_FILE, LiveStateChannel, PollerElection, UpdateRequest, shared_dir
+from spatial_index import parse_bbox, parse_point
+from sampling_profiler import SamplingProfiler
 import json
-import csv
-from collections import defaultdict
+import os
+import uuid
 
 import threading
 import time
@@ -16,273 +25,663 @@ cyprus_tz = ZoneInfo("Asia/Nicosia")
 
 
 # Load your GTFS static data from earlier (mocked here)
-GTFS_REALTIME_URL = "http://20.19.98.194:8328/Api/api/gtfs-realtime"
-
-import csv
-import os
-from collections import defaultdict
-
-# GTFS static paths
-STATIC_DATA_FOLDERS = [
-    "static_data/2_google_transit/",
-    "static_data/4_google_transit/",
-    "static_data/5_google_transit/",
-    "static_data/6_google_transit/",
-    "static_data/9_google_transit/",
-    "static_data/10_google_transit/",
-    "static_data/11_google_transit/"
-]
-
-ROUTES_FILE = "routes.txt"
-STOPS_FILE = "stops.txt"
-STOP_TIMES_FILE = "stop_times.txt"
-TRIPS_FILE = "trips.txt"
-
-# Data holders
-routes_dict = {}
-stops_data = []
-trips_dict = {}
-stop_times = defaultdict(list)
-
-# === Load GTFS CSV (TXT) files ===
-
-import os
-import csv
-from collections import defaultdict
-
-# Constants
-STATIC_DATA_FOLDERS = [
-    "static_data/2_google_transit/",
-    "static_data/4_google_transit/",
-    "static_data/5_google_transit/",
-    "static_data/6_google_transit/",
-    "static_data/9_google_transit/",
-    "static_data/10_google_transit/",
-    "static_data/11_google_transit/"
-]
-
-ROUTES_FILE = "routes.txt"
-STOPS_FILE = "stops.txt"
-TRIPS_FILE = "trips.txt"
-STOP_TIMES_FILE = "stop_times.txt"
-
-# Data holders
-routes_dict = {}
-stops_data = []
-trips_dict = {}
-stop_times = defaultdict(list)
-
-# === Load GTFS CSV (TXT) files ===
-for folder in STATIC_DATA_FOLDERS:
-    # --- Load Routes ---
-    path = os.path.join(folder, ROUTES_FILE)
+GTFS_REALTIME_URL = os.environ.get("GTFS_REALTIME_URL", "http://20.19.98.194:8328/Api/api/gtfs-realtime")
+# Set to archive every fetched feed for benchmarks/replay_server.py.
+FEED_RECORD_DIR = os.environ.get("FEED_RECORD_DIR")
+# Set to keep a queryable history of positions and delays (/history/...) in SQLite files there.
+HISTORY_DIR = os.environ.get("HISTORY_DIR")
+# Set to 1 to allow starting the sampling profiler through /bus_state/profiler.
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED") == "1"
+# Where /vehicle_positions/stream sends clients when stream_server.py serves the streams (gunicorn.conf.py
+# starts it and sets this); ":<port>/path" means this host on that port. Unset, the workers stream themselves.
+STREAM_URL = os.environ.get("STREAM_URL")
+# Open /vehicle_positions/stream connections per worker process when they do; each holds a server
+# thread, so keep this well under THREADS. Past it streams get 503 and the map polls.
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get("STREAM_MAX_SUBSCRIBERS", "8"))
+# How long a request needing static data waits for the startup load before answering 503.
+STATIC_WAIT_SECONDS = float(os.environ.get("STATIC_WAIT_SECONDS", "30"))
+
+bp = Blueprint("bus_map", __name__)
+
+# Static GTFS data, the state manager (shared views, per-browser selection sessions) and the
+# feed client are built on first use; see AppRuntime.
+feed_recorder = FeedRecorder(FEED_RECORD_DIR) if FEED_RECORD_DIR else None
+runtime = AppRuntime(cyprus_tz, lambda obj: dumps_bytes(obj).decode("utf-8"), realtime_url=GTFS_REALTIME_URL,
+                     recorder=feed_recorder)
+response_cache = ResponseCache()
+broadcaster = FeedBroadcaster(max_subscribers=STREAM_MAX_SUBSCRIBERS)
+history_store = HistoryStore(HISTORY_DIR) if HISTORY_DIR else None
+profiler = SamplingProfiler()
+feed_update_requested = threading.Event()
+feed_update_thread = None
+# FeedMerger and publish_feed assume a single writer: refreshes run one at a time.
+feed_refresh_lock = threading.Lock()
+# Held while a one-off refresh started by /bus_state/update is running (no poller thread).
+one_off_refresh = threading.Lock()
+# Set in multi-worker mode: how a worker that isn't the poller asks it for a refresh.
+shared_update_request = None
+SESSION_COOKIE = "bus_session"
+# Mirrors the session's selection, so it survives requests landing on another worker process.
+VIEW_COOKIE = "bus_view"
+# Endpoints that answer without the static data, so they work while it loads.
+NO_STATIC_ENDPOINTS = {"static", "bus_map.home", "bus_map.admin", "bus_map.liveness", "bus_map.readiness",
+                       "bus_map.metrics", "bus_map.profiler_control", "bus_map.fetcher_stats",
+                       "bus_map.history_trail", "bus_map.history_on_time"}
+
+
+def __getattr__(name):
+    # main.state_manager etc. for scripts and benchmarks; the first access loads the static data.
+    if name in ("state_manager", "static_reloader"):
+        runtime.load()
+        return getattr(runtime, name)
+    if name == "live_feed_state":
+        return runtime.state_manager.live_feed_state
+    if name in ("fetcher", "feed_merger"):
+        return getattr(runtime, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@bp.before_app_request
+def pin_static_generation():
+    g.request_start = time.perf_counter()
+    if request.endpoint in NO_STATIC_ENDPOINTS or request.endpoint is None:
+        return None
+    # The first request to need static data starts the load if nothing has yet.
+    if not runtime.wait(STATIC_WAIT_SECONDS):
+        return jsonify(dict(runtime.status(), error="Static GTFS data is still loading")), 503, {"Retry-After": "5"}
+    # Everything a request reads from static data comes from the generation current when it started.
+    g.static = runtime.state_manager.generation
+
+
+def current_session():
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not session_id:
+        session_id = g.new_session_id = uuid.uuid4().hex
+    session = runtime.state_manager.sessions.get(session_id)
+    mode_name, _, key = request.cookies.get(VIEW_COOKIE, "").partition(":")
+    if mode_name in AppState.__members__ and session.view_key() != (AppState[mode_name], key or None):
+        session.select(AppState[mode_name], key or None)
+    return session
+
+
+def remember_selection(session):
+    mode, key = session.view_key()
+    g.view_cookie = f"{mode.name}:{key or ''}"
+
+
+@bp.after_app_request
+def observe_request_time(response):
+    if "request_start" in g:
+        # The URL rule, not the path, so /stops/<stop_id>/departures is one series.
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint, str(response.status_code))
+    return response
+
+@bp.after_app_request
+def set_session_cookie(response):
+    if "new_session_id" in g:
+        response.set_cookie(SESSION_COOKIE, g.new_session_id, httponly=True, samesite="Lax")
+    if "view_cookie" in g:
+        response.set_cookie(VIEW_COOKIE, g.view_cookie, httponly=True, samesite="Lax")
+    return response
+
+def broadcast_feed():
+    """Pushes the newest feed version to every /vehicle_positions/stream subscriber, serialized once."""
+    if STREAM_URL:
+        return  # stream_server.py has the subscribers
+    previous = broadcaster.version
+    full = runtime.state_manager.position_delta(None)
+    version = full["version"]
+    if version == previous:
+        return
+    snapshot = sse_message("snapshot", dumps_bytes(full), version)
+    delta = None
+    if previous is not None:
+        changes = runtime.state_manager.position_delta(previous)
+        if not changes["full"]:
+            delta = sse_message("delta", dumps_bytes(dict(changes, since=previous)), version)
+    broadcaster.publish(version, snapshot, delta)
+
+def refresh_feed(channel=None):
+    # Imported on the first refresh, not with main: feed_fetcher imports requests.
+    from feed_fetcher import FeedFetchError
+    with feed_refresh_lock:
+        try:
+            changes = update_feed()
+            if changes is not None:
+                broadcast_feed()
+                live = runtime.state_manager.live_feed_state
+                if channel is not None:
+                    channel.publish(live["version"], changes.vehicles, changes, live.get("feed_timestamp"))
+                if history_store is not None:
+                    history_store.record(live["version"], live.get("feed_timestamp"), changes,
+                                         runtime.state_manager.generation.static_data["trips"])
+        except FeedFetchError as e:
+            print("Feed fetch failed:", e)
+        except Exception as e:
+            print("Feed update failed:", e)
+
+def refresh_feed_once():
     try:
-        with open(path, "r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            if reader.fieldnames is None or "route_id" not in reader.fieldnames:
-                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
-                continue
-            for row in reader:
-                routes_dict[row["route_id"]] = row
-    except FileNotFoundError:
-        print(f"⚠️ {ROUTES_FILE} not found in {folder}, skipping.")
-    except Exception as e:
-        print(f"❌ Error loading {path}: {e}")
-
-    # --- Load Stops ---
-    path = os.path.join(folder, STOPS_FILE)
-    try:
-        with open(path, "r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            if reader.fieldnames is None or "stop_id" not in reader.fieldnames:
-                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
-                continue
-            for row in reader:
-                stops_data.append(row)
-    except FileNotFoundError:
-        print(f"⚠️ {STOPS_FILE} not found in {folder}, skipping.")
-    except Exception as e:
-        print(f"❌ Error loading {path}: {e}")
-
-    # --- Load Trips ---
-    path = os.path.join(folder, TRIPS_FILE)
-    try:
-        with open(path, "r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            if reader.fieldnames is None or "trip_id" not in reader.fieldnames:
-                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
-                continue
-            for row in reader:
-                trips_dict[row["trip_id"]] = row
-    except FileNotFoundError:
-        print(f"⚠️ {TRIPS_FILE} not found in {folder}, skipping.")
-    except Exception as e:
-        print(f"❌ Error loading {path}: {e}")
-
-    # --- Load Stop Times ---
-    path = os.path.join(folder, STOP_TIMES_FILE)
-    try:
-        with open(path, "r", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
-            if reader.fieldnames is None or "trip_id" not in reader.fieldnames:
-                print(f"⚠️ Skipping {path}: Missing or invalid header. Found: {reader.fieldnames}")
-                continue
-            for row in reader:
-                try:
-                    stop_times[row["trip_id"]].append({
-                        "stop_id": row["stop_id"],
-                        "arrival_time": row["arrival_time"],
-                        "departure_time": row["departure_time"],
-                        "stop_sequence": int(row["stop_sequence"])
-                    })
-                except KeyError as ke:
-                    print(f"⚠️ Missing key in {path}: {ke}")
-                except ValueError:
-                    print(f"⚠️ Invalid stop_sequence in {path}: {row.get('stop_sequence')}")
-    except FileNotFoundError:
-        print(f"⚠️ {STOP_TIMES_FILE} not found in {folder}, skipping.")
-    except Exception as e:
-        print(f"❌ Error loading {path}: {e}")
-
-# Attach sorted stop_times to each trip in trips_dict
-for trip_id, times in stop_times.items():
-    if trip_id in trips_dict:
-        trips_dict[trip_id]["stop_times"] = sorted(times, key=lambda x: x["stop_sequence"])
-
-
-app = Flask(__name__)
-
-# Prepare static and dynamic data
-static_data = {
-    "routes": routes_dict,
-    "stops": {stop["stop_id"]: stop for stop in stops_data},
-    "trips": trips_dict,
-}
-live_feed_state = {"vehicles": {}}
-
-# Initialize global state manager
-state_manager = BusAppStateManager(static_data, live_feed_state)
+        refresh_feed()
+    finally:
+        one_off_refresh.release()
 
 # background job function
 def schedule_feed_updates(interval=60):
+    global feed_update_thread
+
     def update_loop():
         while True:
-            try:
-                with app.app_context():
-                    print("⏰ Updating GTFS-RT feed in background...")
-                    update_feed()
-            except Exception as e:
-                print("Feed update failed:", e)
-            time.sleep(interval)
-
-    thread = threading.Thread(target=update_loop, daemon=True)
-    thread.start()
-
-
-@app.route("/bus_state/update")
-def update_feed():
-    feed = gtfs_realtime_pb2.FeedMessage()
-    response = requests.get(GTFS_REALTIME_URL)
-    feed.ParseFromString(response.content)
-    print(f"Feed entity count: {len(feed.entity)}")
+            print("⏰ Updating GTFS-RT feed in background...")
+            refresh_feed()
+            # Sleep until the next interval, or until /bus_state/update asks for an early refresh.
+            feed_update_requested.wait(interval)
+            feed_update_requested.clear()
 
+    feed_update_thread = threading.Thread(target=update_loop, daemon=True)
+    feed_update_thread.start()
 
-    vehicles = {}
-    for entity in feed.entity:
-        vehicle_id = None
-        v_info = {}
 
-        if entity.HasField("vehicle"):
-            v = entity.vehicle
-            vehicle_id = v.vehicle.id
-            v_info["trip_id"] = v.trip.trip_id
-            v_info["timestamp"] = int(v.timestamp)
-            if v.HasField("position"):
-                v_info["current_position"] = (v.position.latitude, v.position.longitude)
+def schedule_board_rollover():
+    """Prepares the departure boards of the new service date right after each midnight in Cyprus."""
+    def rollover_loop():
+        while True:
+            now = datetime.now(cyprus_tz)
+            try:
+                runtime.state_manager.departure_boards.roll_over(now.date())
+            except Exception as e:
+                print("Departure board rollover failed:", e)
+            next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), cyprus_tz)
+            time.sleep(max(1.0, (next_midnight - datetime.now(cyprus_tz)).total_seconds() + 1))
+
+    if runtime.state_manager.departure_boards is not None:
+        threading.Thread(target=rollover_loop, daemon=True).start()
+
+
+def apply_shared_state(state):
+    version, vehicles, changes, feed_timestamp = state
+    current = runtime.state_manager.live_feed_state["version"]
+    if version <= current:
+        return
+    # The changes only describe the step from version - 1; after a gap, rebuild from scratch.
+    runtime.state_manager.publish_feed(vehicles, changes if version == current + 1 else None, version=version,
+                                       feed_timestamp=feed_timestamp)
+    broadcast_feed()
+
+
+# multi-worker mode (see gunicorn.conf.py)
+def start_shared_feed_updates(interval=60, follow_interval=1.0):
+    """One elected worker polls the upstream and shares the decoded feed; the others apply it.
+
+    Followers keep trying the election, so a new poller takes over if the current one dies.
+    """
+    global feed_update_thread, shared_update_request
+    directory = shared_dir()
+    election = PollerElection(os.path.join(directory, "poller.lock"))
+    channel = LiveStateChannel(os.path.join(directory, LIVE_STATE_FILE))
+    shared_update_request = UpdateRequest(os.path.join(directory, "update.request"))
+
+    def follow():
+        try:
+            state = channel.poll()
+            if state is not None:
+                apply_shared_state(state)
+        except Exception as e:
+            print("Applying shared feed failed:", e)
+
+    def worker_loop():
+        polling = False
+        while True:
+            if election.try_acquire():
+                # Catch up first, so a new poller continues the version sequence the workers already follow.
+                follow()
+                if not polling:
+                    # This worker's merger has never seen a feed: seeded with the state it followed, vehicles
+                    # that left the feed before the takeover are reported removed instead of lingering in
+                    # the incremental indexes here, on the followers and in the history.
+                    runtime.feed_merger.seed(runtime.state_manager.live_feed_state["vehicles"])
+                    polling = True
+                print(f"⏰ [poller {os.getpid()}] Updating GTFS-RT feed in background...")
+                refresh_feed(channel)
+                # Until the next poll, or earlier if /bus_state/update was called on any worker.
+                deadline = time.monotonic() + interval
+                while not shared_update_request.take() and time.monotonic() < deadline:
+                    if feed_update_requested.wait(min(follow_interval, max(0.0, deadline - time.monotonic()))):
+                        break
+                feed_update_requested.clear()
             else:
-                v_info["current_position"] = (None, None)
-
-        if entity.HasField("trip_update"):
-            trip = entity.trip_update
-            vehicle_id = trip.vehicle.id if trip.HasField("vehicle") else vehicle_id or "unknown"
-            v_info["trip_id"] = trip.trip.trip_id
-            v_info["timestamp"] = int(trip.timestamp)
-            v_info["stop_time_updates"] = [
-                {
-                    "stop_id": u.stop_id,
-                    "arrival": {"time": u.arrival.time, "delay": u.arrival.delay},
-                    "departure": {"time": u.departure.time, "delay": u.departure.delay}
-                } for u in trip.stop_time_update if u.HasField("arrival") and u.HasField("departure")
-            ]
-
-        if vehicle_id:
-            # Merge with any existing data
-            existing = vehicles.get(vehicle_id, {})
-            existing.update(v_info)
-            vehicles[vehicle_id] = existing
+                follow()
+                time.sleep(follow_interval)
+
+    feed_update_thread = threading.Thread(target=worker_loop, daemon=True)
+    feed_update_thread.start()
+
+
+@bp.route("/bus_state/update")
+def request_feed_update():
+    # Never fetch on the request thread: wake the poller, or run a one-off refresh if there is none.
+    if shared_update_request is not None:
+        # The poller may be another worker: it picks the request up within follow_interval.
+        shared_update_request.request()
+        feed_update_requested.set()
+    elif feed_update_thread is not None:
+        feed_update_requested.set()
+    elif one_off_refresh.acquire(blocking=False):
+        threading.Thread(target=refresh_feed_once, daemon=True).start()
+    # else a one-off refresh is already running; this request is answered by it.
+    return jsonify({
+        "status": "Live feed update requested",
+        "vehicles_count": len(runtime.state_manager.live_feed_state["vehicles"]),
+        "version": runtime.state_manager.live_feed_state["version"],
+    }), 202
+
+@bp.route("/bus_state/static")
+def static_status():
+    reloader = runtime.static_reloader
+    return jsonify(dict(g.static.describe(), reloads=reloader.reloads, failures=reloader.failures,
+                        last_reload=reloader.last_report, startup_load=runtime.load_report))
+
+@bp.route("/metrics")
+def metrics():
+    # Per process: under gunicorn each scrape sees the worker that answered it.
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/bus_state/profiler")
+def profiler_control():
+    """?action=start[&interval=0.01] | stop | report[&limit=N] (collapsed stacks); status otherwise."""
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "Profiler disabled; start the server with PROFILER_ENABLED=1"}), 404
+    action = request.args.get("action")
+    if action == "start":
+        try:
+            profiler.start(request.args.get("interval", type=float))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    elif action == "stop":
+        profiler.stop()
+    elif action == "report":
+        return Response(profiler.report(request.args.get("limit", type=int)), mimetype="text/plain")
+    return jsonify(profiler.status())
+
+@bp.route("/bus_state/fetcher")
+def fetcher_stats():
+    stats = runtime.fetcher.stats_snapshot()
+    if feed_recorder is not None:
+        stats["recorder"] = feed_recorder.stats_snapshot()
+    if history_store is not None:
+        stats["history"] = history_store.stats_snapshot()
+    return jsonify(stats)
+
+def history_range(default_span):
+    """(since, until) unix seconds from the query string; until defaults to now."""
+    until = request.args.get("until", type=int) or int(time.time())
+    since = request.args.get("since", type=int) or until - default_span
+    return since, until
+
+@bp.route("/history/trail")
+def history_trail():
+    """?vehicle_id=... or ?trip_id=..., [&since=&until=] (unix seconds, default the last hour)[&limit=N]."""
+    if history_store is None:
+        return jsonify({"error": "History disabled; start the server with HISTORY_DIR set"}), 404
+    vehicle_id = request.args.get("vehicle_id")
+    trip_id = request.args.get("trip_id")
+    if not vehicle_id and not trip_id:
+        return jsonify({"error": "vehicle_id or trip_id required"}), 400
+    since, until = history_range(3600)
+    points = history_store.trail(since, until, vehicle_id=vehicle_id or None, trip_id=None if vehicle_id else trip_id,
+                                 limit=request.args.get("limit", MAX_TRAIL_POINTS, type=int))
+    return jsonify({"vehicle_id": vehicle_id, "trip_id": trip_id, "since": since, "until": until,
+                    "fields": ["timestamp", "lat", "lon", "trip_id", "next_stop_id", "delay"], "points": points})
+
+@bp.route("/history/routes/<route_id>/on_time")
+def history_on_time(route_id):
+    """[?since=&until=] (unix seconds, default the last 7 days)[&stop_id=][&early=-60&late=300] (seconds)."""
+    if history_store is None:
+        return jsonify({"error": "History disabled; start the server with HISTORY_DIR set"}), 404
+    since, until = history_range(7 * 86400)
+    return jsonify(history_store.on_time(route_id, since, until, stop_id=request.args.get("stop_id"),
+                                         early=request.args.get("early", -60, type=int),
+                                         late=request.args.get("late", 300, type=int)))
+
+
+def when_loaded(read):
+    """Gauge function returning read(state_manager), and nothing until the static data is loaded."""
+    return lambda: read(runtime.state_manager) if runtime.ready else None
+
+def feed_staleness(state):
+    feed_timestamp = state.live_feed_state.get("feed_timestamp")
+    return time.time() - feed_timestamp if feed_timestamp else None
+
+def stop_time_update_count(state):
+    return sum(len(v.updates) for v in state.live_feed_state["vehicles"].values())
+
+def fetcher_events():
+    fetcher = runtime.fetcher_started()
+    if fetcher is None:
+        return None
+    stats = fetcher.stats_snapshot()
+    return {(event,): stats[event] for event in ("requests", "updated", "not_modified", "unchanged", "errors",
+                                                  "timeouts", "retries", "failures")}
+
+REGISTRY.register(Gauge("bus_vehicles", "Vehicles in the current feed.",
+                        function=when_loaded(lambda state: len(state.live_feed_state["vehicles"]))))
+REGISTRY.register(Gauge("bus_stop_time_updates", "Stop time updates in the current feed.",
+                        function=when_loaded(stop_time_update_count)))
+REGISTRY.register(Gauge("bus_feed_version", "Version number of the current feed.",
+                        function=when_loaded(lambda state: state.live_feed_state["version"])))
+REGISTRY.register(Gauge("bus_feed_staleness_seconds", "Now minus the current feed's header timestamp.",
+                        function=when_loaded(feed_staleness)))
+REGISTRY.register(Gauge("bus_static_generation", "Number of the static GTFS generation being served.",
+                        function=when_loaded(lambda state: state.generation.number)))
+REGISTRY.register(Gauge("bus_static_bytes", "Approximate memory held by the static GTFS data, per part.", ["part"],
+                        function=when_loaded(lambda state: {(part,): size
+                                                            for part, size in state.generation.footprint().items()})))
+REGISTRY.register(Gauge("bus_process_resident_bytes", "Resident set size of this process.",
+                        function=lambda: (rss_mb() or 0) * 1e6))
+REGISTRY.register(Counter("bus_fetcher_events_total", "GTFS-RT fetcher events (HTTP attempts, outcomes).", ["event"],
+                          function=fetcher_events))
+REGISTRY.register(Gauge("bus_delay_propagation_seconds", "Duration of the last delay propagation pass.",
+                        function=when_loaded(lambda state: state.propagator.stats["seconds"])))
+REGISTRY.register(Gauge("bus_predicted_stop_times", "Stop arrivals predicted by delay propagation in the current feed.",
+                        function=when_loaded(lambda state: state.propagator.stats["predicted_stops"])))
+REGISTRY.register(Gauge("bus_delay_propagation_deferred", "Vehicles the last pass left to the next refresh (budget spent).",
+                        function=when_loaded(lambda state: state.propagator.stats["deferred"])))
+REGISTRY.register(Counter("bus_delay_propagation_overruns_total", "Delay propagation passes that hit their time budget.",
+                          function=when_loaded(lambda state: state.propagator.stats["overruns"])))
+REGISTRY.register(Gauge("bus_history_pending_feeds", "Feeds queued for the history writer.",
+                        function=lambda: history_store.pending() if history_store is not None else None))
+REGISTRY.register(Counter("bus_history_events_total", "History writer activity (feeds, batches, rows, drops, errors).",
+                          ["event"], function=lambda: None if history_store is None else
+                          {(event,): history_store.stats[event] for event in ("feeds", "batches", "positions",
+                                                                              "stop_events", "dropped", "errors")}))
+REGISTRY.register(Gauge("bus_stream_subscribers", "Open /vehicle_positions/stream connections.",
+                        function=lambda: len(broadcaster)))
+REGISTRY.register(Counter("bus_stream_rejected_total", "Stream connections refused because every stream slot was taken.",
+                          function=lambda: broadcaster.rejected))
+REGISTRY.register(Gauge("bus_response_cache_entries", "Rendered response bodies held in the response cache.",
+                        function=lambda: response_cache.stats()["entries"]))
+REGISTRY.register(Gauge("bus_response_cache_bytes", "Bytes of rendered response bodies held in the response cache.",
+                        function=lambda: response_cache.stats()["bytes"]))
+REGISTRY.register(Counter("bus_response_cache_events_total", "Response cache lookups (hits, misses) and LRU evictions.",
+                          ["event"], function=lambda: {(event,): count for event, count in response_cache.stats().items()
+                                                       if event in ("hits", "misses", "evictions")}))
 
+def update_feed():
+    with FEED_STAGE_SECONDS.time("fetch"):
+        content = runtime.fetcher.fetch()
+    if content is None:
+        print("Feed unchanged, skipping parse.")
+        return None
+
+    with FEED_STAGE_SECONDS.time("parse"):
+        feed = parse_feed(content)
+    print(f"Feed entity count: {len(feed.entity)}")
 
+    with FEED_STAGE_SECONDS.time("merge"):
+        changes = runtime.feed_merger.merge(feed)
+    print(f"Feed merge: {len(changes.added)} added, {len(changes.changed)} changed, {len(changes.removed)} removed")
+    with FEED_STAGE_SECONDS.time("publish"):
+        if not runtime.state_manager.publish_feed(changes.vehicles, changes, feed_timestamp=feed.header.timestamp or None):
+            return None
+    return changes
 
-    state_manager.live_feed_state["vehicles"] = vehicles
-    return jsonify({"status": "Live feed updated", "vehicles_count": len(vehicles)})
+def cached_view_response(endpoint, render, ticking=lambda mode: True):
+    """Serves render(mode, key, now) for the session's view through the response cache, with ETag/304 support.
 
-@app.route("/bus_state/view")
+    Bodies are keyed by the view epoch; when ticking(mode) is false the body only depends on
+    the feed version and static generation, so it stays cached (and 304s) across view ticks.
+    """
+    now = datetime.now().astimezone(cyprus_tz)
+    mode, key = current_session().view_key()
+    epoch = runtime.state_manager.view_epoch(now)
+    if not ticking(mode):
+        epoch = (epoch[0], None, epoch[2])
+    etag = make_etag(endpoint, mode.name, key, *epoch)
+    if request.if_none_match.contains(etag):
+        return json_bytes_response(b"", etag, epoch[0])
+    body = response_cache.get_or_render(endpoint, (mode, key), epoch, lambda: dumps_bytes(render(mode, key, now)))
+    return json_bytes_response(body, etag, epoch[0])
+
+@bp.route("/bus_state/view")
 def view_state():
-    return jsonify(state_manager.update_every_5s(datetime.now().astimezone(cyprus_tz)))
+    return cached_view_response("view", runtime.state_manager.view)
 
-@app.route("/bus_state/select_stop/<stop_id>")
+@bp.route("/bus_state/select_stop/<stop_id>")
 def select_stop(stop_id):
-    return jsonify(state_manager.on_select_stop(stop_id))
+    session = current_session()
+    result = runtime.state_manager.on_select_stop(session, stop_id)
+    remember_selection(session)
+    return jsonify(result)
 
-@app.route("/bus_state/select_bus/<vehicle_id>")
+@bp.route("/bus_state/select_bus/<vehicle_id>")
 def select_bus(vehicle_id):
-    return jsonify(state_manager.on_select_bus(vehicle_id))
+    session = current_session()
+    result = runtime.state_manager.on_select_bus(session, vehicle_id)
+    remember_selection(session)
+    return jsonify(result)
 
-@app.route("/bus_state/deselect")
+@bp.route("/bus_state/deselect")
 def deselect():
-    return jsonify({"message": state_manager.on_deselect()})
+    session = current_session()
+    message = runtime.state_manager.on_deselect(session)
+    remember_selection(session)
+    return jsonify({"message": message})
 
-@app.route("/bus_stops")
+@bp.route("/bus_stops")
 def bus_stops():
-    # Optional: augment with upcoming buses if available
-    return jsonify({"stops": stops_data})
+    # Static for the life of the process: serialized and compressed once at startup.
+    return g.static.bus_stops_body.response()
 
-@app.route("/vehicle_positions")
-def vehicle_positions():
+def spatial_search(grid, key, pinned=()):
+    """?bbox=west,south,east,north[&limit=N] or ?near=lat,lon[&n=N] against a GridIndex.
+
+    `pinned` items are added to bbox results even when they are out of the box or past the limit.
+    """
+    try:
+        if "bbox" in request.args:
+            limit = request.args.get("limit", type=int)
+            items = grid.within(*parse_bbox(request.args["bbox"]), limit=limit)
+            truncated = limit is not None and len(items) >= limit
+            items += [item for item in pinned if item not in items]
+            return jsonify({key: items, "truncated": truncated})
+        if "near" in request.args:
+            lat, lon = parse_point(request.args["near"])
+            n = min(request.args.get("n", 10, type=int), 500)
+            return jsonify({key: [dict(item, distance_m=round(distance, 1))
+                                  for distance, item in grid.nearest(lat, lon, n)]})
+    except ValueError as e:
+        return jsonify({"error": f"Bad query: {e}"}), 400
+    return jsonify({"error": "Pass bbox=west,south,east,north or near=lat,lon"}), 400
+
+@bp.route("/bus_stops/search")
+def bus_stops_search():
+    # ?include=<stop_id> keeps the selected stop on the map wherever the viewport is.
+    include = g.static.static_data["stops"].get(request.args.get("include"))
+    return spatial_search(g.static.stop_grid, "stops", [include] if include else ())
+
+def render_vehicle_positions(mode, key, now):
+    positions = runtime.state_manager.current_positions()
+    if mode == AppState.DEFAULT:
+        # Every vehicle at its reported fix: exactly the position records built at publish time.
+        return {"vehicles": list(positions.values())}
+    vehicles = []
+    for vehicle_id, info in runtime.state_manager.view(mode, key, now).get("bus_locations", {}).items():
+        record = positions.get(vehicle_id)
+        vehicles.append({
+            "vehicle_id": vehicle_id,
+            "latitude": info["lat"],
+            "longitude": info["lon"],
+            "timestamp": info["timestamp"],
+            "trip_id": record["trip_id"] if record is not None else None,
+            "next_stop_id": record["next_stop_id"] if record is not None else ""
+        })
+    return {"vehicles": vehicles}
+
+@bp.route("/stops/<stop_id>/departures")
+def stop_departures(stop_id):
+    if stop_id not in g.static.static_data["stops"]:
+        return jsonify({"error": "Stop not found"}), 404
+    n = max(1, min(request.args.get("n", 10, type=int), 100))
     now = datetime.now().astimezone(cyprus_tz)
-    snapshot = state_manager.update_every_5s(now)
+    departures = runtime.state_manager.departures(stop_id, now, n, generation=g.static)
+    for departure in departures:
+        departure["scheduled"] = runtime.state_manager.clock(departure["scheduled_time"])
+        departure["expected"] = runtime.state_manager.clock(departure["expected_time"])
+    return jsonify({"stop_id": stop_id, "now": now.strftime('%H:%M:%S'), "departures": departures})
 
+@bp.route("/vehicle_positions")
+def vehicle_positions():
+    return cached_view_response("vehicle_positions", render_vehicle_positions,
+                                ticking=lambda mode: mode != AppState.DEFAULT)
+
+@bp.route("/vehicle_positions/delta")
+def vehicle_positions_delta():
+    since = request.args.get("since", type=int)
+    if since is not None and not runtime.state_manager.has_positions(since):
+        # Unknown or expired: the full snapshot, cached and tagged once rather than per since value.
+        since = None
+    epoch = runtime.state_manager.view_epoch(datetime.now().astimezone(cyprus_tz))
+    etag = make_etag("vehicle_positions_delta", since, epoch[0])
+    if request.if_none_match.contains(etag):
+        return json_bytes_response(b"", etag, epoch[0])
+    body = response_cache.get_or_render("vehicle_positions_delta", since, epoch,
+                                        lambda: dumps_bytes(runtime.state_manager.position_delta(since)))
+    return json_bytes_response(body, etag, epoch[0])
+
+@bp.route("/vehicle_positions/search")
+def vehicle_positions_search():
+    return spatial_search(runtime.state_manager.vehicle_grid(), "vehicles")
+
+def render_route_vehicles(route_ids):
+    state = runtime.state_manager.live_feed_state
+    route_vehicles = state.get("route_vehicles", {})
+    positions = runtime.state_manager.current_positions()
     vehicles = []
-    if "bus_locations" in snapshot:
-        for vehicle_id, info in snapshot["bus_locations"].items():
-            v = state_manager.live_feed_state["vehicles"].get(vehicle_id, {})
-            updates = v.get("stop_time_updates", [])
-            next_stop_id = updates[0]["stop_id"] if updates else ""
-            #eta = updates[0]["stop_id"] if updates else ""
-
-            vehicles.append({
-                "vehicle_id": vehicle_id,
-                "latitude": info["lat"],
-                "longitude": info["lon"],
-                "timestamp": info["timestamp"],
-                "trip_id": v.get("trip_id"),
-                "next_stop_id": next_stop_id
-                #"next_stop_eta": eta
-            })
-    return jsonify({"vehicles": vehicles})
-
-
-@app.route("/")
+    for route_id in route_ids:
+        for vehicle_id in route_vehicles.get(route_id, ()):
+            record = positions.get(vehicle_id)
+            if record is not None:
+                vehicles.append(dict(record, route_id=route_id))
+    return {"route_ids": list(route_ids), "version": state.get("version", 0), "vehicles": vehicles}
+
+@bp.route("/routes/<route_id>/vehicles")
+def route_vehicles(route_id):
+    """Live positions of the vehicles on a route; <route_id> may also be a route number (all its routes)."""
+    route_ids = g.static.route_index.resolve(route_id)
+    if not route_ids:
+        return jsonify({"error": "Route not found"}), 404
+    version, _, generation = runtime.state_manager.view_epoch(datetime.now().astimezone(cyprus_tz))
+    etag = make_etag("route_vehicles", route_id, version, generation)
+    if request.if_none_match.contains(etag):
+        return json_bytes_response(b"", etag, version)
+    body = response_cache.get_or_render("route_vehicles", route_id, (version, None, generation),
+                                        lambda: dumps_bytes(render_route_vehicles(route_ids)))
+    return json_bytes_response(body, etag, version)
+
+def render_route_stops(route_ids):
+    static_data = g.static.static_data
+    index = g.static.route_index
+    routes = []
+    for route_id in route_ids:
+        route = static_data["routes"].get(route_id, {})
+        stops = [static_data["stops"][stop_id] for stop_id in index.route_stops.get(route_id, ())
+                 if stop_id in static_data["stops"]]
+        routes.append({
+            "route_id": route_id,
+            "route_number": route.get("route_short_name", ""),
+            "route_name": route.get("route_long_name", ""),
+            "stops": [{"stop_id": stop["stop_id"], "stop_name": stop.get("stop_name", ""),
+                       "stop_lat": float(stop.get("stop_lat", 0)), "stop_lon": float(stop.get("stop_lon", 0))}
+                      for stop in stops],
+        })
+    return {"routes": routes}
+
+@bp.route("/routes/<route_id>/stops")
+def route_stops(route_id):
+    """The stops of a route in travel order (every route of a route number, one per direction)."""
+    route_ids = g.static.route_index.resolve(route_id)
+    if not route_ids:
+        return jsonify({"error": "Route not found"}), 404
+    # Only changes with the static data: cached for the life of the generation.
+    etag = make_etag("route_stops", route_id, g.static.number)
+    if request.if_none_match.contains(etag):
+        return json_bytes_response(b"", etag)
+    body = response_cache.get_or_render("route_stops", route_id, (None, None, g.static.number),
+                                        lambda: dumps_bytes(render_route_stops(route_ids)))
+    return json_bytes_response(body, etag)
+
+@bp.route("/vehicle_positions/stream")
+def vehicle_positions_stream():
+    # Server-Sent Events: a full snapshot first, then one delta per feed version.
+    if STREAM_URL:
+        target = STREAM_URL
+        if target.startswith(":"):
+            host = request.host if request.host.endswith("]") else request.host.rsplit(":", 1)[0]
+            target = f"{request.scheme}://{host}{target}"
+        return redirect(target, 307)
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        # Every stream slot of this worker is taken; EventSource gives up and the map falls back to polling.
+        return jsonify({"error": "Too many open streams; poll /vehicle_positions/delta"}), 503, {"Retry-After": "60"}
+    return Response(broadcaster.stream(subscriber), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@bp.route("/")
 def home():
     return render_template("map.html")
 
-@app.route("/admin")
+@bp.route("/admin")
 def admin():
     return render_template("admin_debug.html")
 
+@bp.route("/healthz")
+def liveness():
+    # The process is up and serving; says nothing about the data.
+    return jsonify({"alive": True, "pid": os.getpid(), "uptime_seconds": time.time() - runtime.created_at})
+
+@bp.route("/readyz")
+def readiness():
+    """200 once the static data is loaded and data endpoints answer without waiting, 503 until then."""
+    status = runtime.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+def start_background_jobs(feed_interval=60, reload_interval=30, shared=False):
+    """Static reloads, departure board rollover and feed updates, started once the static data is loaded.
+
+    Returns at once; the jobs start from a thread that waits for (or starts) the load, and
+    retries it if it failed.
+    """
+    def start():
+        while not runtime.wait(60):
+            pass
+        runtime.static_reloader.start(interval=reload_interval)
+        schedule_board_rollover()
+        if shared:
+            start_shared_feed_updates(interval=feed_interval)
+        else:
+            schedule_feed_updates(interval=feed_interval)
+
+    threading.Thread(target=start, daemon=True).start()
+
+
+def create_app():
+    """The Flask app. Cheap to call: static data and the feed client are built on first use (see AppRuntime)."""
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.register_blueprint(bp)
+    return app
+
+
+app = create_app()
+
 
 if __name__ == "__main__":
-    schedule_feed_updates(interval=60)
+    # Serve / and /healthz right away; the map's data endpoints wait for the static load.
+    runtime.start_loading()
+    start_background_jobs(feed_interval=60, reload_interval=30)
     app.run(debug=True)
 
 
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# Run from anywhere: the static_data paths are relative to the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gtfs_static import SNAPSHOT_PATH, STATIC_DATA_FOLDERS, build_snapshot
+
+if __name__ == "__main__":
+    os.chdir(ROOT)
+    output = sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT_PATH
+    build_snapshot(output, STATIC_DATA_FOLDERS)
@@ -1,66 +1,77 @@
-import json  # Import JSON for output formatting
-from google.transit import gtfs_realtime_pb2  # Import GTFS-Realtime protocol buffer
+"""Converts recorded GTFS-Realtime files to NDJSON (one entity per line) or chunked columns.
 
-def parse_gtfs_realtime(file_path):
-    """Parses a GTFS-Realtime file and converts it into a full JSON structure."""
-    feed = gtfs_realtime_pb2.FeedMessage()
+Inputs are raw FeedMessage files or the feeds-YYYYMMDD.log files FeedRecorder writes
+(FEED_RECORD_DIR); every feed in a log is converted, in recording order.
+
+Entities are decoded one at a time from the memory-mapped file, so memory stays flat for
+any feed size. Filters combine: --route/--trip/--vehicle may repeat, --since/--until take
+unix seconds or an ISO datetime (naive = local time).
+
+    python process_scripts/parse.py gtfs-realtime > parsed.ndjson
+    python process_scripts/parse.py recordings/*.pb --output-dir out --jobs 4 --route 50060012
+    python process_scripts/parse.py feed.pb --format columnar --output feed.columns
+    python process_scripts/parse.py recordings/feeds-20260301.log --vehicle 5523 > 5523.ndjson
+
+Throughput goes to stderr.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rt_stream import EntityFilter, NdjsonWriter, convert_file, convert_files, convert_to_file
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gtfs-realtime")
+
+
+def parse_time(value):
     try:
-        with open(file_path, "rb") as f:
-            feed.ParseFromString(f.read())
-
-        entities = []
-        for entity in feed.entity:
-            entity_data = {
-                "id": entity.id,
-                "is_vehicle": entity.HasField("vehicle"),
-                "is_trip_update": entity.HasField("trip_update"),
-                "is_alert": entity.HasField("alert")
-            }
-            
-            if entity.HasField("vehicle"):
-                vehicle = entity.vehicle
-                entity_data["vehicle"] = {
-                    "vehicle_id": vehicle.vehicle.id if vehicle.HasField("vehicle") else "Unknown",
-                    "latitude": vehicle.position.latitude if vehicle.HasField("position") else None,
-                    "longitude": vehicle.position.longitude if vehicle.HasField("position") else None,
-                    "timestamp": vehicle.timestamp if vehicle.HasField("timestamp") else None,
-                    "trip_id": vehicle.trip.trip_id if vehicle.HasField("trip") else None,
-                    "route_id": vehicle.trip.route_id if vehicle.HasField("trip") else None
-                }
-            
-            if entity.HasField("trip_update"):
-                trip_update = entity.trip_update
-                entity_data["trip_update"] = {
-                    "trip_id": trip_update.trip.trip_id,
-                    "route_id": trip_update.trip.route_id,
-                    "stop_time_updates": [
-                        {
-                            "stop_id": update.stop_id,
-                            "arrival_time": update.arrival.time if update.HasField("arrival") else None,
-                            "departure_time": update.departure.time if update.HasField("departure") else None
-                        }
-                        for update in trip_update.stop_time_update
-                    ]
-                }
-            
-            if entity.HasField("alert"):
-                alert = entity.alert
-                entity_data["alert"] = {
-                    "cause": alert.cause,
-                    "effect": alert.effect,
-                    "description_text": alert.description_text.translation[0].text if alert.description_text.translation else None
-                }
-            
-            entities.append(entity_data)
-        
-        return json.dumps({"header": {
-            "gtfs_realtime_version": feed.header.gtfs_realtime_version,
-            "timestamp": feed.header.timestamp
-        }, "entities": entities}, indent=4)  # Convert to formatted JSON
-    except Exception as e:
-        return json.dumps({"error": str(e)}, indent=4)
-        
-if __name__ == '__main__':
-    file_path = "gtfs-realtime"  # Replace with the actual file path
-    json_output = parse_gtfs_realtime(file_path)
-    print(json_output)
+        return int(value)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", default=[DEFAULT_FILE],
+                        help="recorded FeedMessage files or feeds-*.log recorder logs")
+    parser.add_argument("--format", choices=["ndjson", "columnar"], default="ndjson")
+    parser.add_argument("--output", help="output file for a single input (default: stdout, ndjson only)")
+    parser.add_argument("--output-dir", help="one <name>.ndjson/.columns per input, converted in parallel")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes with --output-dir (default: CPUs)")
+    parser.add_argument("--route", action="append", help="keep only this route_id")
+    parser.add_argument("--trip", action="append", help="keep only this trip_id")
+    parser.add_argument("--vehicle", action="append", help="keep only this vehicle id")
+    parser.add_argument("--since", type=parse_time, help="keep entities stamped at or after this time")
+    parser.add_argument("--until", type=parse_time, help="keep entities stamped before this time")
+    args = parser.parse_args(argv)
+
+    if args.output_dir is None and args.format == "columnar" and args.output is None:
+        parser.error("columnar output needs --output or --output-dir")
+    if args.output is not None and len(args.files) > 1:
+        parser.error("--output takes a single input; use --output-dir for several")
+
+    entity_filter = EntityFilter(args.route, args.trip, args.vehicle, args.since, args.until)
+    start = time.perf_counter()
+    if args.output_dir is not None:
+        reports = convert_files(args.files, args.output_dir, args.format, entity_filter, args.jobs)
+    elif args.output is not None:
+        reports = [convert_to_file(args.files[0], args.output, args.format, entity_filter)]
+    else:
+        writer = NdjsonWriter(sys.stdout)
+        reports = [convert_file(path, writer, entity_filter) for path in args.files]
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    entities = sum(report["entities"] for report in reports)
+    written = sum(report["written"] for report in reports)
+    print(f"✅ {entities} entities ({written} written) from {len(reports)} file(s) in {elapsed:.2f}s, "
+          f"{entities / elapsed if elapsed else 0:,.0f} entities/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+def merge_patterns(patterns):
+    """One stop order covering every pattern: the longest first, then each other pattern's extra
+    stops inserted after the last stop it shares with what is merged so far."""
+    merged = []
+    for pattern in sorted(patterns, key=len, reverse=True):
+        if not merged:
+            merged = list(pattern)
+            continue
+        seen = set(merged)
+        position = 0
+        for stop in pattern:
+            if stop in seen:
+                # A loop lists a stop twice: prefer the visit ahead of where the pattern has got to.
+                position = merged.index(stop, position) + 1 if stop in merged[position:] else merged.index(stop) + 1
+            else:
+                merged.insert(position, stop)
+                seen.add(stop)
+                position += 1
+    return merged
+
+
+class RouteIndex:
+    """Route lookups derived from one static generation, never modified after construction.
+
+    trip_routes: trip_id -> (route_id, route_short_name)
+    route_trips: route_id -> tuple of its trip_ids
+    route_stops: route_id -> tuple of stop_ids in travel order, all of the route's stop patterns merged
+    short_names: route_short_name -> tuple of route_ids; one number runs in both directions
+    and, across the seven feeds, sometimes in several districts.
+    """
+
+    def __init__(self, routes, trips, stop_times=None):
+        self.routes = routes
+        self.trip_routes = {}
+        route_trips = {}
+        for trip_id, trip in trips.items():
+            route_id = trip.get("route_id", "")
+            self.trip_routes[trip_id] = (route_id, routes.get(route_id, {}).get("route_short_name", ""))
+            route_trips.setdefault(route_id, []).append(trip_id)
+        self.route_trips = {route_id: tuple(trip_ids) for route_id, trip_ids in route_trips.items()}
+
+        short_names = {}
+        for route_id, route in routes.items():
+            short_names.setdefault(route.get("route_short_name", ""), []).append(route_id)
+        self.short_names = {name: tuple(route_ids) for name, route_ids in short_names.items()}
+
+        self.route_stops = {}
+        if stop_times is not None:
+            trip_index = stop_times.trip_index
+            stop_ids = stop_times.stop_ids
+            for route_id, trip_ids in self.route_trips.items():
+                # Trips of a route mostly repeat a handful of stop patterns; merge each once.
+                patterns = set()
+                for trip_id in trip_ids:
+                    t = trip_index.get(trip_id)
+                    if t is not None:
+                        patterns.add(tuple(stop_times.stop_index[stop_times.trip_start[t]:stop_times.trip_start[t + 1]]))
+                self.route_stops[route_id] = tuple(stop_ids[s] for s in merge_patterns(patterns))
+
+    def resolve(self, key):
+        """Route ids a /routes/<key>/... path means: the route_id itself, or every route with that short name."""
+        if key in self.routes:
+            return (key,)
+        return self.short_names.get(key, ())
+
+
+def build_route_vehicles(vehicles, trip_routes):
+    """route_id -> [vehicle_id] of the vehicles running one of its trips, in feed order."""
+    route_vehicles = {}
+    for vehicle_id, vehicle in vehicles.items():
+        route = trip_routes.get(vehicle.trip_id)
+        if route is not None:
+            route_vehicles.setdefault(route[0], []).append(vehicle_id)
+    return route_vehicles
+
+
+def update_route_vehicles(route_vehicles, old_vehicles, vehicles, touched, trip_routes):
+    """Copy of route_vehicles with the touched vehicle ids moved to their current routes; the input is not modified.
+
+    Only routes a vehicle joined or left are rebuilt; a vehicle that merely moved along its
+    trip leaves the index as it was.
+    """
+    moved = {}
+    for vehicle_id in touched:
+        old, new = old_vehicles.get(vehicle_id), vehicles.get(vehicle_id)
+        old_route = trip_routes.get(old.trip_id) if old is not None else None
+        new_route = trip_routes.get(new.trip_id) if new is not None else None
+        if old_route != new_route:
+            moved[vehicle_id] = (old_route[0] if old_route else None, new_route[0] if new_route else None)
+    if not moved:
+        return route_vehicles
+
+    new_index = dict(route_vehicles)
+    for route_id in {route for pair in moved.values() for route in pair if route is not None}:
+        kept = [vehicle_id for vehicle_id in route_vehicles.get(route_id, ()) if vehicle_id not in moved]
+        if kept:
+            new_index[route_id] = kept
+        else:
+            new_index.pop(route_id, None)
+    # As in update_stop_index, every list appended to here is a fresh copy.
+    for vehicle_id, (_, route_id) in moved.items():
+        if route_id is not None:
+            new_index.setdefault(route_id, []).append(vehicle_id)
+    return new_index
@@ -0,0 +1,325 @@
+import json
+import mmap
+import multiprocessing
+import os
+import pickle
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from google.transit import gtfs_realtime_pb2
+
+from feed_recorder import RECORD_MAGIC, iter_log
+
+# FeedMessage fields: 1 = header, 2 = repeated entity. Walking the top-level wire format lets a
+# recorded feed be decoded one FeedEntity at a time instead of as one big FeedMessage.
+FEED_HEADER_FIELD = 1
+FEED_ENTITY_FIELD = 2
+
+# Rows per chunk of columnar output; a chunk is the most the writer holds in memory.
+COLUMN_CHUNK_ROWS = 65536
+
+
+def read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_fields(buf, start=0, end=None):
+    """(field number, start, end) of every length-delimited field of one message, other wire types skipped."""
+    pos = start
+    end = len(buf) if end is None else end
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            _, pos = read_varint(buf, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        elif wire_type == 2:
+            length, pos = read_varint(buf, pos)
+            if pos + length > end:
+                raise ValueError(f"Truncated field {key >> 3} at byte {pos}")
+            yield key >> 3, pos, pos + length
+            pos += length
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} at byte {pos}")
+
+
+def read_header(buf):
+    for field, start, end in iter_fields(buf):
+        if field == FEED_HEADER_FIELD:
+            return gtfs_realtime_pb2.FeedHeader.FromString(buf[start:end])
+    return gtfs_realtime_pb2.FeedHeader()
+
+
+def iter_entities(buf):
+    for field, start, end in iter_fields(buf):
+        if field == FEED_ENTITY_FIELD:
+            yield gtfs_realtime_pb2.FeedEntity.FromString(buf[start:end])
+
+
+def entity_timestamp(entity, feed_timestamp):
+    if entity.HasField("vehicle") and entity.vehicle.timestamp:
+        return entity.vehicle.timestamp
+    if entity.HasField("trip_update") and entity.trip_update.timestamp:
+        return entity.trip_update.timestamp
+    return feed_timestamp
+
+
+class EntityFilter:
+    """Which entities to keep: route, trip and vehicle each in its given set, timestamp in [since, until).
+
+    A criterion left empty matches everything; entities without their own timestamp use the feed's.
+    """
+
+    def __init__(self, routes=None, trips=None, vehicles=None, since=None, until=None):
+        self.routes = set(routes or ())
+        self.trips = set(trips or ())
+        self.vehicles = set(vehicles or ())
+        self.since = since
+        self.until = until
+
+    def matches(self, entity, feed_timestamp):
+        if self.since is not None or self.until is not None:
+            timestamp = entity_timestamp(entity, feed_timestamp)
+            if self.since is not None and timestamp < self.since:
+                return False
+            if self.until is not None and timestamp >= self.until:
+                return False
+        if not (self.routes or self.trips or self.vehicles):
+            return True
+        trip = vehicle = None
+        if entity.HasField("vehicle"):
+            trip, vehicle = entity.vehicle.trip, entity.vehicle.vehicle
+        elif entity.HasField("trip_update"):
+            trip, vehicle = entity.trip_update.trip, entity.trip_update.vehicle
+        if trip is None:
+            return False
+        return ((not self.routes or trip.route_id in self.routes) and
+                (not self.trips or trip.trip_id in self.trips) and
+                (not self.vehicles or vehicle.id in self.vehicles))
+
+
+def entity_record(entity, feed_timestamp):
+    """One entity as a JSON-ready dict, in the layout process_scripts/parse.py has always printed."""
+    record = {
+        "id": entity.id,
+        "feed_timestamp": feed_timestamp,
+        "is_vehicle": entity.HasField("vehicle"),
+        "is_trip_update": entity.HasField("trip_update"),
+        "is_alert": entity.HasField("alert"),
+    }
+    if entity.HasField("vehicle"):
+        vehicle = entity.vehicle
+        record["vehicle"] = {
+            "vehicle_id": vehicle.vehicle.id if vehicle.HasField("vehicle") else "Unknown",
+            "latitude": vehicle.position.latitude if vehicle.HasField("position") else None,
+            "longitude": vehicle.position.longitude if vehicle.HasField("position") else None,
+            "timestamp": vehicle.timestamp if vehicle.HasField("timestamp") else None,
+            "trip_id": vehicle.trip.trip_id if vehicle.HasField("trip") else None,
+            "route_id": vehicle.trip.route_id if vehicle.HasField("trip") else None
+        }
+    if entity.HasField("trip_update"):
+        trip_update = entity.trip_update
+        record["trip_update"] = {
+            "trip_id": trip_update.trip.trip_id,
+            "route_id": trip_update.trip.route_id,
+            "vehicle_id": trip_update.vehicle.id if trip_update.HasField("vehicle") else None,
+            "timestamp": trip_update.timestamp if trip_update.HasField("timestamp") else None,
+            "stop_time_updates": [
+                {
+                    "stop_id": update.stop_id,
+                    "arrival_time": update.arrival.time if update.HasField("arrival") else None,
+                    "departure_time": update.departure.time if update.HasField("departure") else None
+                }
+                for update in trip_update.stop_time_update
+            ]
+        }
+    if entity.HasField("alert"):
+        alert = entity.alert
+        record["alert"] = {
+            "cause": alert.cause,
+            "effect": alert.effect,
+            "description_text": alert.description_text.translation[0].text if alert.description_text.translation else None
+        }
+    return record
+
+
+class NdjsonWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, entity, feed_timestamp):
+        self.f.write(json.dumps(entity_record(entity, feed_timestamp), separators=(",", ":")))
+        self.f.write("\n")
+
+    def close(self):
+        self.f.flush()
+
+
+def _entity_columns():
+    return {
+        "feed_timestamp": array("q"), "entity_id": [], "kind": [], "vehicle_id": [], "trip_id": [],
+        "route_id": [], "timestamp": array("q"), "latitude": array("d"), "longitude": array("d"),
+    }
+
+
+def _update_columns():
+    return {"entity_row": array("q"), "stop_id": [], "arrival_time": array("q"), "departure_time": array("q")}
+
+
+class ColumnarWriter:
+    """Writes entities as a sequence of pickled column chunks (see read_columns).
+
+    Each chunk is {"entities": columns, "stop_time_updates": columns}, numeric columns as
+    arrays and string columns as lists, so pandas.DataFrame(chunk["entities"]) works as-is.
+    stop_time_updates rows point at their entity through entity_row, counted across the file.
+    Missing numbers are 0 and missing positions NaN; alerts only get a row with kind "alert".
+    """
+
+    def __init__(self, f, chunk_rows=COLUMN_CHUNK_ROWS):
+        self.f = f
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.entities = _entity_columns()
+        self.updates = _update_columns()
+
+    def write(self, entity, feed_timestamp):
+        columns = self.entities
+        trip = vehicle = None
+        latitude = longitude = float("nan")
+        timestamp = 0
+        if entity.HasField("vehicle"):
+            v = entity.vehicle
+            kind, trip, vehicle, timestamp = "vehicle", v.trip, v.vehicle, v.timestamp
+            if v.HasField("position"):
+                latitude, longitude = v.position.latitude, v.position.longitude
+        elif entity.HasField("trip_update"):
+            t = entity.trip_update
+            kind, trip, vehicle, timestamp = "trip_update", t.trip, t.vehicle, t.timestamp
+            updates = self.updates
+            for update in t.stop_time_update:
+                updates["entity_row"].append(self.rows)
+                updates["stop_id"].append(update.stop_id)
+                updates["arrival_time"].append(update.arrival.time)
+                updates["departure_time"].append(update.departure.time)
+        else:
+            kind = "alert" if entity.HasField("alert") else "other"
+        columns["feed_timestamp"].append(feed_timestamp)
+        columns["entity_id"].append(entity.id)
+        columns["kind"].append(kind)
+        columns["vehicle_id"].append(vehicle.id if vehicle is not None else "")
+        columns["trip_id"].append(trip.trip_id if trip is not None else "")
+        columns["route_id"].append(trip.route_id if trip is not None else "")
+        columns["timestamp"].append(timestamp)
+        columns["latitude"].append(latitude)
+        columns["longitude"].append(longitude)
+        self.rows += 1
+        if len(columns["entity_id"]) >= self.chunk_rows or len(self.updates["stop_id"]) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self.entities["entity_id"]:
+            pickle.dump({"entities": self.entities, "stop_time_updates": self.updates}, self.f, protocol=5)
+            self.entities = _entity_columns()
+            self.updates = _update_columns()
+
+    def close(self):
+        self.flush()
+        self.f.flush()
+
+
+def read_columns(path):
+    """Yields the chunks a ColumnarWriter wrote, one at a time."""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def is_recorder_log(path):
+    """True for a FeedRecorder log (feeds-*.log), whose records each hold one compressed FeedMessage.
+
+    A FeedMessage can't start with the magic: its first byte would be field 8 with wire type 7.
+    """
+    with open(path, "rb") as f:
+        return f.read(len(RECORD_MAGIC)) == RECORD_MAGIC
+
+
+def convert_feed(buf, writer, entity_filter=None, default_timestamp=0):
+    """Streams one FeedMessage (bytes or mmap) into writer; returns (entities seen, entities written)."""
+    feed_timestamp = read_header(buf).timestamp or default_timestamp
+    seen = written = 0
+    for entity in iter_entities(buf):
+        seen += 1
+        if entity_filter is None or entity_filter.matches(entity, feed_timestamp):
+            writer.write(entity, feed_timestamp)
+            written += 1
+    return seen, written
+
+
+def convert_file(path, writer, entity_filter=None):
+    """Streams one recorded FeedMessage file into writer. Returns {"file", "entities", "written", "seconds"}.
+
+    The file is memory-mapped and decoded one entity at a time, so memory stays flat whatever its size.
+    A FeedRecorder log is read record by record instead (the report adds "records"); a feed without
+    a header timestamp is stamped with its fetch time.
+    """
+    start = time.perf_counter()
+    seen = written = 0
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {"file": path, "entities": 0, "written": 0, "seconds": time.perf_counter() - start}
+    if is_recorder_log(path):
+        records = 0
+        for fetched_at, payload in iter_log(path):
+            records += 1
+            counts = convert_feed(payload, writer, entity_filter, int(fetched_at))
+            seen += counts[0]
+            written += counts[1]
+        return {"file": path, "records": records, "entities": seen, "written": written,
+                "seconds": time.perf_counter() - start}
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            seen, written = convert_feed(buf, writer, entity_filter)
+    return {"file": path, "entities": seen, "written": written, "seconds": time.perf_counter() - start}
+
+
+def output_name(path, fmt):
+    return os.path.basename(path) + (".ndjson" if fmt == "ndjson" else ".columns")
+
+
+def open_writer(f, fmt):
+    return NdjsonWriter(f) if fmt == "ndjson" else ColumnarWriter(f)
+
+
+def convert_to_file(path, output_path, fmt, entity_filter=None):
+    with open(output_path, "w" if fmt == "ndjson" else "wb") as f:
+        writer = open_writer(f, fmt)
+        report = convert_file(path, writer, entity_filter)
+        writer.close()
+    report["output"] = output_path
+    return report
+
+
+def convert_files(paths, output_dir, fmt, entity_filter=None, workers=None):
+    """Converts each file into output_dir/<name>.ndjson|.columns on a fork process pool; reports in input order."""
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(path, os.path.join(output_dir, output_name(path, fmt))) for path in paths]
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    if workers <= 1 or len(paths) <= 1:
+        return [convert_to_file(path, output, fmt, entity_filter) for path, output in jobs]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        futures = [pool.submit(convert_to_file, path, output, fmt, entity_filter) for path, output in jobs]
+        return [future.result() for future in futures]
@@ -0,0 +1,92 @@
+import math
+import sys
+import threading
+import time
+from collections import Counter
+
+# Shortest sampling interval start() accepts; below it the sampler would busy-loop.
+MIN_INTERVAL = 0.001
+
+
+class SamplingProfiler:
+    """Statistical profiler for a running server: samples every thread's stack on a timer.
+
+    Costs one sys._current_frames() walk per interval while running and nothing while
+    stopped. report() returns collapsed stacks ("outer;inner;leaf count" lines, hottest
+    first) that flamegraph.pl or speedscope read directly.
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Separate from _lock, which stop() holds while joining the sampler thread.
+        self._samples_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        """False if already running; ValueError unless interval is None or a finite number >= MIN_INTERVAL."""
+        if interval is not None and not (math.isfinite(interval) and interval >= MIN_INTERVAL):
+            raise ValueError(f"interval must be a number of seconds >= {MIN_INTERVAL}")
+        with self._lock:
+            if self.running:
+                return False
+            if interval is not None:
+                self.interval = interval
+            self.samples = Counter()
+            self.sample_count = 0
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return False
+            self._stop.set()
+            self._thread.join()
+            self.stopped_at = time.time()
+            return True
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                with self._samples_lock:
+                    self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def status(self):
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.sample_count,
+            "stacks": len(self.samples),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+        }
+
+    def report(self, limit=None):
+        # Copied under the lock: the sampler thread may be adding stacks while this sorts.
+        with self._samples_lock:
+            samples = Counter(self.samples)
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common(limit))
@@ -0,0 +1,303 @@
+import math
+import pickle
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # optional: without numpy vehicles are interpolated in straight lines
+    np = None
+
+METERS_PER_DEGREE = 111_320
+
+
+def _float_column(buffer):
+    return memoryview(buffer).cast("B").cast("d")
+
+
+def _int_column(buffer):
+    return memoryview(buffer).cast("B").cast("i")
+
+
+class ShapeStore:
+    """shapes.txt as contiguous columns: points grouped by shape and sorted by shape_pt_sequence.
+
+    Points of shape ``shape_ids[s]`` live in ``shape_start[s]:shape_start[s + 1]``; ``dist``
+    is the distance in meters along the shape from its first point. Like StopTimesStore the
+    columns are arrays after a CSV load and memoryviews over the snapshot mmap after a
+    snapshot load; ``arrays()`` exposes them to numpy without copying.
+    """
+
+    def __init__(self, shape_ids, shape_start, lat, lon, dist):
+        self.shape_ids = shape_ids
+        self.shape_index = {shape_id: s for s, shape_id in enumerate(shape_ids)}
+        self.shape_start = shape_start
+        self.lat = lat
+        self.lon = lon
+        self.dist = dist
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __contains__(self, shape_id):
+        return shape_id in self.shape_index
+
+    def length(self, shape_id):
+        s = self.shape_index[shape_id]
+        end = self.shape_start[s + 1]
+        return self.dist[end - 1] if end > self.shape_start[s] else 0.0
+
+    def arrays(self):
+        """numpy views (lat, lon, dist, start, base, gdist).
+
+        ``gdist = dist + base[shape]`` is strictly increasing over the whole store, so one
+        searchsorted call locates points on many different shapes at once.
+        """
+        if self._arrays is None:
+            lat = np.frombuffer(self.lat, dtype=np.float64)
+            lon = np.frombuffer(self.lon, dtype=np.float64)
+            dist = np.frombuffer(self.dist, dtype=np.float64)
+            start = np.frombuffer(self.shape_start, dtype=np.int32).astype(np.intp)
+            counts = np.diff(start)
+            lengths = np.zeros(len(counts))
+            nonempty = counts > 0
+            lengths[nonempty] = dist[start[1:][nonempty] - 1]
+            base = np.concatenate(([0.0], np.cumsum(lengths + 1.0)[:-1]))
+            gdist = dist + np.repeat(base, counts)
+            self._arrays = (lat, lon, dist, start, base, gdist)
+        return self._arrays
+
+    def snap(self, shape_id, lat, lon, max_offset=150.0):
+        """Distances along the shape (ascending) of every pass within max_offset meters of the point.
+
+        A loop route can pass a stop more than once, so each run of nearby segments yields one
+        candidate; the globally closest segment is always included. Returns [] for unknown shapes.
+        """
+        s = self.shape_index.get(shape_id)
+        if s is None:
+            return []
+        a_lat, a_lon, dist, start, _, _ = self.arrays()
+        i0, i1 = start[s], start[s + 1]
+        if i1 - i0 < 2:
+            return []
+        cos_lat = math.cos(math.radians(lat))
+        x = (a_lon[i0:i1] - lon) * (METERS_PER_DEGREE * cos_lat)
+        y = (a_lat[i0:i1] - lat) * METERS_PER_DEGREE
+        ax, ay, bx, by = x[:-1], y[:-1], x[1:], y[1:]
+        dx, dy = bx - ax, by - ay
+        seg2 = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(seg2 > 0, seg2, 1.0), 0.0, 1.0)
+        px, py = ax + t * dx, ay + t * dy
+        offset2 = px * px + py * py
+        along = dist[i0:i1 - 1] + t * (dist[i0 + 1:i1] - dist[i0:i1 - 1])
+
+        best = int(np.argmin(offset2))
+        if offset2[best] > max_offset * max_offset:
+            return []
+        near = offset2 <= max_offset * max_offset
+        # Closest segment of each run of consecutive nearby segments.
+        runs = np.flatnonzero(np.diff(np.concatenate(([False], near, [False])).astype(np.int8)))
+        candidates = {int(r0 + np.argmin(offset2[r0:r1])) for r0, r1 in zip(runs[::2], runs[1::2])}
+        candidates.add(best)
+        return sorted(float(along[k]) for k in candidates)
+
+    def points_at(self, shape_idx, along):
+        """Vectorized (lat, lon) arrays at distance `along` on shapes `shape_idx` (index arrays)."""
+        a_lat, a_lon, _, start, base, gdist = self.arrays()
+        first, last = start[shape_idx], start[shape_idx + 1] - 1
+        length = gdist[last] - base[shape_idx]
+        g = base[shape_idx] + np.clip(along, 0.0, length)
+        i = np.clip(np.searchsorted(gdist, g, side="right") - 1, first, np.maximum(last - 1, first))
+        j = np.minimum(i + 1, last)
+        span = gdist[j] - gdist[i]
+        f = np.where(span > 0, (g - gdist[i]) / np.where(span > 0, span, 1.0), 0.0)
+        return a_lat[i] + f * (a_lat[j] - a_lat[i]), a_lon[i] + f * (a_lon[j] - a_lon[i])
+
+    def __reduce_ex__(self, protocol):
+        wrap = pickle.PickleBuffer if protocol >= 5 else bytes
+        return _rebuild_store, (self.shape_ids, wrap(self.shape_start), wrap(self.lat), wrap(self.lon),
+                                wrap(self.dist))
+
+
+def _rebuild_store(shape_ids, shape_start, lat, lon, dist):
+    return ShapeStore(shape_ids, _int_column(shape_start), _float_column(lat), _float_column(lon),
+                      _float_column(dist))
+
+
+class ShapesBuilder:
+    """Collects shapes.txt rows in any order and sorts them once into a ShapeStore."""
+
+    def __init__(self):
+        self._shape_lookup = {}
+        self.shape_ids = []
+        self._shape = array("i")
+        self._sequence = array("i")
+        self._lat = array("d")
+        self._lon = array("d")
+
+    def add(self, shape_id, shape_pt_lat, shape_pt_lon, shape_pt_sequence):
+        lat = float(shape_pt_lat)
+        lon = float(shape_pt_lon)
+        sequence = int(shape_pt_sequence)
+        s = self._shape_lookup.get(shape_id)
+        if s is None:
+            s = self._shape_lookup[shape_id] = len(self.shape_ids)
+            self.shape_ids.append(shape_id)
+        self._shape.append(s)
+        self._sequence.append(sequence)
+        self._lat.append(lat)
+        self._lon.append(lon)
+
+    def build(self):
+        shape, sequence = self._shape, self._sequence
+        order = sorted(range(len(shape)), key=lambda i: (shape[i], sequence[i]))
+
+        shape_start = array("i", [0] * (len(self.shape_ids) + 1))
+        for s in shape:
+            shape_start[s + 1] += 1
+        for s in range(len(self.shape_ids)):
+            shape_start[s + 1] += shape_start[s]
+
+        lat = array("d", (self._lat[i] for i in order))
+        lon = array("d", (self._lon[i] for i in order))
+        dist = array("d", bytes(8 * len(lat)))
+        if np is not None:
+            a_lat, a_lon = np.frombuffer(lat), np.frombuffer(lon)
+            step = np.hypot(np.diff(a_lon) * METERS_PER_DEGREE * np.cos(np.radians(a_lat[1:])),
+                            np.diff(a_lat) * METERS_PER_DEGREE)
+            starts = np.frombuffer(shape_start, dtype=np.int32)[:-1]
+            step[starts[starts > 0] - 1] = 0.0  # no step across a shape boundary
+            cumulative = np.concatenate(([0.0], np.cumsum(step)))
+            # Restart the running sum at the first point of every shape.
+            counts = np.diff(np.frombuffer(shape_start, dtype=np.int32))
+            np.frombuffer(dist)[:] = cumulative - np.repeat(cumulative[starts], counts)
+        else:
+            for s in range(len(self.shape_ids)):
+                for i in range(shape_start[s] + 1, shape_start[s + 1]):
+                    dy = (lat[i] - lat[i - 1]) * METERS_PER_DEGREE
+                    dx = (lon[i] - lon[i - 1]) * METERS_PER_DEGREE * math.cos(math.radians(lat[i]))
+                    dist[i] = dist[i - 1] + math.hypot(dx, dy)
+        return ShapeStore(list(self.shape_ids), shape_start, lat, lon, dist)
+
+
+def merge_shapes(stores):
+    """One ShapeStore from per-feed stores, in feed order.
+
+    A shape_id present in several feeds keeps all its points, the later feed's after the earlier one's.
+    """
+    shape_ids = [shape_id for store in stores for shape_id in store.shape_ids]
+    if len(set(shape_ids)) != len(shape_ids):
+        builder = ShapesBuilder()
+        sequence = {}
+        for store in stores:
+            for s, shape_id in enumerate(store.shape_ids):
+                for i in range(store.shape_start[s], store.shape_start[s + 1]):
+                    sequence[shape_id] = sequence.get(shape_id, -1) + 1
+                    builder.add(shape_id, store.lat[i], store.lon[i], sequence[shape_id])
+        return builder.build()
+
+    shape_start = array("i", [0])
+    lat, lon, dist = array("d"), array("d"), array("d")
+    for store in stores:
+        offset = shape_start[-1]
+        shape_start.extend(offset + start for start in store.shape_start[1:])
+        for merged, column in ((lat, store.lat), (lon, store.lon), (dist, store.dist)):
+            merged.frombytes(memoryview(column).cast("B"))
+    return ShapeStore(shape_ids, shape_start, lat, lon, dist)
+
+
+class ShapeInterpolator:
+    """Advances vehicles along their trip's shape towards a stop, many vehicles per numpy call.
+
+    Each leg is (vehicle_id, trip_id, (lat, lon), fix_time, stop_id, stop_time): the bus is
+    assumed to cover the shape between its last fix and the stop at constant speed. Snapping
+    is cached per (vehicle, trip, fix time, stop), so once a fix has been seen a tick only pays
+    for a dict lookup per leg and one batched searchsorted. Legs whose bus or stop is not on
+    the shape (or every leg, without numpy) fall back to a straight line.
+    """
+
+    def __init__(self, shapes, trips, stops, max_offset=150.0, max_cached=50000):
+        self.shapes = shapes
+        self.trips = trips
+        self.stops = stops
+        self.max_offset = max_offset
+        self.max_cached = max_cached
+        self.enabled = np is not None and shapes is not None and len(shapes) > 0
+        self._fix_snaps = {}
+        self._stop_snaps = {}
+        self._leg_snaps = {}
+
+    def _stop_position(self, stop_id):
+        stop = self.stops.get(stop_id, {})
+        return float(stop.get("stop_lat", 0)), float(stop.get("stop_lon", 0))
+
+    def _snap_leg(self, vehicle_id, trip_id, pos, fix_time, stop_id):
+        """(shape index, along at the fix, along at the stop), or None if the leg is off-shape."""
+        shape_id = self.trips.get(trip_id, {}).get("shape_id")
+        if shape_id not in self.shapes or pos[0] is None:
+            return None
+        key = (vehicle_id, fix_time, trip_id)
+        fix = self._fix_snaps.get(key)
+        if fix is None:
+            passes = self.shapes.snap(shape_id, pos[0], pos[1], self.max_offset)
+            # Without history the first nearby pass is the best guess for where the trip is.
+            fix = self._fix_snaps[key] = passes[0] if passes else False
+        if fix is False:
+            return None
+        stop_key = (shape_id, stop_id)
+        passes = self._stop_snaps.get(stop_key)
+        if passes is None:
+            passes = self._stop_snaps[stop_key] = self.shapes.snap(shape_id, *self._stop_position(stop_id),
+                                                                   self.max_offset)
+        ahead = [along for along in passes if along >= fix - self.max_offset]
+        if not ahead:
+            return None
+        return self.shapes.shape_index[shape_id], fix, max(ahead[0], fix)
+
+    def interpolate(self, legs, now):
+        """[(lat, lon)] for each leg at unix time `now`."""
+        if not self.enabled:
+            return [self._straight_line(leg, now) for leg in legs]
+
+        # One dict lookup per leg once its snap is cached; everything else is array arithmetic.
+        snaps = self._leg_snaps
+        shape_idx, fix_along, stop_along, fix_times, stop_times, on_shape = [], [], [], [], [], []
+        results = [None] * len(legs)
+        for n, leg in enumerate(legs):
+            vehicle_id, trip_id, pos, fix_time, stop_id, stop_time = leg
+            key = (vehicle_id, trip_id, fix_time, stop_id)
+            snapped = snaps.get(key)
+            if snapped is None:
+                snapped = snaps[key] = self._snap_leg(vehicle_id, trip_id, pos, fix_time, stop_id) or False
+            if snapped is False or stop_time <= fix_time:
+                results[n] = self._straight_line(leg, now)
+                continue
+            on_shape.append(n)
+            shape_idx.append(snapped[0])
+            fix_along.append(snapped[1])
+            stop_along.append(snapped[2])
+            fix_times.append(fix_time)
+            stop_times.append(stop_time)
+
+        if on_shape:
+            fix_times = np.asarray(fix_times, dtype=np.float64)
+            f = np.clip((now - fix_times) / (np.asarray(stop_times, dtype=np.float64) - fix_times), 0.0, 1.0)
+            fix_along = np.asarray(fix_along)
+            along = fix_along + f * (np.asarray(stop_along) - fix_along)
+            lats, lons = self.shapes.points_at(np.asarray(shape_idx, dtype=np.intp), along)
+            for n, lat, lon in zip(on_shape, lats.tolist(), lons.tolist()):
+                results[n] = (lat, lon)
+
+        # Old fixes are never asked for again; dropping everything now and then keeps the caches bounded.
+        if len(snaps) > self.max_cached:
+            self._leg_snaps = {}
+            self._fix_snaps = {}
+        return results
+
+    def _straight_line(self, leg, now):
+        _, _, pos, fix_time, stop_id, stop_time = leg
+        if stop_time <= fix_time or pos[0] is None:
+            return pos
+        f = min(1.0, max(0.0, (now - fix_time) / (stop_time - fix_time)))
+        stop_lat, stop_lon = self._stop_position(stop_id)
+        return pos[0] + f * (stop_lat - pos[0]), pos[1] + f * (stop_lon - pos[1])
@@ -0,0 +1,153 @@
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import sys
+import tempfile
+
+from fast_json import dumps_bytes
+from live_feed import NO_UPDATES, FeedChanges, StopTimeUpdates, Vehicle
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The LiveStateChannel file in shared_dir(): the poller writes it, the workers and stream_server.py follow it.
+LIVE_STATE_FILE = "live_state.json"
+
+
+def shared_dir():
+    """This deployment's private directory for the poller lock and live state channel.
+
+    On tmpfs when available, so the published state lives in shared memory rather than on
+    disk. The default is named after the user and the app directory (so each deployment
+    gets its own) and created 0700; BUS_APP_SHARED_DIR overrides it. Either way it must be
+    a real directory owned by this user that no one else can write to, or RuntimeError:
+    whoever can write there can feed every worker its vehicles or stall the poller election.
+    """
+    path = os.environ.get("BUS_APP_SHARED_DIR")
+    if not path:
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        deployment = hashlib.sha256(MODULE_DIR.encode("utf-8")).hexdigest()[:12]
+        path = os.path.join(base, f"cyprus_bus-{os.getuid()}-{deployment}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(f"Shared state directory {path} must be a directory owned by uid {os.getuid()} "
+                           f"with mode 0700")
+    return path
+
+
+class PollerElection:
+    """Elects one process per host as the GTFS-RT poller with an exclusive flock.
+
+    The kernel releases the lock when the holder exits, so a follower that keeps calling
+    try_acquire() takes over after the poller dies.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    @property
+    def is_leader(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        self._fd = fd
+        return True
+
+
+class UpdateRequest:
+    """A feed refresh asked for on any worker, handed to the poller as a flag file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def request(self):
+        os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600))
+
+    def take(self):
+        """True (and the flag cleared) if a refresh was requested since the last take()."""
+        try:
+            os.remove(self.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def encode_state(version, vehicles, changes, feed_timestamp):
+    """JSON bytes of one published state: plain data only, so reading it can't run code."""
+    if changes is not None:
+        changes = {"added": sorted(changes.added), "changed": sorted(changes.changed), "removed": sorted(changes.removed)}
+    return dumps_bytes({
+        "version": version,
+        "feed_timestamp": feed_timestamp,
+        "vehicles": [[v.vehicle_id, v.trip_id, v.timestamp, v.lat, v.lon, v.updates.stop_ids,
+                      v.updates.arrival_time.tolist(), v.updates.arrival_delay.tolist(),
+                      v.updates.departure_time.tolist(), v.updates.departure_delay.tolist()]
+                     for v in vehicles.values()],
+        "changes": changes,
+    })
+
+
+def decode_state(body):
+    """(version, vehicles, changes, feed_timestamp) from encode_state bytes."""
+    state = json.loads(body)
+    vehicles = {}
+    for vehicle_id, trip_id, timestamp, lat, lon, stop_ids, *columns in state["vehicles"]:
+        updates = StopTimeUpdates([sys.intern(stop_id) for stop_id in stop_ids], *columns) if stop_ids else NO_UPDATES
+        vehicles[vehicle_id] = Vehicle(vehicle_id, trip_id, timestamp, lat, lon, updates)
+    changes = state["changes"]
+    if changes is not None:
+        changes = FeedChanges(vehicles, set(changes["added"]), set(changes["changed"]), set(changes["removed"]))
+    return state["version"], vehicles, changes, state["feed_timestamp"]
+
+
+class LiveStateChannel:
+    """Hands the decoded live feed from the poller to the other workers through one shared file.
+
+    publish() writes (version, vehicles, changes, feed_timestamp) as JSON to a temp file and
+    renames it over the channel path, so readers see either the old or the new state, never a
+    partial one. poll() is a stat() until the file is replaced, then one decode.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._seen = None
+
+    def publish(self, version, vehicles, changes=None, feed_timestamp=None):
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(encode_state(version, vehicles, changes, feed_timestamp))
+        os.replace(tmp_path, self.path)
+
+    def poll(self):
+        """(version, vehicles, changes, feed_timestamp) if a new state was published since the last poll, else None."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            # fstat the file we opened, so the identity matches the content even if it is replaced meanwhile.
+            st = os.fstat(f.fileno())
+            identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if identity == self._seen:
+                return None
+            try:
+                state = decode_state(f.read())
+            except (ValueError, KeyError, TypeError):
+                return None
+        self._seen = identity
+        return state
@@ -0,0 +1,155 @@
+import heapq
+import math
+
+METERS_PER_DEGREE = 111_320
+
+
+def check_coordinates(lat, lon):
+    """Raises ValueError unless lat and lon are finite and on the globe."""
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise ValueError("coordinates must be finite")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("lat must be within ±90 and lon within ±180")
+
+
+def parse_point(value):
+    """'lat,lon' -> (lat, lon) floats; raises ValueError."""
+    lat, lon = (float(part) for part in value.split(","))
+    check_coordinates(lat, lon)
+    return lat, lon
+
+
+def parse_bbox(value):
+    """Leaflet's toBBoxString() order, 'west,south,east,north' -> (min_lat, min_lon, max_lat, max_lon)."""
+    west, south, east, north = (float(part) for part in value.split(","))
+    check_coordinates(south, west)
+    check_coordinates(north, east)
+    if west > east or south > north:
+        raise ValueError("bbox must be west,south,east,north")
+    return south, west, north, east
+
+
+class GridIndex:
+    """Uniform lat/lon grid over (lat, lon, item) points.
+
+    bbox queries visit only the cells overlapping the box; nearest-N queries scan rings of
+    cells outward from the query point, clipped to the occupied extent, and stop once no
+    unvisited cell can hold anything closer than the N-th best match. A query point outside
+    the extent is answered by one pass over all points instead, so far-away queries cost at
+    most O(points). cell_size is in degrees (0.01 deg ~ 1.1 km).
+    """
+
+    def __init__(self, points, cell_size=0.01):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.size = 0
+        for lat, lon, item in points:
+            if lat is None or lon is None:
+                continue
+            self.cells.setdefault(self._cell(lat, lon), []).append((lat, lon, item))
+            self.size += 1
+        if self.cells:
+            xs = [x for x, _ in self.cells]
+            ys = [y for _, y in self.cells]
+            self._extent = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            self._extent = None
+
+    def __len__(self):
+        return self.size
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def within(self, min_lat, min_lon, max_lat, max_lon, limit=None):
+        """Items inside the box, at most `limit` of them (in no particular order)."""
+        results = []
+        if self._extent is None:
+            return results
+        x0, y0 = self._cell(min_lat, min_lon)
+        x1, y1 = self._cell(max_lat, max_lon)
+        ex0, ey0, ex1, ey1 = self._extent
+        x0, y0, x1, y1 = max(x0, ex0), max(y0, ey0), min(x1, ex1), min(y1, ey1)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # Huge box: walking the occupied cells is cheaper than walking the box.
+            candidates = (cell for (x, y), cell in self.cells.items() if x0 <= x <= x1 and y0 <= y <= y1)
+        else:
+            candidates = (self.cells.get((x, y), ()) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+        for cell in candidates:
+            for lat, lon, item in cell:
+                if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                    results.append(item)
+                    if limit is not None and len(results) >= limit:
+                        return results
+        return results
+
+    def nearest(self, lat, lon, n=10):
+        """[(distance_m, item)] for the n items closest to (lat, lon), closest first."""
+        if self._extent is None or n <= 0:
+            return []
+        cos_lat = math.cos(math.radians(lat))
+        cx, cy = self._cell(lat, lon)
+        ex0, ey0, ex1, ey1 = self._extent
+        if not (ex0 <= cx <= ex1 and ey0 <= cy <= ey1):
+            return self._nearest_scan(lat, lon, n, cos_lat)
+        max_ring = max(abs(cx - ex0), abs(cx - ex1), abs(cy - ey0), abs(cy - ey1))
+        # A point k + 1 rings out differs by more than k cells on one axis; lon degrees are the shorter.
+        ring_gap_m = self.cell_size * METERS_PER_DEGREE * min(1.0, cos_lat)
+
+        best = []  # max-heap of (-distance, tiebreak, item)
+        counter = 0
+        for ring in range(max_ring + 1):
+            if len(best) >= n and -best[0][0] <= ring_gap_m * (ring - 1):
+                break
+            for x, y in self._ring(cx, cy, ring, self._extent):
+                for p_lat, p_lon, item in self.cells.get((x, y), ()):
+                    dy = (p_lat - lat) * METERS_PER_DEGREE
+                    dx = (p_lon - lon) * METERS_PER_DEGREE * cos_lat
+                    distance = math.hypot(dx, dy)
+                    counter += 1
+                    if len(best) < n:
+                        heapq.heappush(best, (-distance, counter, item))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, counter, item))
+        return [(-d, item) for d, _, item in sorted(best, reverse=True)]
+
+    def _nearest_scan(self, lat, lon, n, cos_lat):
+        def distances():
+            for cell in self.cells.values():
+                for p_lat, p_lon, item in cell:
+                    yield math.hypot((p_lon - lon) * METERS_PER_DEGREE * cos_lat,
+                                     (p_lat - lat) * METERS_PER_DEGREE), item
+        return heapq.nsmallest(n, distances(), key=lambda pair: pair[0])
+
+    @staticmethod
+    def _ring(cx, cy, ring, extent):
+        """Cells of the square ring `ring` cells out from (cx, cy) that lie inside extent."""
+        if ring == 0:
+            yield cx, cy
+            return
+        ex0, ey0, ex1, ey1 = extent
+        xs = range(max(cx - ring, ex0), min(cx + ring, ex1) + 1)
+        for y in (cy - ring, cy + ring):
+            if ey0 <= y <= ey1:
+                for x in xs:
+                    yield x, y
+        ys = range(max(cy - ring + 1, ey0), min(cy + ring - 1, ey1) + 1)
+        for x in (cx - ring, cx + ring):
+            if ex0 <= x <= ex1:
+                for y in ys:
+                    yield x, y
+
+
+def stop_points(stops):
+    """(lat, lon, stop) for every stop with usable coordinates."""
+    for stop in stops.values():
+        try:
+            yield float(stop["stop_lat"]), float(stop["stop_lon"]), stop
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+def vehicle_points(positions):
+    """(lat, lon, record) for position records that have a fix."""
+    for record in positions.values():
+        yield record["latitude"], record["longitude"], record
@@ -0,0 +1,235 @@
+import fcntl
+import gc
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from departure_boards import DepartureBoards
+from gtfs_static import (SNAPSHOT_PATH, SOURCE_FILES, STATIC_DATA_FOLDERS, feed_hash,
+                         feed_snapshot_path, load_snapshot, merge_feeds, parse_feeds_isolated, source_hash,
+                         write_snapshot)
+from http_cache import PrecompressedBody
+from metrics import rss_mb
+from route_index import RouteIndex
+from shape_store import ShapeInterpolator
+from spatial_index import GridIndex, stop_points
+
+
+def deep_sizeof(obj, seen=None):
+    """sys.getsizeof of obj and everything reachable through dicts, lists, tuples and sets, each object once."""
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+
+def column_bytes(*columns):
+    return sum(memoryview(column).nbytes for column in columns if column is not None)
+
+
+class StaticGeneration:
+    """One load of the static GTFS data and everything derived from it, never modified after construction.
+
+    Readers take a reference to the current generation once (per request, per view) and use
+    only that, so a reload swapping in the next generation never mixes old and new data.
+    """
+
+    def __init__(self, static_data, number=1, feed_hashes=None, tz=None, dumps=None, stops_data=None):
+        self.number = number
+        self.feed_hashes = dict(feed_hashes or {})
+        self.loaded_at = time.time()
+        self.static_data = static_data
+        self.stops_data = stops_data if stops_data is not None else list(static_data["stops"].values())
+        self.stop_grid = GridIndex(stop_points(static_data["stops"]))
+        self.interpolator = ShapeInterpolator(static_data.get("shapes"), static_data["trips"], static_data["stops"])
+        self.route_index = RouteIndex(static_data["routes"], static_data["trips"], static_data.get("stop_times"))
+        self.departure_boards = None
+        if static_data.get("stop_times") is not None and tz is not None:
+            self.departure_boards = DepartureBoards(static_data["stop_times"], static_data["trips"],
+                                                    static_data["routes"], static_data.get("service_dates", {}), tz)
+        self.bus_stops_body = None
+        if dumps is not None:
+            self.bus_stops_body = PrecompressedBody(dumps({"stops": self.stops_data}).encode("utf-8"))
+        self._footprint = None
+
+    @classmethod
+    def from_data(cls, data, number=1, feed_hashes=None, tz=None, dumps=None):
+        """From the tuple gtfs_static.load_static_data returns."""
+        routes_dict, stops_data, trips_dict, stop_times_store, shape_store, service_dates = data
+        static_data = {
+            "routes": routes_dict,
+            "stops": {stop["stop_id"]: stop for stop in stops_data},
+            "trips": trips_dict,
+            "stop_times": stop_times_store,
+            "shapes": shape_store,
+            "service_dates": service_dates,
+        }
+        return cls(static_data, number, feed_hashes, tz, dumps, stops_data)
+
+    def footprint(self):
+        """Approximate bytes held per part of the static data; walked once per generation, on first use.
+
+        The stop_times and shapes columns may be views into the mapped snapshot (page cache,
+        shared between workers) rather than heap.
+        """
+        if self._footprint is None:
+            data = self.static_data
+            footprint = {"tables": deep_sizeof([data["routes"], data["stops"], data["trips"], self.stops_data])}
+            store = data.get("stop_times")
+            if store is not None:
+                footprint["stop_times"] = column_bytes(store.trip_start, store.stop_index, store.arrival,
+                                                       store.departure, store.stop_sequence)
+            shapes = data.get("shapes")
+            if shapes is not None:
+                footprint["shapes"] = column_bytes(shapes.shape_start, shapes.lat, shapes.lon, shapes.dist)
+            self._footprint = footprint
+        return self._footprint
+
+    def describe(self):
+        return {
+            "generation": self.number,
+            "loaded_at": self.loaded_at,
+            "routes": len(self.static_data["routes"]),
+            "stops": len(self.static_data["stops"]),
+            "trips": len(self.static_data["trips"]),
+            "feeds": {folder: digest.hex()[:12] for folder, digest in self.feed_hashes.items()},
+        }
+
+
+def folder_signature(folder):
+    """Cheap change detector: (name, mtime, size) of every source file; hashing only happens when it moves."""
+    signature = []
+    for name in SOURCE_FILES:
+        try:
+            st = os.stat(os.path.join(folder, name))
+            signature.append((name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append((name, None, None))
+    return tuple(signature)
+
+
+class StaticReloader:
+    """Watches the feed folders and swaps in a new StaticGeneration when one of them changes.
+
+    Changed feeds are re-parsed in a worker process, in parallel when several changed (the CSV parsing would otherwise
+    hold the GIL away from request threads) which writes their per-feed snapshots; unchanged
+    feeds come from their existing snapshots. The merged result is written as the main
+    snapshot and mapped back in, then handed to on_swap in one assignment. A file lock
+    keeps several gunicorn workers from parsing the same drop: the later ones find the
+    merged snapshot already written and just map it.
+    """
+
+    def __init__(self, generation, build_generation, on_swap, folders=STATIC_DATA_FOLDERS,
+                 snapshot_path=SNAPSHOT_PATH, parse_timeout=600):
+        self.generation = generation
+        self.build_generation = build_generation
+        self.on_swap = on_swap
+        self.folders = list(folders)
+        self.snapshot_path = snapshot_path
+        self.parse_timeout = parse_timeout
+        self.signatures = {folder: folder_signature(folder) for folder in self.folders}
+        self.last_report = None
+        self.reloads = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Reloads if any folder changed. Returns the reload report, or None if nothing changed."""
+        with self._lock:
+            signatures = {folder: folder_signature(folder) for folder in self.folders}
+            moved = [folder for folder in self.folders if signatures[folder] != self.signatures.get(folder)]
+            if not moved:
+                return None
+            hashes = dict(self.generation.feed_hashes)
+            for folder in moved:
+                hashes[folder] = feed_hash(folder)
+            changed = [folder for folder in moved if hashes[folder] != self.generation.feed_hashes.get(folder)]
+            if changed:
+                self._reload(hashes, changed)
+            # Only remember the signatures once the new data is live, so a failed reload is retried.
+            self.signatures = signatures
+            return self.last_report if changed else None
+
+    def _reload(self, hashes, changed):
+        start = time.perf_counter()
+        rss_before = rss_mb()
+        samples = [rss_before]
+        src_hash = source_hash(self.folders, hashes)
+        parsed = []
+
+        with open(f"{self.snapshot_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = load_snapshot(self.snapshot_path, src_hash)
+            if data is None:
+                feeds = {folder: load_snapshot(feed_snapshot_path(folder), hashes[folder]) for folder in self.folders}
+                stale = [folder for folder in self.folders if feeds[folder] is None]
+                if stale:
+                    parsed = self._parse(stale)
+                    for folder in stale:
+                        feeds[folder] = load_snapshot(feed_snapshot_path(folder), hashes[folder])
+                missing = [folder for folder in self.folders if feeds[folder] is None]
+                if missing:
+                    raise RuntimeError(f"Could not load feeds {missing}")
+                merged = merge_feeds([feeds[folder] for folder in self.folders])
+                write_snapshot(merged, src_hash, self.snapshot_path)
+                samples.append(rss_mb())
+                del merged, feeds
+                # Map the file back instead of keeping the heap copy, so the columns are shared again.
+                data = load_snapshot(self.snapshot_path, src_hash)
+        parse_seconds = time.perf_counter() - start
+
+        generation = self.build_generation(data, self.generation.number + 1, hashes)
+        # Both generations are alive here: this is the high-water mark of the swap.
+        samples.append(rss_mb())
+        rss_peak = max(filter(None, samples), default=None)
+        previous = self.generation
+        self.generation = generation
+        self.on_swap(generation)
+        del previous, data
+        gc.collect()
+
+        self.reloads += 1
+        self.last_report = {
+            "generation": generation.number,
+            "changed": changed,
+            "parsed": parsed,
+            "seconds": time.perf_counter() - start,
+            "load_seconds": parse_seconds,
+            "rss_before_mb": rss_before,
+            "rss_peak_mb": rss_peak,
+            "rss_after_mb": rss_mb(),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        print(f"🔄 Static GTFS generation {generation.number}: {', '.join(changed)} changed, "
+              f"reloaded in {self.last_report['seconds']:.2f}s (peak RSS {rss_peak or 0:.0f} MB)")
+
+    def _parse(self, folders):
+        # A fresh interpreter rather than a fork: the server has threads that may hold locks at fork time.
+        return list(parse_feeds_isolated(folders, self.parse_timeout).values())
+
+    def start(self, interval=30):
+        def reload_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    self.failures += 1
+                    print("Static GTFS reload failed:", e)
+
+        thread = threading.Thread(target=reload_loop, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,213 @@
+import pickle
+from array import array
+from collections.abc import Sequence
+
+
+def parse_gtfs_time(value):
+    """'HH:MM:SS' -> seconds since midnight of the service day (hours may exceed 23)."""
+    h, m, s = value.strip().split(":")
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+def format_gtfs_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _int_column(buffer):
+    return memoryview(buffer).cast("B").cast("i")
+
+
+class TripStopTimes(Sequence):
+    """Read-only view of one trip's rows, yielding the same dicts the CSV loader used to build."""
+    __slots__ = ("store", "start", "end")
+
+    def __init__(self, store, start, end):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(self.start + j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("stop_times index out of range")
+        return self._row(self.start + i)
+
+    def __iter__(self):
+        for row in range(self.start, self.end):
+            yield self._row(row)
+
+    def __reduce__(self):
+        return TripStopTimes, (self.store, self.start, self.end)
+
+    def __repr__(self):
+        return f"<TripStopTimes rows={len(self)}>"
+
+    def _row(self, row):
+        store = self.store
+        return {
+            "stop_id": store.stop_ids[store.stop_index[row]],
+            "arrival_time": format_gtfs_time(store.arrival[row]),
+            "departure_time": format_gtfs_time(store.departure[row]),
+            "stop_sequence": store.stop_sequence[row],
+        }
+
+
+class StopTimesStore:
+    """Columnar stop_times: rows grouped by trip and sorted by stop_sequence.
+
+    Stop ids are interned into ``stop_ids`` and referenced by index; times are seconds
+    since midnight. Rows of trip ``trip_ids[t]`` live in ``trip_start[t]:trip_start[t + 1]``.
+    The int columns are ``array('i')`` after a CSV load and memoryviews over the snapshot
+    mmap after a snapshot load; both index the same way.
+    """
+
+    def __init__(self, stop_ids, trip_ids, trip_start, stop_index, arrival, departure, stop_sequence):
+        self.stop_ids = stop_ids
+        self.trip_ids = trip_ids
+        self.trip_index = {trip_id: t for t, trip_id in enumerate(trip_ids)}
+        self.trip_start = trip_start
+        self.stop_index = stop_index
+        self.arrival = arrival
+        self.departure = departure
+        self.stop_sequence = stop_sequence
+
+    def __len__(self):
+        return len(self.stop_index)
+
+    def __contains__(self, trip_id):
+        return trip_id in self.trip_index
+
+    def trip(self, trip_id):
+        t = self.trip_index.get(trip_id)
+        if t is None:
+            return TripStopTimes(self, 0, 0)
+        return TripStopTimes(self, self.trip_start[t], self.trip_start[t + 1])
+
+    def attach(self, trips_dict):
+        """Sets trips_dict[trip_id]["stop_times"] for every trip that has rows."""
+        for trip_id in self.trip_ids:
+            if trip_id in trips_dict:
+                trips_dict[trip_id]["stop_times"] = self.trip(trip_id)
+
+    def __reduce_ex__(self, protocol):
+        # Protocol 5 lets the snapshot writer store the columns out-of-band and the loader
+        # hand them back as zero-copy views into the mmap.
+        wrap = pickle.PickleBuffer if protocol >= 5 else bytes
+        columns = (self.trip_start, self.stop_index, self.arrival, self.departure, self.stop_sequence)
+        return _rebuild_store, (self.stop_ids, self.trip_ids) + tuple(wrap(c) for c in columns)
+
+
+def _rebuild_store(stop_ids, trip_ids, *columns):
+    return StopTimesStore(stop_ids, trip_ids, *(_int_column(c) for c in columns))
+
+
+class StopTimesBuilder:
+    """Collects stop_times rows in any order and sorts them once into a StopTimesStore."""
+
+    def __init__(self):
+        self._stop_lookup = {}
+        self._trip_lookup = {}
+        self._time_lookup = {}
+        self.trip_ids = []
+        self._trip = array("i")
+        self._stop = array("i")
+        self._arrival = array("i")
+        self._departure = array("i")
+        self._sequence = array("i")
+
+    def add(self, trip_id, stop_id, arrival_time, departure_time, stop_sequence):
+        # Parse everything before appending so a bad row leaves the columns aligned.
+        arrival = self._seconds(arrival_time)
+        departure = self._seconds(departure_time)
+        self.add_parsed(trip_id, stop_id, arrival, departure, int(stop_sequence))
+
+    def add_parsed(self, trip_id, stop_id, arrival, departure, sequence):
+        t = self._trip_lookup.get(trip_id)
+        if t is None:
+            t = self._trip_lookup[trip_id] = len(self.trip_ids)
+            self.trip_ids.append(trip_id)
+        s = self._stop_lookup.get(stop_id)
+        if s is None:
+            s = self._stop_lookup[stop_id] = len(self._stop_lookup)
+        self._trip.append(t)
+        self._stop.append(s)
+        self._arrival.append(arrival)
+        self._departure.append(departure)
+        self._sequence.append(sequence)
+
+    def _seconds(self, value):
+        # A feed only uses a few thousand distinct times, so parse each one once.
+        seconds = self._time_lookup.get(value)
+        if seconds is None:
+            seconds = self._time_lookup[value] = parse_gtfs_time(value)
+        return seconds
+
+    def build(self):
+        trip, sequence = self._trip, self._sequence
+        order = sorted(range(len(trip)), key=lambda i: (trip[i], sequence[i]))
+
+        trip_start = array("i", [0] * (len(self.trip_ids) + 1))
+        for t in trip:
+            trip_start[t + 1] += 1
+        for t in range(len(self.trip_ids)):
+            trip_start[t + 1] += trip_start[t]
+
+        def take(column):
+            return array("i", (column[i] for i in order))
+
+        stop_ids = [None] * len(self._stop_lookup)
+        for stop_id, s in self._stop_lookup.items():
+            stop_ids[s] = stop_id
+        return StopTimesStore(stop_ids, list(self.trip_ids), trip_start, take(self._stop),
+                              take(self._arrival), take(self._departure), take(sequence))
+
+
+def merge_stores(stores):
+    """One StopTimesStore from per-feed stores, in feed order.
+
+    Equivalent to loading every feed into a single StopTimesBuilder: trips and stops are
+    numbered by first appearance and a trip_id present in several feeds keeps the rows of
+    all of them. Without such collisions the columns are simply concatenated.
+    """
+    trip_ids, seen = [], set()
+    collision = False
+    for store in stores:
+        for trip_id in store.trip_ids:
+            if trip_id in seen:
+                collision = True
+            seen.add(trip_id)
+            trip_ids.append(trip_id)
+
+    if collision:
+        builder = StopTimesBuilder()
+        for store in stores:
+            for t, trip_id in enumerate(store.trip_ids):
+                for row in range(store.trip_start[t], store.trip_start[t + 1]):
+                    builder.add_parsed(trip_id, store.stop_ids[store.stop_index[row]], store.arrival[row],
+                                       store.departure[row], store.stop_sequence[row])
+        return builder.build()
+
+    stop_lookup, stop_ids = {}, []
+    trip_start = array("i", [0])
+    stop_index, arrival, departure, stop_sequence = array("i"), array("i"), array("i"), array("i")
+    for store in stores:
+        remap = []
+        for stop_id in store.stop_ids:
+            s = stop_lookup.get(stop_id)
+            if s is None:
+                s = stop_lookup[stop_id] = len(stop_ids)
+                stop_ids.append(stop_id)
+            remap.append(s)
+        offset = trip_start[-1]
+        trip_start.extend(offset + start for start in store.trip_start[1:])
+        stop_index.extend(remap[s] for s in store.stop_index)
+        for merged, column in ((arrival, store.arrival), (departure, store.departure),
+                               (stop_sequence, store.stop_sequence)):
+            merged.frombytes(memoryview(column).cast("B"))
+    return StopTimesStore(stop_ids, trip_ids, trip_start, stop_index, arrival, departure, stop_sequence)
@@ -0,0 +1,170 @@
+"""Serves /vehicle_positions/stream (Server-Sent Events) from one asyncio process.
+
+Under gthread every open stream holds a worker thread, so the workers can only afford a few.
+Here a stream is a socket and a coroutine: the process follows the live state channel the
+poller writes (like any worker), turns each new version into one snapshot and one delta frame,
+and writes them to every client. gunicorn.conf.py starts it next to the workers, which
+redirect /vehicle_positions/stream to it.
+Usage: python stream_server.py [host:port]  (default STREAM_BIND or 127.0.0.1:8001)
+"""
+import asyncio
+import os
+import resource
+import sys
+
+from bus_app_state import diff_positions, position_record
+from fast_json import dumps_bytes
+from feed_broadcast import KEEPALIVE, sse_message
+from shared_state import LIVE_STATE_FILE, LiveStateChannel, shared_dir
+
+STREAM_PATH = b"/vehicle_positions/stream"
+# Open connections this process accepts; past it clients get 503 and the map polls.
+STREAM_MAX_CLIENTS = int(os.environ.get("STREAM_MAX_CLIENTS", "10000"))
+# The stream may be on another port than the page, so let EventSource read it cross-origin.
+SSE_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+               b"Content-Type: text/event-stream\r\n"
+               b"Cache-Control: no-cache\r\n"
+               b"X-Accel-Buffering: no\r\n"
+               b"Access-Control-Allow-Origin: *\r\n"
+               b"Connection: close\r\n\r\n")
+
+
+def json_response(status, obj, headers=b""):
+    body = dumps_bytes(obj)
+    return (f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            .encode("ascii") + headers + b"Connection: close\r\n\r\n" + body)
+
+
+class StreamHub:
+    """The newest feed version as finished SSE frames, shared by every connected client.
+
+    Frames are serialized once per version: a snapshot, and a delta from the version before.
+    A client still writing an older frame when versions arrive is sent the newest snapshot
+    next, so however slowly it reads it never has more than one frame buffered.
+    """
+
+    def __init__(self, max_clients=STREAM_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.clients = 0
+        self.rejected = 0
+        self.version = None
+        self.positions = {}
+        self.snapshot = None
+        self.delta = None
+        self.delta_since = None
+        self._changed = asyncio.Event()
+
+    def update(self, version, vehicles):
+        positions = {vehicle_id: position_record(vehicle_id, vehicle) for vehicle_id, vehicle in vehicles.items()}
+        previous = self.version
+        self.snapshot = sse_message("snapshot", dumps_bytes({"version": version, "full": True,
+                                                             "vehicles": list(positions.values())}), version)
+        self.delta = None
+        if previous is not None:
+            added, moved, removed = diff_positions(self.positions, positions)
+            self.delta = sse_message("delta", dumps_bytes({"version": version, "full": False, "added": added,
+                                                           "moved": moved, "removed": removed, "since": previous}),
+                                     version)
+        self.delta_since = previous
+        self.version = version
+        self.positions = positions
+        # Wake every waiting client; later waits use a fresh event.
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def frame_after(self, sent):
+        """The frame taking a client from version `sent` to the newest, or None if it has it."""
+        if self.version is None or self.version == sent:
+            return None
+        if sent is not None and sent == self.delta_since:
+            return self.delta
+        return self.snapshot
+
+    async def serve(self, writer, keepalive=15, write_timeout=60):
+        """Writes frames to one client until it goes away or stops reading for write_timeout seconds."""
+        writer.write(SSE_HEADERS)
+        sent = None
+        while True:
+            frame = self.frame_after(sent)
+            if frame is not None:
+                sent = self.version
+            else:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), keepalive)
+                    continue
+                except asyncio.TimeoutError:
+                    frame = KEEPALIVE
+            writer.write(frame)
+            await asyncio.wait_for(writer.drain(), write_timeout)
+
+    def status(self):
+        return {"version": self.version, "vehicles": len(self.positions), "clients": self.clients,
+                "max_clients": self.max_clients, "rejected": self.rejected}
+
+
+async def handle(hub, reader, writer):
+    try:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            return
+        method, _, target = head.split(b"\r\n", 1)[0].partition(b" ")
+        path = target.split(b" ", 1)[0].split(b"?", 1)[0]
+        if method != b"GET":
+            writer.write(json_response("405 Method Not Allowed", {"error": "GET only"}))
+        elif path == b"/healthz":
+            writer.write(json_response("200 OK", hub.status()))
+        elif path != STREAM_PATH:
+            writer.write(json_response("404 Not Found", {"error": "Not found"}))
+        elif hub.clients >= hub.max_clients:
+            hub.rejected += 1
+            writer.write(json_response("503 Service Unavailable",
+                                       {"error": "Too many open streams; poll /vehicle_positions/delta"},
+                                       b"Retry-After: 60\r\n"))
+        else:
+            hub.clients += 1
+            try:
+                await hub.serve(writer)
+            finally:
+                hub.clients -= 1
+            return
+        await writer.drain()
+    except (ConnectionError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+
+
+async def follow(hub, channel, interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            # Off the event loop: decoding a large fleet would stall every client's writes.
+            state = await loop.run_in_executor(None, channel.poll)
+            if state is not None:
+                version, vehicles, _, _ = state
+                hub.update(version, vehicles)
+        except Exception as e:
+            print("Applying shared feed failed:", e)
+        await asyncio.sleep(interval)
+
+
+async def serve_streams(bind, follow_interval=0.1):
+    host, _, port = bind.rpartition(":")
+    hub = StreamHub()
+    channel = LiveStateChannel(os.path.join(shared_dir(), LIVE_STATE_FILE))
+    server = await asyncio.start_server(lambda reader, writer: handle(hub, reader, writer), host or None, int(port),
+                                        backlog=1024)
+    print(f"📡 [stream {os.getpid()}] Serving {STREAM_PATH.decode()} on {bind} (up to {hub.max_clients} clients)")
+    async with server:
+        await asyncio.gather(server.serve_forever(), follow(hub, channel, follow_interval))
+
+
+if __name__ == "__main__":
+    # One descriptor per client: allow as many as the hard limit does.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+    asyncio.run(serve_streams(sys.argv[1] if len(sys.argv) > 1 else os.environ.get("STREAM_BIND", "127.0.0.1:8001")))
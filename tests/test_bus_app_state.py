@@ -0,0 +1,59 @@
+import os
+import sys
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bus_app_state import AppState, BusAppStateManager
+from live_feed import NO_UPDATES, Vehicle
+
+NOW = datetime(2026, 6, 1, 12, tzinfo=ZoneInfo("Asia/Nicosia"))
+
+
+def manager():
+    state = BusAppStateManager({"stops": {}, "trips": {}, "routes": {}},
+                               {"vehicles": {}, "stop_index": {}, "version": 0})
+    state.publish_feed({"A": Vehicle("A", "TA", 100, 35.0, 33.0, NO_UPDATES)})
+    return state
+
+
+def test_slow_view_does_not_block_other_views():
+    state = manager()
+    release = threading.Event()
+    slow_started = threading.Event()
+    computed = []
+
+    def stop_table(stop_id, current_time=None):
+        computed.append(stop_id)
+        if stop_id == "SLOW":
+            slow_started.set()
+            release.wait(5)
+        return {"stop_id": stop_id}
+
+    state.update_stop_table = stop_table
+    slow = [threading.Thread(target=state.view, args=(AppState.STOP_SELECTED, "SLOW", NOW)) for _ in range(3)]
+    for thread in slow:
+        thread.start()
+    assert slow_started.wait(5)
+
+    # The other views answer while SLOW is still being computed.
+    assert state.view(AppState.STOP_SELECTED, "FAST", NOW) == {"stop_id": "FAST"}
+    assert "A" in state.view(AppState.DEFAULT, None, NOW)["bus_locations"]
+    assert all(thread.is_alive() for thread in slow)
+
+    release.set()
+    for thread in slow:
+        thread.join(5)
+    # The three concurrent polls of SLOW shared one computation.
+    assert computed.count("SLOW") == 1
+    assert state.view(AppState.STOP_SELECTED, "SLOW", NOW) == {"stop_id": "SLOW"}
+
+
+def test_published_state_is_replaced_not_modified():
+    state = manager()
+    before = state.live_feed_state
+    state.publish_feed({"B": Vehicle("B", "TB", 130, 35.0, 33.0, NO_UPDATES)})
+    assert list(before["vehicles"]) == ["A"] and before["version"] == 1
+    assert list(state.live_feed_state["vehicles"]) == ["B"] and state.live_feed_state["version"] == 2
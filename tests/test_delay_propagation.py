@@ -0,0 +1,78 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delay_propagation import DelayPropagator, propagate_trip
+from live_feed import StopTimeUpdates, Vehicle
+from stop_times_store import StopTimesBuilder, parse_gtfs_time
+
+# 2026-03-01 00:00 UTC, a whole hour like every service day start.
+DAY_START = 1772323200
+
+
+def store_with_trip(*stops):
+    """A store with one trip T calling at (stop_id, "HH:MM:SS") in order, dwelling one minute at each."""
+    builder = StopTimesBuilder()
+    for sequence, (stop_id, time) in enumerate(stops, 1):
+        departure = parse_gtfs_time(time) + 60
+        builder.add_parsed("T", stop_id, parse_gtfs_time(time), departure, sequence)
+    store = builder.build()
+    return store, {stop_id: s for s, stop_id in enumerate(store.stop_ids)}
+
+
+def updates(*rows):
+    """StopTimeUpdates from (stop_id, scheduled "HH:MM:SS", delay seconds)."""
+    times = [DAY_START + parse_gtfs_time(time) + delay for _, time, delay in rows]
+    delays = [delay for _, _, delay in rows]
+    return StopTimeUpdates([stop_id for stop_id, _, _ in rows], times, delays, times, delays)
+
+
+def test_omitted_stops_get_the_delay_of_the_last_matched_stop_before_them():
+    store, stop_rows = store_with_trip(("A", "08:00:00"), ("B", "08:10:00"), ("C", "08:20:00"),
+                                       ("D", "08:30:00"), ("E", "08:40:00"))
+    predicted = propagate_trip(store, 0, updates(("B", "08:10:00", 60), ("D", "08:30:00", 300)), stop_rows)
+    # A is before the first update (already passed); B and D are in the feed.
+    assert list(predicted.stop_ids) == ["C", "E"]
+    assert predicted.arrival_delay.tolist() == [60, 300]
+    assert predicted.arrival_time.tolist() == [DAY_START + parse_gtfs_time("08:20:00") + 60,
+                                               DAY_START + parse_gtfs_time("08:40:00") + 300]
+    assert predicted.departure_time[0] == predicted.arrival_time[0] + 60
+
+
+def test_updates_are_matched_in_trip_order():
+    # An update for a stop the trip doesn't serve, and one without a time, are ignored.
+    store, stop_rows = store_with_trip(("A", "08:00:00"), ("B", "08:10:00"), ("C", "08:20:00"), ("D", "08:30:00"))
+    feed_updates = updates(("A", "08:00:00", 120), ("X", "08:05:00", 900), ("C", "08:20:00", 240))
+    feed_updates.arrival_time[1] = 0
+    predicted = propagate_trip(store, 0, feed_updates, stop_rows)
+    assert list(predicted.stop_ids) == ["B", "D"]
+    assert predicted.arrival_delay.tolist() == [120, 240]
+
+
+def test_loop_trip_anchors_on_the_visit_matching_the_schedule():
+    # The trip starts and ends at A; the update is for the second visit, 08:30.
+    store, stop_rows = store_with_trip(("A", "08:00:00"), ("B", "08:10:00"), ("C", "08:20:00"),
+                                       ("A", "08:30:00"), ("D", "08:40:00"))
+    predicted = propagate_trip(store, 0, updates(("A", "08:30:00", 180)), stop_rows)
+    # Anchored on the first visit, B and C would be predicted for half an hour from now.
+    assert list(predicted.stop_ids) == ["D"]
+    assert predicted.arrival_time[0] == DAY_START + parse_gtfs_time("08:40:00") + 180
+
+
+def test_nothing_to_predict():
+    store, stop_rows = store_with_trip(("A", "08:00:00"), ("B", "08:10:00"))
+    assert propagate_trip(store, 0, updates(("X", "08:00:00", 60)), stop_rows) is None
+    assert propagate_trip(store, 0, updates(("A", "08:00:00", 0), ("B", "08:10:00", 0)), stop_rows) is None
+
+
+def test_propagator_recomputes_only_touched_vehicles():
+    store, _ = store_with_trip(("A", "08:00:00"), ("B", "08:10:00"), ("C", "08:20:00"))
+    vehicles = {"V": Vehicle("V", "T", DAY_START, 35.0, 33.0, updates(("A", "08:00:00", 60)))}
+    propagator = DelayPropagator()
+    first = propagator.update(store, vehicles)
+    assert first["V"].arrival_delay.tolist() == [60, 60]
+    assert propagator.update(store, vehicles, touched=set())["V"] is first["V"]
+    vehicles = {"V": Vehicle("V", "T", DAY_START, 35.0, 33.0, updates(("A", "08:00:00", 300)))}
+    assert propagator.update(store, vehicles, touched={"V"})["V"].arrival_delay.tolist() == [300, 300]
+    assert propagator.update(store, {}, touched={"V"}) == {}
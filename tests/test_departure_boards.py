@@ -0,0 +1,71 @@
+import os
+import sys
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from departure_boards import DepartureBoards, service_day_start
+from stop_times_store import StopTimesBuilder
+
+NICOSIA = ZoneInfo("Asia/Nicosia")
+
+
+def test_ordinary_day_starts_at_midnight():
+    assert service_day_start(date(2026, 6, 1), NICOSIA) == datetime(2026, 6, 1, tzinfo=NICOSIA)
+
+
+def test_spring_forward_day_starts_an_hour_before_midnight():
+    # Clocks go 03:00 -> 04:00 on 2026-03-29: noon is +03:00, so noon - 12h is 23:00 (+02:00) the day before.
+    start = service_day_start(date(2026, 3, 29), NICOSIA)
+    assert start.timestamp() == datetime(2026, 3, 28, 23, tzinfo=NICOSIA).timestamp()
+    assert start.timestamp() + 12 * 3600 == datetime(2026, 3, 29, 12, tzinfo=NICOSIA).timestamp()
+
+
+def test_fall_back_day_starts_an_hour_after_midnight():
+    # Clocks go 04:00 -> 03:00 on 2026-10-25: noon is +02:00, so noon - 12h is 01:00 (+03:00).
+    start = service_day_start(date(2026, 10, 25), NICOSIA)
+    assert start.timestamp() == datetime(2026, 10, 25, 1, tzinfo=NICOSIA).timestamp()
+    assert start.timestamp() + 12 * 3600 == datetime(2026, 10, 25, 12, tzinfo=NICOSIA).timestamp()
+
+
+def boards_with_hourly_departures():
+    """One trip per hour from 05:00 to 23:00 at stop S, all on service "WK", running every day of 2026."""
+    builder = StopTimesBuilder()
+    trips = {}
+    for hour in range(5, 24):
+        trip_id = f"T{hour}"
+        builder.add(trip_id, "S", f"{hour:02d}:00:00", f"{hour:02d}:00:00", 1)
+        trips[trip_id] = {"route_id": "R", "service_id": "WK"}
+    service_dates = {}
+    day = date(2026, 1, 1)
+    while day.year == 2026:
+        service_dates[day.strftime("%Y%m%d")] = ["WK"]
+        day += timedelta(days=1)
+    return DepartureBoards(builder.build(), trips, {"R": {"route_short_name": "1"}}, service_dates, NICOSIA)
+
+
+def test_next_departures_on_ordinary_day():
+    boards = boards_with_hourly_departures()
+    now = datetime(2026, 6, 1, 12, tzinfo=NICOSIA)
+    departures = boards.next_departures("S", now, n=2)
+    assert [d["trip_id"] for d in departures] == ["T12", "T13"]
+    assert departures[0]["scheduled_time"] == now.timestamp()
+
+
+def test_next_departures_on_spring_forward_day():
+    # Noon is 12h of elapsed time after the 23:00 day start, so the "12:00:00" trip leaves at 12:00 on the clock.
+    boards = boards_with_hourly_departures()
+    now = datetime(2026, 3, 29, 12, tzinfo=NICOSIA)
+    departures = boards.next_departures("S", now, n=2)
+    assert [d["trip_id"] for d in departures] == ["T12", "T13"]
+    assert departures[0]["scheduled_time"] == now.timestamp()
+
+
+def test_next_departures_on_fall_back_day():
+    # Noon is 12h of elapsed time after the 01:00 day start (03:00-04:00 happens twice), so again 12:00 on the clock.
+    boards = boards_with_hourly_departures()
+    now = datetime(2026, 10, 25, 12, tzinfo=NICOSIA)
+    departures = boards.next_departures("S", now, n=2)
+    assert [d["trip_id"] for d in departures] == ["T12", "T13"]
+    assert departures[0]["scheduled_time"] == now.timestamp()
@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feed_fetcher import FeedFetchError, FeedFetcher
+
+
+class StallingHandler(BaseHTTPRequestHandler):
+    """Sends the headers and half the body, then goes quiet."""
+
+    release = threading.Event()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "1000")
+        self.end_headers()
+        self.wfile.write(b"x" * 500)
+        self.wfile.flush()
+        self.release.wait(5)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stalling_url():
+    StallingHandler.release.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StallingHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/feed"
+    StallingHandler.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def test_body_that_stalls_counts_as_a_timeout(stalling_url):
+    fetcher = FeedFetcher(stalling_url, read_timeout=0.2, retries=1, backoff=0)
+    with pytest.raises(FeedFetchError):
+        fetcher.fetch()
+    stats = fetcher.stats_snapshot()
+    assert stats["requests"] == 2 and stats["retries"] == 1 and stats["failures"] == 1
+    assert stats["errors"] == 2 and stats["timeouts"] == 2
+    assert stats["last_error"].startswith("ConnectionError")
+
+
+def test_refused_connection_is_not_a_timeout():
+    fetcher = FeedFetcher("http://127.0.0.1:9/feed", retries=0)
+    with pytest.raises(FeedFetchError):
+        fetcher.fetch()
+    stats = fetcher.stats_snapshot()
+    assert stats["errors"] == 1 and stats["timeouts"] == 0
@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def test_update_requests_share_one_refresh(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_refresh(channel=None):
+        calls.append(threading.current_thread())
+        started.set()
+        release.wait(5)
+
+    state = SimpleNamespace(state_manager=SimpleNamespace(live_feed_state={"vehicles": {}, "version": 3}))
+    monkeypatch.setattr(main, "runtime", state)
+    monkeypatch.setattr(main, "refresh_feed", slow_refresh)
+    monkeypatch.setattr(main, "feed_update_thread", None)
+    monkeypatch.setattr(main, "shared_update_request", None)
+
+    with main.app.test_request_context("/bus_state/update"):
+        response, status = main.request_feed_update()
+        assert status == 202 and response.get_json()["version"] == 3
+        assert started.wait(5)
+        # Polls while the refresh runs are answered by it, not queued behind it on the request thread.
+        for _ in range(5):
+            assert main.request_feed_update()[1] == 202
+        assert len(calls) == 1 and calls[0] is not threading.current_thread()
+
+        release.set()
+        calls[0].join(5)
+        assert not main.one_off_refresh.locked()
+        started.clear()
+        main.request_feed_update()
+        assert started.wait(5) and len(calls) == 2
+        calls[1].join(5)
@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import HistoryStore
+from live_feed import FeedChanges, StopTimeUpdates, Vehicle
+
+# 2026-03-01 00:00 UTC: days long closed, so their on-time totals are memoized.
+DAY = 1772323200
+TRIPS = {"T1": {"route_id": "R1"}, "T2": {"route_id": "R2"}}
+
+
+def run_trip(store, vehicle_id, trip_id, start, delays, version=1):
+    """Writes one vehicle leaving stops S0, S1, ... every 10 minutes from start with these delays."""
+    previous = {}
+    for n, delay in enumerate(delays + [None]):
+        vehicles = {}
+        if delay is not None:
+            departure = start + 600 * n + delay
+            updates = StopTimeUpdates([f"S{n}"], [departure], [delay], [departure], [delay])
+            vehicles[vehicle_id] = Vehicle(vehicle_id, trip_id, departure - 60, 35.0 + n / 100, 33.0, updates)
+        changes = FeedChanges(vehicles, set(vehicles) - set(previous), set(vehicles) & set(previous),
+                              set(previous) - set(vehicles))
+        store.write([(version, start + 600 * n, changes, TRIPS)])
+        previous = vehicles
+        version += 1
+    return version
+
+
+def test_on_time_totals_across_days(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    run_trip(store, "V1", "T1", DAY + 3600, [-120, 0, 60])
+    run_trip(store, "V1", "T1", DAY + 86400 + 3600, [400, 30])
+    assert len(store.partitions()) == 2
+
+    for _ in range(2):  # the second pass reads the memoized day totals
+        report = store.on_time("R1", DAY, DAY + 2 * 86400)
+        assert (report["departures"], report["early"], report["on_time"], report["late"]) == (5, 1, 3, 1)
+        assert report["max_delay"] == 400
+        assert report["mean_delay"] == (-120 + 0 + 60 + 400 + 30) / 5
+    assert store.on_time("R1", DAY, DAY + 2 * 86400, stop_id="S0")["departures"] == 2
+    assert store.on_time("R1", DAY, DAY + 86400, late=30)["late"] == 1
+    empty = store.on_time("R9", DAY, DAY + 2 * 86400)
+    assert empty["departures"] == 0 and empty["on_time_ratio"] is None and empty["max_delay"] is None
+
+
+def test_max_delay_of_a_route_that_only_ran_early(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    run_trip(store, "V2", "T2", DAY + 3600, [-300, -120])
+    assert store.on_time("R2", DAY, DAY + 86400)["max_delay"] == -120
+
+
+def test_trail_limit_is_clamped(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    run_trip(store, "V1", "T1", DAY + 3600, [0, 0, 0, 0])
+    full = store.trail(DAY, DAY + 86400, vehicle_id="V1")
+    assert len(full) == 4 and full == sorted(full)
+    assert store.trail(DAY, DAY + 86400, vehicle_id="V1", limit=2) == full[:2]
+    # SQLite reads a negative LIMIT as no limit at all.
+    assert store.trail(DAY, DAY + 86400, vehicle_id="V1", limit=-1) == full[:1]
+    assert store.trail(DAY, DAY + 86400, vehicle_id="V1", limit=0) == full[:1]
+    assert store.trail(DAY, DAY + 86400, trip_id="T1") == full
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.transit import gtfs_realtime_pb2
+
+from live_feed import FeedMerger
+
+
+def feed_with_delay(delay):
+    """One vehicle's trip update with two stops, always stamped 1000; only the delays vary."""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = 1000
+    entity = feed.entity.add(id="1")
+    trip = entity.trip_update
+    trip.trip.trip_id = "T1"
+    trip.vehicle.id = "V1"
+    trip.timestamp = 1000
+    for n, stop_id in enumerate(["S1", "S2"]):
+        update = trip.stop_time_update.add(stop_id=stop_id)
+        update.arrival.time = update.departure.time = 2000 + 600 * n + delay
+        update.arrival.delay = update.departure.delay = delay
+    return feed
+
+
+def test_unchanged_feed_reuses_vehicle():
+    merger = FeedMerger()
+    first = merger.merge(feed_with_delay(60)).vehicles["V1"]
+    changes = merger.merge(feed_with_delay(60))
+    assert not changes.changed and not changes.added
+    assert changes.vehicles["V1"] is first
+
+
+def test_delay_only_revision_is_a_change():
+    merger = FeedMerger()
+    merger.merge(feed_with_delay(60))
+    changes = merger.merge(feed_with_delay(180))
+    assert changes.changed == {"V1"}
+    assert changes.vehicles["V1"].updates.arrival_delay.tolist() == [180, 180]
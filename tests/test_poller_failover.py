@@ -0,0 +1,77 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.transit import gtfs_realtime_pb2
+
+from bus_app_state import BusAppStateManager
+from live_feed import FeedMerger
+from shared_state import LiveStateChannel
+
+STATIC = {"stops": {}, "trips": {"TA": {"route_id": "R"}, "TB": {"route_id": "R"}},
+          "routes": {"R": {"route_short_name": "1"}}}
+
+
+def feed(timestamp, *vehicle_ids):
+    """Each vehicle V on trip TV, calling at stop S."""
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = "2.0"
+    message.header.timestamp = timestamp
+    for vehicle_id in vehicle_ids:
+        trip = message.entity.add(id=vehicle_id).trip_update
+        trip.trip.trip_id = f"T{vehicle_id}"
+        trip.vehicle.id = vehicle_id
+        trip.timestamp = timestamp
+        update = trip.stop_time_update.add(stop_id="S")
+        update.arrival.time = update.departure.time = timestamp + 300
+    return message
+
+
+def manager():
+    return BusAppStateManager(dict(STATIC), {"vehicles": {}, "stop_index": {}, "version": 0})
+
+
+def poll(merger, state, channel, message):
+    """What the poller's refresh_feed does with one fetched feed."""
+    changes = merger.merge(message)
+    state.publish_feed(changes.vehicles, changes, feed_timestamp=message.header.timestamp)
+    live = state.live_feed_state
+    channel.publish(live["version"], changes.vehicles, changes, live["feed_timestamp"])
+
+
+def follow(state, channel):
+    """What a follower's apply_shared_state does with the channel."""
+    version, vehicles, changes, feed_timestamp = channel.poll()
+    current = state.live_feed_state["version"]
+    state.publish_feed(vehicles, changes if version == current + 1 else None, version=version,
+                       feed_timestamp=feed_timestamp)
+
+
+def stop_vehicles(state):
+    return sorted(vehicle.vehicle_id for vehicle, _ in state.live_feed_state["stop_index"].get("S", ()))
+
+
+def run_takeover(tmp_path, seed):
+    channel = LiveStateChannel(str(tmp_path / "live_state.json"))
+    other_channel = LiveStateChannel(channel.path)
+    poller, follower, other = manager(), manager(), manager()
+    poll(FeedMerger(), poller, channel, feed(1000, "A", "B"))
+    follow(follower, channel)
+    follow(other, other_channel)
+
+    # The poller dies; B leaves the feed before the follower, now elected, polls.
+    merger = FeedMerger()
+    if seed:
+        merger.seed(follower.live_feed_state["vehicles"])
+    poll(merger, follower, channel, feed(1030, "A"))
+    follow(other, other_channel)
+    return follower, other
+
+
+def test_seeded_new_poller_removes_vehicles_that_left_before_takeover(tmp_path):
+    for state in run_takeover(tmp_path, seed=True):
+        assert stop_vehicles(state) == ["A"]
+        assert state.live_feed_state["route_vehicles"] == {"R": ["A"]}
+        assert state.live_feed_state["version"] == 2
+
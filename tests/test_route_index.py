@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from live_feed import NO_UPDATES, Vehicle
+from route_index import RouteIndex, build_route_vehicles, merge_patterns, update_route_vehicles
+from stop_times_store import StopTimesBuilder
+
+
+def test_short_turn_pattern_adds_nothing():
+    assert merge_patterns([("A", "B", "C", "D"), ("B", "C")]) == ["A", "B", "C", "D"]
+
+
+def test_branch_stop_goes_after_the_last_shared_stop():
+    assert merge_patterns([("A", "B", "C", "D"), ("A", "B", "X", "D")]) == ["A", "B", "X", "C", "D"]
+
+
+def test_extensions_at_either_end():
+    assert merge_patterns([("B", "C", "D", "E"), ("A", "B", "C")]) == ["A", "B", "C", "D", "E"]
+    assert merge_patterns([("A", "B", "C"), ("C", "D")]) == ["A", "B", "C", "D"]
+
+
+def test_loop_matches_the_visit_ahead():
+    # Both patterns return to A; E follows the second visit, not the first.
+    assert merge_patterns([("A", "B", "C", "A", "D"), ("A", "B", "C", "A", "E")]) == ["A", "B", "C", "A", "E", "D"]
+
+
+def index():
+    builder = StopTimesBuilder()
+    for trip_id, stops in (("T1", "ABCD"), ("T2", "BC"), ("T3", "DCBA")):
+        for sequence, stop_id in enumerate(stops, 1):
+            builder.add_parsed(trip_id, stop_id, 3600 * sequence, 3600 * sequence, sequence)
+    routes = {"R1": {"route_short_name": "30"}, "R2": {"route_short_name": "30"}}
+    trips = {"T1": {"route_id": "R1"}, "T2": {"route_id": "R1"}, "T3": {"route_id": "R2"}}
+    return RouteIndex(routes, trips, builder.build())
+
+
+def test_route_index():
+    routes = index()
+    assert routes.route_trips == {"R1": ("T1", "T2"), "R2": ("T3",)}
+    assert routes.route_stops == {"R1": ("A", "B", "C", "D"), "R2": ("D", "C", "B", "A")}
+    assert routes.resolve("R2") == ("R2",)
+    assert routes.resolve("30") == ("R1", "R2")
+    assert routes.resolve("31") == ()
+
+
+def test_update_route_vehicles_matches_a_rebuild():
+    trip_routes = index().trip_routes
+    old = {v: Vehicle(v, trip, 0, 35.0, 33.0, NO_UPDATES) for v, trip in (("V1", "T1"), ("V2", "T2"), ("V3", "T3"))}
+    # V1 moves along its trip, V2 switches route, V3 leaves, V4 joins.
+    new = {"V1": Vehicle("V1", "T1", 30, 35.1, 33.0, NO_UPDATES), "V2": Vehicle("V2", "T3", 30, 35.0, 33.0, NO_UPDATES),
+           "V4": Vehicle("V4", "T2", 30, 35.0, 33.0, NO_UPDATES)}
+    before = build_route_vehicles(old, trip_routes)
+    after = update_route_vehicles(before, old, new, {"V1", "V2", "V3", "V4"}, trip_routes)
+    rebuilt = build_route_vehicles(new, trip_routes)
+    assert {r: sorted(v) for r, v in after.items()} == {r: sorted(v) for r, v in rebuilt.items()}
+    assert before == {"R1": ["V1", "V2"], "R2": ["V3"]}
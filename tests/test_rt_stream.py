@@ -0,0 +1,48 @@
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.transit import gtfs_realtime_pb2
+
+from feed_recorder import FeedRecorder, log_files
+from rt_stream import NdjsonWriter, convert_file, is_recorder_log
+
+
+def payload():
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = 1772323200
+    vehicle = feed.entity.add(id="1").vehicle
+    vehicle.vehicle.id = "5523"
+    vehicle.trip.trip_id = "T1"
+    vehicle.timestamp = 1772323190
+    vehicle.position.latitude, vehicle.position.longitude = 34.86, 33.39
+    trip = feed.entity.add(id="2").trip_update
+    trip.trip.trip_id = "T1"
+    trip.vehicle.id = "5523"
+    trip.stop_time_update.add(stop_id="7973").arrival.time = 1772323500
+    return feed.SerializeToString()
+
+
+def convert(path):
+    out = io.StringIO()
+    report = convert_file(str(path), NdjsonWriter(out))
+    return report, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_recorder_log_converts_like_the_raw_feed(tmp_path):
+    raw = tmp_path / "feed.pb"
+    raw.write_bytes(payload())
+    FeedRecorder(str(tmp_path / "recordings")).record(payload(), fetched_at=1772323201.5)
+    log = log_files(str(tmp_path / "recordings"))[0]
+
+    assert is_recorder_log(log) and not is_recorder_log(str(raw))
+    raw_report, raw_records = convert(raw)
+    log_report, log_records = convert(log)
+    assert log_report["records"] == 1
+    assert log_report["entities"] == raw_report["entities"] == 2
+    assert log_records == raw_records
+    assert log_records[0]["vehicle"]["vehicle_id"] == "5523"
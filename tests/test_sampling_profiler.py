@@ -0,0 +1,47 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sampling_profiler import MIN_INTERVAL, SamplingProfiler
+
+
+@pytest.mark.parametrize("interval", [-1, 0, float("nan"), float("inf"), MIN_INTERVAL / 2])
+def test_start_rejects_unusable_intervals(interval):
+    profiler = SamplingProfiler()
+    with pytest.raises(ValueError):
+        profiler.start(interval)
+    assert not profiler.running and profiler.interval == 0.01
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_report_while_sampling():
+    profiler = SamplingProfiler()
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop,), daemon=True)
+    worker.start()
+    try:
+        assert profiler.start(MIN_INTERVAL)
+        assert not profiler.start()
+        deadline = time.monotonic() + 5
+        reports = []
+        # Reading while the sampler thread adds stacks must not raise "dictionary changed size".
+        while time.monotonic() < deadline and profiler.sample_count < 50:
+            reports.append(profiler.report(limit=5))
+        assert profiler.stop()
+    finally:
+        stop.set()
+        worker.join(5)
+    assert not profiler.stop()
+    status = profiler.status()
+    assert status["samples"] >= 1 and status["interval"] == MIN_INTERVAL and status["stopped_at"] is not None
+    assert "busy (test_sampling_profiler.py:" in profiler.report()
+    assert all(len(report.splitlines()) <= 5 for report in reports)
@@ -0,0 +1,81 @@
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial_index import METERS_PER_DEGREE, GridIndex, check_coordinates, parse_bbox, parse_point
+
+
+def brute_force(points, lat, lon, n):
+    cos_lat = math.cos(math.radians(lat))
+    distances = sorted((math.hypot((p_lon - lon) * METERS_PER_DEGREE * cos_lat,
+                                   (p_lat - lat) * METERS_PER_DEGREE), item) for p_lat, p_lon, item in points)
+    return distances[:n]
+
+
+def random_points(count, seed=1):
+    rng = random.Random(seed)
+    # Clustered around a few towns with empty cells between them, like the stops.
+    towns = [(34.68, 33.04), (34.92, 33.63), (35.17, 33.36)]
+    points = []
+    for i in range(count):
+        lat, lon = rng.choice(towns)
+        points.append((lat + rng.gauss(0, 0.03), lon + rng.gauss(0, 0.03), i))
+    return points
+
+
+def test_nearest_matches_brute_force():
+    points = random_points(2000)
+    index = GridIndex(points)
+    rng = random.Random(2)
+    for _ in range(200):
+        lat, lon = rng.uniform(34.6, 35.25), rng.uniform(32.95, 33.7)
+        n = rng.choice((1, 5, 20))
+        expected = [item for _, item in brute_force(points, lat, lon, n)]
+        assert [item for _, item in index.nearest(lat, lon, n)] == expected
+
+
+def test_nearest_from_outside_the_occupied_extent():
+    points = random_points(500)
+    index = GridIndex(points)
+    for lat, lon in ((51.5, -0.12), (-33.9, 151.2), (34.0, 33.3)):
+        got = index.nearest(lat, lon, 3)
+        expected = brute_force(points, lat, lon, 3)
+        assert [item for _, item in got] == [item for _, item in expected]
+        assert got[0][0] == pytest.approx(expected[0][0])
+
+
+def test_nearest_edge_cases():
+    assert GridIndex([]).nearest(35.0, 33.0) == []
+    index = GridIndex([(35.0, 33.0, "A"), (None, 33.0, "skipped")])
+    assert len(index) == 1
+    assert index.nearest(35.0, 33.0, 0) == []
+    assert index.nearest(35.0, 33.0, 5) == [(0.0, "A")]
+
+
+@pytest.mark.parametrize("lat, lon", [(float("nan"), 33.0), (35.0, float("inf")), (90.5, 33.0), (35.0, -180.1)])
+def test_check_coordinates_rejects_unusable_points(lat, lon):
+    with pytest.raises(ValueError):
+        check_coordinates(lat, lon)
+
+
+@pytest.mark.parametrize("value", ["nan,33", "35,inf", "91,33", "35", "35,33,1", "north,east"])
+def test_parse_point_rejects(value):
+    with pytest.raises(ValueError):
+        parse_point(value)
+
+
+@pytest.mark.parametrize("value", ["33,35,nan,35.1", "33,35,33.1,-inf", "33,35,181,35.1", "33.1,35,33,35.1",
+                                   "33,35.1,33.1,35", "33,35,33.1"])
+def test_parse_bbox_rejects(value):
+    with pytest.raises(ValueError):
+        parse_bbox(value)
+
+
+def test_parse_valid_values():
+    assert parse_point("35.1,33.4") == (35.1, 33.4)
+    assert parse_bbox("33,35,33.1,35.1") == (35.0, 33.0, 35.1, 33.1)
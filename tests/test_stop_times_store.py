@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stop_times_store import StopTimesBuilder, merge_stores
+
+FEED_A = [("T1", "S1", "08:00:00", 1), ("T1", "S2", "08:10:00", 2), ("T2", "S2", "09:00:00", 1)]
+FEED_B = [("T3", "S3", "10:00:00", 1), ("T3", "S1", "10:20:00", 2)]
+# Feed C reuses trip id T1 (with other stops) as separate agencies' feeds sometimes do.
+FEED_C = [("T1", "S4", "11:00:00", 3), ("T4", "S4", "12:00:00", 1)]
+
+
+def build(*feeds):
+    builder = StopTimesBuilder()
+    for feed in feeds:
+        for trip_id, stop_id, time, sequence in feed:
+            builder.add(trip_id, stop_id, time, time, sequence)
+    return builder.build()
+
+
+def rows(store):
+    """Every trip's rows as (stop_id, arrival, departure, stop_sequence), by trip id."""
+    return {trip_id: [(r["stop_id"], r["arrival_time"], r["departure_time"], r["stop_sequence"])
+                      for r in store.trip(trip_id)] for trip_id in store.trip_ids}
+
+
+def test_merge_without_collisions_concatenates():
+    merged = merge_stores([build(FEED_A), build(FEED_B)])
+    single = build(FEED_A, FEED_B)
+    assert merged.trip_ids == single.trip_ids == ["T1", "T2", "T3"]
+    assert merged.stop_ids == single.stop_ids
+    assert rows(merged) == rows(single)
+    assert list(merged.trip_start) == list(single.trip_start)
+
+
+def test_merge_with_colliding_trip_ids_keeps_rows_of_every_feed():
+    merged = merge_stores([build(FEED_A), build(FEED_B), build(FEED_C)])
+    single = build(FEED_A, FEED_B, FEED_C)
+    assert merged.trip_ids == single.trip_ids == ["T1", "T2", "T3", "T4"]
+    assert rows(merged) == rows(single)
+    assert [row[0] for row in rows(merged)["T1"]] == ["S1", "S2", "S4"]
+    assert len(merged) == len(FEED_A) + len(FEED_B) + len(FEED_C)
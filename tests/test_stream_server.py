@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from live_feed import NO_UPDATES, Vehicle
+from stream_server import StreamHub
+
+
+def frame_data(frame):
+    return json.loads(frame.split(b"\ndata: ", 1)[1])
+
+
+def hub_with_versions():
+    hub = StreamHub()
+    hub.update(1, {"A": Vehicle("A", "TA", 100, 35.0, 33.0, NO_UPDATES),
+                   "B": Vehicle("B", "TB", 100, 35.1, 33.1, NO_UPDATES)})
+    hub.update(2, {"A": Vehicle("A", "TA", 130, 35.01, 33.0, NO_UPDATES)})
+    return hub
+
+
+def test_client_one_version_behind_gets_the_delta():
+    delta = frame_data(hub_with_versions().frame_after(1))
+    assert delta["since"] == 1 and delta["version"] == 2
+    assert [v["vehicle_id"] for v in delta["moved"]] == ["A"]
+    assert delta["removed"] == ["B"] and delta["added"] == []
+
+
+def test_new_or_lagging_client_gets_the_snapshot():
+    for sent in (None, 0):
+        snapshot = frame_data(hub_with_versions().frame_after(sent))
+        assert snapshot["full"] and snapshot["version"] == 2
+        assert [v["vehicle_id"] for v in snapshot["vehicles"]] == ["A"]
+
+
+def test_up_to_date_client_gets_nothing():
+    assert hub_with_versions().frame_after(2) is None
+